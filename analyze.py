@@ -3,26 +3,70 @@
 """Analyze codon usage statistics.
 
 Usage:
-  analyze.py basic <stats-path> --ref-codon-usage <ref-path>
-  analyze.py plot <stats-path>
+  analyze.py basic <stats-path> --ref-codon-usage <ref-path> [--running]
+  analyze.py plot (<stats-path> | --cds-stats=<dir>) [--output=<path>]
+                  [--export=<path>] [--chunk-size=<mib>] [--seed=<n>]
   analyze.py manova <stats-path>
+  analyze.py permutation <stats-path> [--permutations=<n>] [--bootstrap=<n>]
+                         [--batch-size=<n>] [--workers=<n>] [--seed=<n>]
+  analyze.py import <stats-path> <store-path>
+  analyze.py rebuild-aggregate <store-path>
   analyze.py (-h | --help)
 
+<stats-path> is either a directory with <population>/<sample>.json files or a
+stats store (see cdnu.store). The import command appends samples from a stats
+directory or a tar archive (e.g. stats.tar.gz) to a stats store. A stats
+store keeps running statistics which are updated with each added sample, the
+basic command reads only them with --running and rebuild-aggregate recomputes
+them from all samples.
+
+The plot command projects samples to the first two principal components of
+their codon usage and saves the plot to a file. The matrix of samples is read
+in chunks of rows, thus it does not need to fit to memory.
+
 Options:
-  -h --help     Show this screen.
+  -h --help           Show this screen.
+  --permutations=<n>  Number of random permutations of population labels
+                      [default: 10000].
+  --bootstrap=<n>     Number of bootstrap resamples used to compute
+                      confidence intervals of effect sizes, 0 disables the
+                      intervals [default: 1000].
+  --batch-size=<n>    Number of permutations or resamples in a single batch
+                      [default: 1000].
+  --workers=<n>       Number of processes evaluating batches [default: 1].
+  --seed=<n>          Seed of the random generator [default: 0].
+  --running           Read running statistics instead of computing variances
+                      exactly from all samples, the variances may differ in
+                      the last printed digits.
+  --cds-stats=<dir>   Directory with per CDS codon counts of samples stored
+                      as <population>/<sample>.npz (see --per-cds of
+                      codon_usage.py), usage of each codon in each CDS is
+                      then a feature of the plotted samples.
+  --output=<path>     File the plot is saved to [default: pca.png].
+  --export=<path>     Store means, components, explained variances and
+                      projected samples to an .npz file.
+  --chunk-size=<mib>  Approximate size of matrix rows read at once in MiB
+                      [default: 256].
 """
 
 import json
 import os
-import statistics
 from collections import defaultdict
+from functools import partial
 from itertools import product
 
-import matplotlib.pyplot as plt
 import numpy as np
-import scipy.stats as stats
 from docopt import docopt
-from sklearn.decomposition import PCA
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from cdnu.cds_counts import load_cds_counts
+from cdnu.codons import CODONS
+from cdnu.kruskal import (bootstrap_effect_sizes, kruskal_columns,
+                          permutation_test)
+from cdnu.pca import randomized_pca
+from cdnu.store import (Aggregate, SampleMatrix, import_stats, is_store,
+                        load_aggregate, load_store, rebuild_aggregate)
 
 
 def main(arguments):
@@ -32,35 +76,33 @@ def main(arguments):
         plot(arguments)
     elif arguments['manova']:
         manova(arguments)
+    elif arguments['permutation']:
+        permutation(arguments)
+    elif arguments['import']:
+        import_command(arguments)
+    elif arguments['rebuild-aggregate']:
+        rebuild_aggregate_command(arguments)
 
 
-def manova(arguments):
-    stats_path = arguments['<stats-path>']
-    samples = load_samples(stats_path)
-    normalized = normalize_all(samples)
-
-    accepted_triplets = []
-
-    for triplet in product('ATCG', repeat=3):
-        triplet = ''.join(triplet)
-
-        if triplet in ('TGA', 'TAA', 'TAG'):
-            # skip stop codons
-            continue
+def import_command(arguments):
+    num_samples = import_stats(arguments['<stats-path>'],
+                               arguments['<store-path>'])
+    print(f'Imported {num_samples} samples.')
 
-        groups = []
-        for population in normalized.values():
-            group = []
-            groups.append(group)
 
-            for individual in population.values():
-                group.append(individual[triplet])
-
-        kruskal = stats.kruskal(*groups)
+def manova(arguments):
+    stats_path = arguments['<stats-path>']
+    matrix = load_matrix(stats_path)
+    columns, data = usage_without_stop_codons(matrix)
+    _, pvalues = kruskal_columns(data, matrix.populations,
+                                 len(matrix.population_names))
+
+    accepted_triplets = [
+        (pvalue, CODONS[column])
+        for column, pvalue in zip(columns, pvalues.tolist())
         # Use Bonferroni correction
-        if kruskal.pvalue < 0.05 / 61:
-            accepted_triplets.append((kruskal.pvalue, triplet))
-
+        if pvalue < 0.05 / 61
+    ]
     accepted_triplets.sort()
 
     print_title('Triplets with Differing Usage Among Populations')
@@ -73,80 +115,243 @@ def manova(arguments):
     print('+---------+---------+')
 
 
-def plot(arguments):
+def permutation(arguments):
     stats_path = arguments['<stats-path>']
-    samples = load_samples(stats_path)
-    normalized = normalize_all(samples)
-
-    data = np.array([
-        [v[''.join(t)] for t in product('ATCG', repeat=3)]
-        for i, p in enumerate(normalized.values()) for v in p.values()
-    ])
-    pca = PCA(n_components=2)
-    pca.fit(data)
+    permutations = int(arguments['--permutations'])
+    resamples = int(arguments['--bootstrap'])
+    assert permutations > 0
+    options = {
+        'batch_size': int(arguments['--batch-size']),
+        'seed': int(arguments['--seed']),
+        'workers': int(arguments['--workers']),
+    }
 
-    print_title('Explained Variance by Selected Components')
-    print(f' * PC1: {pca.explained_variance_ratio_[0] * 100:0.0f}%')
-    print(f' * PC2: {pca.explained_variance_ratio_[1] * 100:0.0f}%')
+    matrix = load_matrix(stats_path)
+    num_groups = len(matrix.population_names)
+    columns, data = usage_without_stop_codons(matrix)
+
+    result = permutation_test(data, matrix.populations, num_groups,
+                              permutations, **options)
+    effect_sizes = result.h / (len(data) - 1)
+    if resamples:
+        lower, upper = bootstrap_effect_sizes(
+            data, matrix.populations, num_groups, resamples, **options)
+
+    print_title('Permutation Test of Differing Usage Among Populations')
+    print(f'{permutations} permutations, p-values adjusted with the '
+          f'max-statistic method, effect size is epsilon squared.\n')
+
+    print('+---------+---------+----------+-------------+------------------+')
+    print('| triplet | p-value | adjusted | effect size | 95% CI           |')
+    print('+---------+---------+----------+-------------+------------------+')
+    order = sorted(range(len(columns)),
+                   key=lambda i: (result.pvalues[i], -result.h[i]))
+    for i in order:
+        interval = (f'{lower[i]:0.4f} - {upper[i]:0.4f}' if resamples
+                    else ' ' * 15)
+        print(f'| {CODONS[columns[i]]}     | {result.pvalues[i]:0.1e} '
+              f'| {result.adjusted_pvalues[i]:0.1e}  '
+              f'| {effect_sizes[i]:0.4f}      | {interval}  |')
+    print('+---------+---------+----------+-------------+------------------+')
+
+
+def usage_without_stop_codons(matrix):
+    """Return indexes of non-stop codons and (samples x codons) matrix of
+    their normalized usage."""
+    columns = [i for i, t in enumerate(CODONS)
+               if t not in ('TGA', 'TAA', 'TAG')]
+    return columns, normalize_all(matrix)[:, columns]
 
-    for population, individuals in normalized.items():
-        population_data = np.array([
-            [v[''.join(t)] for t in product('ATCG', repeat=3)]
-            for v in individuals.values()
-        ])
-        population_data = pca.transform(population_data)
 
-        plt.scatter(population_data[:, 0], population_data[:, 1])
+def plot(arguments):
+    chunk_bytes = int(float(arguments['--chunk-size']) * 2**20)
+    if arguments['--cds-stats']:
+        matrix = CdsUsageMatrix(arguments['--cds-stats'])
+        row_chunks = partial(matrix.iter_chunks,
+                             max(1, chunk_bytes // (matrix.num_features * 8)))
+        oversamples = 10
+    else:
+        matrix = load_matrix(arguments['<stats-path>'])
+        row_chunks = partial(iter_usage_chunks, matrix.counts,
+                             max(1, chunk_bytes // (len(CODONS) * 8)))
+        # With as many random vectors as codons the result is exact.
+        oversamples = len(CODONS)
+
+    pca = randomized_pca(row_chunks, oversamples=oversamples,
+                         seed=int(arguments['--seed']))
 
-    plt.xlabel('PC1')
-    plt.ylabel('PC2')
-    plt.show()
+    print_title('Explained Variance by Selected Components')
+    print(f' * PC1: {pca.explained_variance_ratio[0] * 100:0.0f}%')
+    print(f' * PC2: {pca.explained_variance_ratio[1] * 100:0.0f}%')
+
+    if arguments['--export']:
+        np.savez(arguments['--export'],
+                 sample_names=np.array(matrix.sample_names),
+                 populations=np.array(matrix.population_names)[
+                     matrix.populations],
+                 **pca._asdict())
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(1, 1, 1)
+    for population, name in enumerate(matrix.population_names):
+        population_data = pca.embedding[matrix.populations == population]
+        axes.scatter(population_data[:, 0], population_data[:, 1],
+                     label=name, s=8)
+    axes.set_xlabel('PC1')
+    axes.set_ylabel('PC2')
+    axes.legend(fontsize='xx-small', ncol=2)
+    figure.savefig(arguments['--output'])
+
+
+def iter_usage_chunks(counts, chunk_rows):
+    """Yield normalized codon usage (see :func:`normalize_triplets`) of
+    consecutive chunks of rows of a (samples x 64) matrix of counts."""
+    for start in range(0, len(counts), chunk_rows):
+        yield normalize_triplets(counts[start:start + chunk_rows])
+
+
+class CdsUsageMatrix:
+    """(samples x (CDS * 64)) matrix of usage of each codon in each CDS
+    (normalized per CDS, see :func:`normalize_triplets`) of samples stored
+    as <population>/<sample>.npz per CDS codon counts. Usage of CDS which
+    are invalid or have no codons is zero. Samples are loaded only while
+    their rows are iterated.
+    """
+
+    def __init__(self, cds_stats_path: str):
+        samples = defaultdict(lambda: {})
+        for dirpath, dirnames, filenames in os.walk(cds_stats_path):
+            _, population = os.path.split(dirpath)
+            for filename in filenames:
+                sample_name, extension = os.path.splitext(filename)
+                # Skip files which are being stored.
+                if extension == '.npz' and not sample_name.endswith('.tmp'):
+                    samples[population][sample_name] = os.path.join(
+                        dirpath, filename)
+
+        self.population_names = sorted(samples.keys())
+        individuals = [
+            (population, sample_name, samples[name][sample_name])
+            for population, name in enumerate(self.population_names)
+            for sample_name in sorted(samples[name])
+        ]
+        self.sample_names = [s for _, s, _ in individuals]
+        self.populations = np.array([p for p, _, _ in individuals],
+                                    dtype=np.intp)
+        self.file_paths = [f for _, _, f in individuals]
+
+        if not self.file_paths:
+            raise ValueError(f'No samples found in {cds_stats_path}.')
+        self.ccds_ids = load_cds_counts(self.file_paths[0]).ccds_ids
+        self.num_features = len(self.ccds_ids) * len(CODONS)
+
+    def iter_chunks(self, chunk_rows):
+        """Yield consecutive chunks of at most :param:`chunk_rows` rows."""
+        for start in range(0, len(self.file_paths), chunk_rows):
+            paths = self.file_paths[start:start + chunk_rows]
+            chunk = np.empty((len(paths), self.num_features))
+            for row, file_path in zip(chunk, paths):
+                row[:] = self.load_usage(file_path).reshape(-1)
+            yield chunk
+
+    def load_usage(self, file_path):
+        """Return (CDS x 64) codon usage of a single sample."""
+        cds_counts = load_cds_counts(file_path)
+        if not np.array_equal(cds_counts.ccds_ids, self.ccds_ids):
+            raise ValueError(f'CDS of {file_path} differ from CDS of '
+                             f'{self.file_paths[0]}.')
+        counts = cds_counts.dense()
+        counts[~cds_counts.valid] = 0
+        with np.errstate(invalid='ignore'):
+            usage = normalize_triplets(counts)
+        return np.nan_to_num(usage, copy=False)
 
 
 def basic(arguments):
     stats_path = arguments['<stats-path>']
     ref_path = arguments['<ref-path>']
 
-    samples = load_samples(stats_path)
+    if arguments['--running']:
+        aggregate = load_aggregate_stats(stats_path)
+        mean_usage = aggregate.mean_usage()
+        total_variances = aggregate.total_variances()
+        population_variances = [
+            (population, variances)
+            for population, num_samples, variances in zip(
+                aggregate.population_names, aggregate.num_samples,
+                aggregate.variances())
+            if num_samples
+        ]
+    else:
+        matrix = load_matrix(stats_path)
+        mean_usage = normalize_triplets(matrix.counts.sum(axis=0))
+        total_variances, population_variances = compute_variances(matrix)
 
     with open(ref_path) as fp:
         ref_usage = json.load(fp)
 
-    mean_codon_usage = compute_mean_codon_usage(samples)
+    mean_codon_usage = dict(zip(CODONS, mean_usage.tolist()))
     print_mean_codon_usage(mean_codon_usage)
     print_mean_abs_diff(mean_codon_usage, ref_usage)
 
-    normalized = normalize_all(samples)
-    print_variances(normalized)
-
-
-def normalize_all(samples):
-    return {
-        population: {
-            sample_name: normalize_triplets(sample['triplets'])
-            for sample_name, sample in individuals.items()
-        }
-        for population, individuals in samples.items()
-    }
-
-
-def print_variances(data):
-    variances = {}
-    for triplet in generate_triplets():
-        variances[triplet] = statistics.variance(
-            s[triplet] for p in data.values() for s in p.values())
-
+    print_variances(total_variances, population_variances)
+
+
+def rebuild_aggregate_command(arguments):
+    store_path = arguments['<store-path>']
+    previous = load_aggregate(store_path)
+    aggregate = rebuild_aggregate(store_path)
+
+    print(f'Rebuilt statistics of {aggregate.num_samples.sum()} samples.')
+    if previous.population_names == aggregate.population_names:
+        difference = max(
+            max_abs_difference(previous.mean, aggregate.mean),
+            max_abs_difference(previous.variances(), aggregate.variances()))
+        print(f'Maximum difference from incrementally updated statistics: '
+              f'{difference:.3e}')
+    else:
+        print('Populations of incrementally updated statistics differ.')
+
+
+def max_abs_difference(first, second):
+    """Return the largest absolute difference of finite values, or 0."""
+    differences = np.abs(first - second)
+    differences = differences[np.isfinite(differences)]
+    return differences.max() if differences.size else 0.
+
+
+def compute_variances(matrix):
+    """Return sample variances of normalized codon usage (see
+    :func:`normalize_all`) of all samples and a list of (population,
+    variances) of samples of each population. Samples without any codons
+    are skipped, as in :class:`cdnu.store.Aggregate`."""
+    counted = matrix.counts.sum(axis=1) > 0
+    data = normalize_triplets(matrix.counts[counted])
+    populations = matrix.populations[counted]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total_variances = data.var(axis=0, ddof=1)
+        population_variances = [
+            (population, data[populations == index].var(axis=0, ddof=1))
+            for index, population in enumerate(matrix.population_names)
+            if np.any(populations == index)
+        ]
+    return total_variances, population_variances
+
+
+def normalize_all(matrix):
+    """Return (samples x 64) matrix of codon usage normalized per sample,
+    see :func:`normalize_triplets`."""
+    return normalize_triplets(matrix.counts)
+
+
+def print_variances(total_variances, population_variances):
     print_title('Individual Codon Usage Variances')
-    print_triplet_table(variances, '{:10.6f}')
-
-    for population, individuals in data.items():
-        variances = {}
-        for triplet in generate_triplets():
-            variances[triplet] = statistics.variance(
-                s[triplet] for s in individuals.values())
+    print_triplet_table(dict(zip(CODONS, total_variances)), '{:10.6f}')
 
+    for population, variances in population_variances:
         print_title('Codon Usage Variance in Population {}'.format(population))
-        print_triplet_table(variances, '{:10.6f}')
+        print_triplet_table(dict(zip(CODONS, variances)), '{:10.6f}')
 
 
 def print_mean_abs_diff(mean_codon_usage, ref_usage):
@@ -159,15 +364,6 @@ def print_mean_abs_diff(mean_codon_usage, ref_usage):
     print('{:.5f}'.format(mean_abs_diff))
 
 
-def compute_mean_codon_usage(samples: dict) -> dict:
-    codon_usage_sum = defaultdict(lambda: 0)
-    for individuals in samples.values():
-        for individual in individuals.values():
-            for triplet, usage in individual['triplets'].items():
-                codon_usage_sum[triplet] += usage
-    return normalize_triplets(codon_usage_sum)
-
-
 def print_mean_codon_usage(mean_codon_usage: dict):
     print_title('Mean Codon Usage')
     print_triplet_table(mean_codon_usage)
@@ -185,9 +381,48 @@ def print_triplet_table(data, fmt='{:4.1f}'):
         print('| ' + line + ' |')
 
 
-def normalize_triplets(triplets):
-    total_triplets = sum(triplets.values())
-    return {k: 1000 * v / total_triplets for k, v in triplets.items()}
+def normalize_triplets(counts):
+    """Normalize codon counts (the last axis) to usage per thousand
+    codons."""
+    counts = np.asarray(counts, dtype=np.float64)
+    return 1000 * counts / counts.sum(axis=-1, keepdims=True)
+
+
+def load_aggregate_stats(stats_path: str) -> Aggregate:
+    """Load running statistics of a stats store, or compute them from a
+    directory with <population>/<sample>.json files."""
+    if is_store(stats_path):
+        return load_aggregate(stats_path)
+    return Aggregate.from_matrix(load_matrix(stats_path))
+
+
+def load_matrix(stats_path: str) -> SampleMatrix:
+    """Load samples either from a stats store or from a directory with
+    <population>/<sample>.json files."""
+    if is_store(stats_path):
+        return load_store(stats_path)
+
+    samples = load_samples(stats_path)
+    population_names = list(samples.keys())
+    individuals = [
+        (population, sample_name, sample)
+        for population, population_samples in enumerate(samples.values())
+        for sample_name, sample in population_samples.items()
+    ]
+    return SampleMatrix(
+        counts=np.array([
+            [sample['triplets'][t] for t in CODONS]
+            for _, _, sample in individuals
+        ], dtype=np.uint64).reshape(-1, len(CODONS)),
+        sample_names=[sample_name for _, sample_name, _ in individuals],
+        populations=np.array([p for p, _, _ in individuals], dtype=np.intp),
+        population_names=population_names,
+        num_cds=np.array([s['numCds'] for _, _, s in individuals],
+                         dtype=np.int64),
+        num_processed_cds=np.array(
+            [s['numProcessedCds'] for _, _, s in individuals],
+            dtype=np.int64),
+    )
 
 
 def load_samples(stats_path: str) -> dict:
@@ -196,8 +431,11 @@ def load_samples(stats_path: str) -> dict:
     for dirpath, dirnames, filenames in os.walk(stats_path):
         _, population = os.path.split(dirpath)
         for filename in filenames:
+            sample_name, extension = os.path.splitext(filename)
+            # Skip other files, e.g. files being stored.
+            if extension != '.json':
+                continue
             with open(os.path.join(dirpath, filename)) as fp:
-                sample_name, _ = os.path.splitext(filename)
                 samples[population][sample_name] = json.load(fp)
 
     # Convert to dict
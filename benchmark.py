@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+"""Benchmark the CRAM to codon usage pipeline on synthetic data.
+
+Synthetic molecules with genes, their CCDS table, a CRAM file with reads
+tiled over the molecules and a stats store with random samples are generated
+to <work-dir> and reused by later runs with the same parameters. Each stage is
+run repeatedly and the fastest run is reported. Results are compared to
+baselines stored for the same parameters, the exit status is 1 if any stage
+is slower than its baseline by more than the tolerance.
+
+Usage:
+  benchmark.py [--genes=<n>] [--exons=<n>] [--coverage=<x>] [--samples=<n>]
+               [--repeat=<n>] [--work-dir=<path>] [--baselines=<path>]
+               [--tolerance=<t>] [--save-baselines]
+  benchmark.py (-h | --help)
+
+Options:
+  -h --help           Show this screen.
+  --genes=<n>         Number of genes [default: 500].
+  --exons=<n>         Number of exons of each gene [default: 4].
+  --coverage=<x>      Read coverage of the CRAM file [default: 10].
+  --samples=<n>       Number of samples in the stats store [default: 500].
+  --repeat=<n>        Number of runs of each stage [default: 3].
+  --work-dir=<path>   Directory with generated data [default: .benchmark].
+  --baselines=<path>  JSON file with baselines
+                      [default: benchmark_baselines.json].
+  --tolerance=<t>     Relative slowdown reported as a regression
+                      [default: 0.25].
+  --save-baselines    Store the results as new baselines.
+"""
+
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import time
+from contextlib import contextmanager, redirect_stdout
+
+import numpy as np
+from docopt import docopt
+
+import analyze
+import codon_usage
+from cdnu.ccds import load_ccds, parse_ccds
+from cdnu.codons import CODONS, CodonCounter
+from cdnu.cram import load_cds_list
+from cdnu.record import Record
+from cdnu.store import append_samples
+from cdnu.synthetic import random_genes, write_ccds, write_cram
+
+READ_LENGTH = 100
+NUM_POPULATIONS = 26
+MIN_SLOWDOWN = 0.01
+"""Shortest slowdown (in seconds) reported as a regression, shorter ones are
+considered to be noise."""
+
+
+def main(arguments):
+    genes = int(arguments['--genes'])
+    exons = int(arguments['--exons'])
+    coverage = float(arguments['--coverage'])
+    samples = int(arguments['--samples'])
+    repeat = int(arguments['--repeat'])
+    tolerance = float(arguments['--tolerance'])
+
+    config = 'genes={},exons={},coverage={:g},samples={}'.format(
+        genes, exons, coverage, samples)
+    work_dir = os.path.abspath(
+        os.path.join(arguments['--work-dir'], config.replace(',', '_')))
+    baselines_path = arguments['--baselines']
+
+    print('Generating data to {}...'.format(work_dir))
+    data = generate_data(work_dir, genes, exons, coverage, samples)
+
+    baselines = load_baselines(baselines_path)
+    results = {}
+    print_header()
+    for name, function, amount, unit in stages(data):
+        seconds = measure(function, repeat)
+        results[name] = round(seconds, 4)
+        print_result(name, seconds, amount, unit,
+                     baselines.get(config, {}).get(name), tolerance)
+
+    if arguments['--save-baselines']:
+        baselines[config] = results
+        with open(baselines_path, 'w', encoding='utf-8',
+                  newline='\n') as fp:
+            json.dump(baselines, fp, indent=2, sort_keys=True)
+            fp.write('\n')
+        print('\nBaselines stored to {}.'.format(baselines_path))
+        return
+
+    regressions = [
+        name for name, seconds in results.items()
+        if name in baselines.get(config, {})
+        and is_regression(seconds, baselines[config][name], tolerance)
+    ]
+    if regressions:
+        print('\nRegressions: {}'.format(', '.join(regressions)))
+        sys.exit(1)
+
+
+def generate_data(work_dir, genes, exons, coverage, samples):
+    """Generate (or reuse) benchmark data and return paths and sizes of the
+    data as a dict."""
+    ccds_file = os.path.join(work_dir, 'CCDS.txt')
+    cram_file = os.path.join(work_dir, 'sample.cram')
+    store_path = os.path.join(work_dir, 'stats.store')
+
+    if not os.path.exists(os.path.join(work_dir, 'complete')):
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+
+        rng = random.Random(1)
+        references, cds_list = random_genes(genes, exons, rng)
+        write_ccds(ccds_file, cds_list)
+        step = max(1, int(round(READ_LENGTH / coverage)))
+        write_cram(work_dir, references, read_length=READ_LENGTH, step=step)
+        write_store(store_path, samples)
+
+        with open(os.path.join(work_dir, 'complete'), 'w'):
+            pass
+
+    cds_list = parse_ccds(ccds_file)
+    return {
+        'work_dir': work_dir,
+        'ccds_file': ccds_file,
+        'cram_file': cram_file,
+        'store_path': store_path,
+        'cds_list': cds_list,
+        'num_bases': sum(b - a for c in cds_list for a, b in c.indexes),
+        'num_samples': samples,
+    }
+
+
+def write_store(store_path, num_samples):
+    """Write a stats store with random codon counts of samples from
+    :const:`NUM_POPULATIONS` populations."""
+    rng = np.random.RandomState(2)
+    usage = rng.dirichlet(np.ones(len(CODONS)), NUM_POPULATIONS)
+    samples = []
+    for i in range(num_samples):
+        population = i % NUM_POPULATIONS
+        counts = rng.multinomial(10 ** 7, usage[population])
+        samples.append(('POP{:02}'.format(population), 'S{}'.format(i), {
+            'triplets': dict(zip(CODONS, counts.tolist())),
+            'numCds': 1,
+            'numProcessedCds': 1,
+        }))
+    append_samples(store_path, samples)
+
+
+def stages(data):
+    """Return (name, function, amount, unit) of each benchmarked stage,
+    amount of processed units is used to compute throughput."""
+    work_dir = data['work_dir']
+    cds_list = data['cds_list']
+    num_bases = data['num_bases']
+    num_samples = data['num_samples']
+    cram_file = data['cram_file']
+    cache_dir = os.path.join(work_dir, 'ccds_cache')
+
+    def compile_ccds():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        load_ccds(data['ccds_file'], cache_dir)
+
+    loaded = load_cds_list(cram_file, cds_list)
+
+    def count_codons():
+        counter = CodonCounter()
+        for cds in loaded:
+            counter.add(cds)
+        counter.counts()
+
+    record = Record('', '', 'S0', 'POP00')
+
+    def analyze_record():
+        with working_directory(os.path.join(work_dir, 'run')):
+            codon_usage.analyze_record(cram_file, record, cds_list)
+
+    store_path = data['store_path']
+    ref_path = os.path.abspath('reference_codon_usage.json')
+
+    return [
+        ('parse_ccds', lambda: parse_ccds(data['ccds_file']),
+         len(cds_list), 'CDS'),
+        ('load_ccds (compile)', compile_ccds, len(cds_list), 'CDS'),
+        ('load_ccds (cached)', lambda: load_ccds(data['ccds_file'],
+                                                 cache_dir),
+         len(cds_list), 'CDS'),
+        ('load_cds_list', lambda: load_cds_list(cram_file, cds_list),
+         num_bases, 'bp'),
+        ('load_cds_list --streaming',
+         lambda: load_cds_list(cram_file, cds_list, streaming=True),
+         num_bases, 'bp'),
+        ('load_cds_list --consensus',
+         lambda: load_cds_list(cram_file, cds_list, streaming=True,
+                               consensus=True),
+         num_bases, 'bp'),
+        ('count codons', count_codons, num_bases, 'bp'),
+        ('analyze_record', analyze_record, num_bases, 'bp'),
+        ('analyze.py basic', lambda: run_analyze(
+            'basic', store_path, '--ref-codon-usage', ref_path),
+         num_samples, 'samples'),
+        ('analyze.py manova', lambda: run_analyze('manova', store_path),
+         num_samples, 'samples'),
+        ('analyze.py permutation', lambda: run_analyze(
+            'permutation', store_path, '--permutations=1000',
+            '--bootstrap=100'),
+         num_samples, 'samples'),
+        ('analyze.py plot', lambda: run_analyze(
+            'plot', store_path, '--output',
+            os.path.join(work_dir, 'pca.png')),
+         num_samples, 'samples'),
+    ]
+
+
+def run_analyze(*argv):
+    with redirect_stdout(io.StringIO()):
+        analyze.main(docopt(analyze.__doc__, argv=argv))
+
+
+@contextmanager
+def working_directory(path):
+    os.makedirs(path, exist_ok=True)
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def measure(function, repeat):
+    """Return the shortest duration of :param:`repeat` calls."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def load_baselines(baselines_path):
+    if not os.path.exists(baselines_path):
+        return {}
+    with open(baselines_path, encoding='utf-8') as fp:
+        return json.load(fp)
+
+
+def is_regression(seconds, baseline, tolerance):
+    return seconds - baseline > max(baseline * tolerance, MIN_SLOWDOWN)
+
+
+def print_header():
+    print()
+    print('{:28} {:>10} {:>20} {:>10} {:>8}'.format(
+        'stage', 'time [s]', 'throughput', 'baseline', 'change'))
+    print('-' * 80)
+
+
+def print_result(name, seconds, amount, unit, baseline, tolerance):
+    throughput = '{:.3g} {}/s'.format(amount / seconds, unit)
+    if baseline is None:
+        baseline_str = change_str = '-'
+    else:
+        change = seconds / baseline - 1
+        baseline_str = '{:.3f}'.format(baseline)
+        change_str = '{:+.0%}'.format(change)
+        if is_regression(seconds, baseline, tolerance):
+            change_str += ' !'
+    print('{:28} {:10.3f} {:>20} {:>10} {:>8}'.format(
+        name, seconds, throughput, baseline_str, change_str), flush=True)
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+    main(arguments)
@@ -1,6 +1,14 @@
-from typing import List, NamedTuple
+import hashlib
+import os
+import shutil
+from typing import Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
 
 CCDS_FILE = 'CCDS.current.txt'
+CACHE_DIR = '.ccds_cache'
+"""Directory with compiled CCDS files, see :func:`load_ccds_index`."""
+CACHE_VERSION = 2
 CHROMOSOMES = ('1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12',
                '13', '14', '15', '16', '17', '18', '19', '20', '21', '22',
                'X', 'Y')
@@ -15,14 +23,208 @@ class CdsPos(NamedTuple):
     sub-sequences."""
     molecule: str
     """Molecule name, see :const:`CHROMOSOMES`"""
+    strand: str = '+'
+    """Either + or -. CDS on the - strand is reverse complement of the
+    concatenation of the sub-sequences (which are in ascending order)."""
+
+
+CDS_DTYPE = np.dtype([
+    ('molecule', np.uint8),
+    ('exon_start', np.int64),
+    ('exon_stop', np.int64),
+    ('strand', 'S1'),
+])
+"""Compiled CDS: index of the chromosome in :const:`CHROMOSOMES`, range of
+the CDS exons in the exon array and strand."""
+EXON_DTYPE = np.dtype([('start', np.int64), ('stop', np.int64)])
+
+
+class CcdsIndex(NamedTuple):
+    """Compiled CCDS as (memory-mapped) NumPy arrays."""
+
+    ccds_ids: np.ndarray
+    """CCDS IDs as ASCII byte strings."""
+    cds: np.ndarray
+    """CDS with :const:`CDS_DTYPE`."""
+    exons: np.ndarray
+    """Exons of all CDS with :const:`EXON_DTYPE`."""
+
+    def cds_pos(self, index: int) -> CdsPos:
+        """Return a single CDS as :class:`CdsPos`."""
+        cds = self.cds[index]
+        exons = self.exons[cds['exon_start']:cds['exon_stop']]
+        return CdsPos(
+            ccds_id=self.ccds_ids[index].decode('ascii'),
+            indexes=list(zip(exons['start'].tolist(),
+                             exons['stop'].tolist())),
+            molecule='chr' + CHROMOSOMES[cds['molecule']],
+            strand=cds['strand'].decode('ascii'),
+        )
+
+    def to_cds_list(self, start: int = 0,
+                    stop: Optional[int] = None) -> List[CdsPos]:
+        """Return CDS (all by default) as a list of :class:`CdsPos`."""
+        cds = self.cds[start:stop]
+        # Gather exons of the CDS, which do not need to be adjacent in the
+        # exon array (see :meth:`sorted_by_position`).
+        num_exons = cds['exon_stop'] - cds['exon_start']
+        ends = np.cumsum(num_exons)
+        starts = ends - num_exons
+        exons = self.exons[np.arange(ends[-1] if len(ends) else 0)
+                           + np.repeat(cds['exon_start'] - starts, num_exons)]
+        exons = list(zip(exons['start'].tolist(), exons['stop'].tolist()))
+        molecules = ['chr' + c for c in CHROMOSOMES]
+        return [
+            CdsPos(ccds_id=ccds_id.decode('ascii'),
+                   indexes=exons[exon_start:exon_stop],
+                   molecule=molecules[molecule],
+                   strand=strand.decode('ascii'))
+            for ccds_id, molecule, exon_start, exon_stop, strand in zip(
+                self.ccds_ids[start:stop].tolist(), cds['molecule'].tolist(),
+                starts.tolist(), ends.tolist(), cds['strand'].tolist())
+        ]
+
+    def sorted_by_position(self) -> 'CcdsIndex':
+        """Return the index with CDS sorted by molecule name and start of
+        their first exon, the order in which CRAM files are loaded fastest.
+        Exons are kept (memory-mapped) as they are."""
+        names = np.array(['chr' + c for c in CHROMOSOMES])
+        molecule_ranks = np.argsort(np.argsort(names))
+        # Sorting by the last key is stable, CDS with the same key keep
+        # their order.
+        order = np.lexsort((self.exons['start'][self.cds['exon_start']],
+                            molecule_ranks[self.cds['molecule']]))
+        return CcdsIndex(ccds_ids=self.ccds_ids[order], cds=self.cds[order],
+                         exons=self.exons)
+
+
+class CdsList(Sequence):
+    """Read-only sequence of :class:`CdsPos` backed by a :class:`CcdsIndex`.
+    CDS are converted to :class:`CdsPos` only while accessed, thus they are
+    not all held in memory as Python objects. It can be passed wherever a
+    list of CDS is iterated, e.g. to :func:`cdnu.cram.iter_cds_list`."""
+
+    CHUNK_SIZE = 4096
+    """Number of CDS converted at once while iterating."""
+
+    def __init__(self, index: CcdsIndex):
+        self.index = index
+
+    def __len__(self) -> int:
+        return len(self.index.cds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.index.cds_pos(i)
+                    for i in range(*index.indices(len(self)))]
+        if not -len(self) <= index < len(self):
+            raise IndexError('CDS index out of range')
+        return self.index.cds_pos(index)
+
+    def __iter__(self) -> Iterator[CdsPos]:
+        for start in range(0, len(self), self.CHUNK_SIZE):
+            yield from self.index.to_cds_list(start, start + self.CHUNK_SIZE)
 
 
-def load_ccds() -> List[CdsPos]:
+def load_ccds(ccds_file: str = CCDS_FILE,
+              cache_dir: Optional[str] = CACHE_DIR) -> List[CdsPos]:
     """Load file with CDS locations within GRCh38 genome as a list of
+    :class:`CdsPos`.
+
+    :param cache_dir: directory with compiled CCDS files (see
+        :func:`load_ccds_index`) or None to parse the text file.
+    """
+    if cache_dir is None:
+        return parse_ccds(ccds_file)
+    return load_ccds_index(ccds_file, cache_dir).to_cds_list()
+
+
+def load_ccds_index(ccds_file: str = CCDS_FILE,
+                    cache_dir: str = CACHE_DIR) -> CcdsIndex:
+    """Load compiled CCDS as memory-mapped arrays. The CCDS file is parsed
+    and compiled to :param:`cache_dir` only if it has not been compiled
+    yet, compiled files are keyed by hash of the CCDS file."""
+    digest = hashlib.sha256()
+    with open(ccds_file, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+            digest.update(chunk)
+    name = '{}-v{}'.format(digest.hexdigest(), CACHE_VERSION)
+    path = os.path.join(cache_dir, name)
+
+    if not os.path.exists(path):
+        index = compile_ccds(parse_ccds(ccds_file))
+
+        os.makedirs(cache_dir, exist_ok=True)
+        # Remove files compiled from other versions of the CCDS file and
+        # files left by crashed processes.
+        for other in os.listdir(cache_dir):
+            if other != name and (not other.endswith('.tmp')
+                                  or not _is_running(other)):
+                shutil.rmtree(os.path.join(cache_dir, other),
+                              ignore_errors=True)
+
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        os.makedirs(tmp_path)
+        try:
+            for field, array in zip(CcdsIndex._fields, index):
+                np.save(os.path.join(tmp_path, field + '.npy'), array)
+            os.rename(tmp_path, path)
+        except OSError:
+            # Compiled concurrently by another process.
+            if not os.path.exists(path):
+                raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    return CcdsIndex(*(
+        np.load(os.path.join(path, field + '.npy'), mmap_mode='r')
+        for field in CcdsIndex._fields
+    ))
+
+
+def _is_running(tmp_name: str) -> bool:
+    """Return False if the process which created a <name>.<pid>.tmp
+    directory does not exist anymore."""
+    try:
+        pid = int(tmp_name.split('.')[-2])
+    except (IndexError, ValueError):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def compile_ccds(cds_list: List[CdsPos]) -> CcdsIndex:
+    """Convert a list of CDS to NumPy arrays."""
+    cds = np.zeros(len(cds_list), dtype=CDS_DTYPE)
+    exons = np.zeros(sum(len(c.indexes) for c in cds_list),
+                     dtype=EXON_DTYPE)
+    exons[:] = [e for c in cds_list for e in c.indexes]
+
+    num_exons = np.array([len(c.indexes) for c in cds_list], dtype=np.int64)
+    cds['exon_stop'] = np.cumsum(num_exons)
+    cds['exon_start'] = cds['exon_stop'] - num_exons
+    cds['molecule'] = [CHROMOSOMES.index(c.molecule[3:]) for c in cds_list]
+    cds['strand'] = [c.strand.encode('ascii') for c in cds_list]
+
+    return CcdsIndex(
+        ccds_ids=np.array([c.ccds_id.encode('ascii') for c in cds_list],
+                          dtype=np.bytes_),
+        cds=cds,
+        exons=exons,
+    )
+
+
+def parse_ccds(ccds_file: str = CCDS_FILE) -> List[CdsPos]:
+    """Parse file with CDS locations within GRCh38 genome to a list of
     :class:`CdsPos`."""
     cds = []
 
-    with open(CCDS_FILE, encoding='utf-8', newline='\n') as fp:
+    with open(ccds_file, encoding='utf-8', newline='\n') as fp:
         for line in fp:
             if not line:
                 # Skip empty lines
@@ -39,9 +241,8 @@ def load_ccds() -> List[CdsPos]:
                 # CDS is not yet public
                 continue
 
-            if parts[6] == '-':
-                # CDS strand negative order = reverse-complement
-                continue
+            strand = parts[6]
+            assert strand in ('+', '-'), strand
 
             locations_str = parts[9]
             if locations_str == '-':
@@ -66,7 +267,8 @@ def load_ccds() -> List[CdsPos]:
             cds.append(CdsPos(
                 ccds_id=ccds_id,
                 molecule='chr' + chromosome,
-                indexes=locations
+                indexes=locations,
+                strand=strand,
             ))
 
     return cds
@@ -0,0 +1,139 @@
+import os
+from typing import Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+from cdnu.ccds import CdsPos
+from cdnu.codons import CODONS, INVALID_CODON, codon_indexes
+from cdnu.cram import is_valid_cds
+
+COUNTS_DTYPE = np.dtype(np.uint32)
+
+
+class CdsCodonCounts(NamedTuple):
+    """Codon counts of each CDS of a single sample stored as a sparse
+    (CDS x 64) matrix in compressed sparse row format: counts of CDS i are
+    at positions ``indptr[i]:indptr[i + 1]`` of :attr:`codons` and
+    :attr:`counts`."""
+
+    ccds_ids: np.ndarray
+    """CCDS IDs as ASCII byte strings."""
+    valid: np.ndarray
+    """Boolean flag of each CDS, see :func:`cdnu.cram.is_valid_cds`.
+    Codons of invalid CDS are counted as well."""
+    indptr: np.ndarray
+    codons: np.ndarray
+    """Codon indexes (see :const:`cdnu.codons.CODONS`) of non-zero
+    counts."""
+    counts: np.ndarray
+
+    def dense(self) -> np.ndarray:
+        """Return (CDS x 64) matrix of codon counts."""
+        matrix = np.zeros((len(self.ccds_ids), len(CODONS)),
+                          dtype=COUNTS_DTYPE)
+        rows = np.repeat(np.arange(len(self.ccds_ids)), np.diff(self.indptr))
+        matrix[rows, self.codons] = self.counts
+        return matrix
+
+    def totals(self) -> np.ndarray:
+        """Return codon counts (in order of :const:`cdnu.codons.CODONS`)
+        summed over valid CDS, i.e. the same counts as returned by
+        :func:`cdnu.codons.count_codons` for the sample."""
+        rows = np.repeat(self.valid, np.diff(self.indptr))
+        return np.bincount(self.codons[rows], weights=self.counts[rows],
+                           minlength=len(CODONS)).astype(np.uint64)
+
+
+def count_cds_codons(ccds_list: List[CdsPos],
+                     cds_list: Iterable[Optional[bytes]]) -> CdsCodonCounts:
+    """Count codons of each CDS, see :class:`CdsCodonCounter`.
+
+    :param ccds_list: positions of the CDS
+    :param cds_list: ASCII CDS buffers as returned by
+        :func:`cdnu.cram.load_cds_list` with ``remove_invalid=False``, i.e.
+        one buffer for each CDS of :param:`ccds_list`.
+    """
+    counter = CdsCodonCounter()
+    for cds_pos, cds in zip(ccds_list, cds_list):
+        counter.add(cds_pos, cds)
+    return counter.result()
+
+
+class CdsCodonCounter:
+    """Counts codons of each CDS added one at a time. Added CDS are buffered
+    and counted in bulk once at least :attr:`FLUSH_SIZE` bytes are
+    buffered, so CDS do not need to be kept in memory all at once."""
+
+    FLUSH_SIZE = 1 << 22
+
+    def __init__(self):
+        self._ccds_ids = []
+        self._valid = []
+        # Sparse counts of already counted CDS in chunks.
+        self._row_sizes = []
+        self._codons = []
+        self._counts = []
+        self._pending = []
+        self._num_pending = 0
+
+    def add(self, cds_pos: CdsPos, cds: Optional[bytes]):
+        """Count codons of a CDS. None is counted as an invalid CDS without
+        any codons."""
+        if cds is None:
+            cds = b''
+        self._ccds_ids.append(cds_pos.ccds_id.encode('ascii'))
+        self._valid.append(is_valid_cds(cds))
+        self._pending.append(memoryview(cds)[:len(cds) - len(cds) % 3])
+        self._num_pending += len(cds)
+        if self._num_pending >= self.FLUSH_SIZE:
+            self._flush()
+
+    def result(self) -> CdsCodonCounts:
+        """Return codon counts of all added CDS."""
+        self._flush()
+        indptr = np.zeros(len(self._ccds_ids) + 1, dtype=np.int64)
+        if self._row_sizes:
+            np.cumsum(np.concatenate(self._row_sizes), out=indptr[1:])
+        return CdsCodonCounts(
+            ccds_ids=np.array(self._ccds_ids, dtype=np.bytes_),
+            valid=np.array(self._valid, dtype=np.bool_),
+            indptr=indptr,
+            codons=np.concatenate(
+                [np.zeros(0, dtype=np.uint8)] + self._codons),
+            counts=np.concatenate(
+                [np.zeros(0, dtype=COUNTS_DTYPE)] + self._counts),
+        )
+
+    def _flush(self):
+        num_cds = len(self._pending)
+        if not num_cds:
+            return
+
+        lengths = np.array([len(cds) // 3 for cds in self._pending],
+                           dtype=np.intp)
+        rows = np.repeat(np.arange(num_cds), lengths)
+        indexes = codon_indexes(b''.join(self._pending))
+        # The extra column collects invalid codons.
+        dense = np.bincount(rows * (INVALID_CODON + 1) + indexes,
+                            minlength=num_cds * (INVALID_CODON + 1))
+        dense = dense.reshape(num_cds, INVALID_CODON + 1)[:, :len(CODONS)]
+
+        row_indexes, codons = np.nonzero(dense)
+        self._row_sizes.append(np.bincount(row_indexes, minlength=num_cds))
+        self._codons.append(codons.astype(np.uint8))
+        self._counts.append(dense[row_indexes, codons].astype(COUNTS_DTYPE))
+
+        self._pending = []
+        self._num_pending = 0
+
+
+def save_cds_counts(file_path: str, cds_counts: CdsCodonCounts):
+    """Atomically store per CDS codon counts to a compressed .npz file."""
+    tmp_file_path = file_path + '.tmp.npz'
+    np.savez_compressed(tmp_file_path, **cds_counts._asdict())
+    os.rename(tmp_file_path, file_path)
+
+
+def load_cds_counts(file_path: str) -> CdsCodonCounts:
+    with np.load(file_path) as data:
+        return CdsCodonCounts(**{f: data[f] for f in CdsCodonCounts._fields})
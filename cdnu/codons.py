@@ -0,0 +1,174 @@
+from itertools import product
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+CODONS = tuple(''.join(codon) for codon in product('ATCG', repeat=3))
+"""All 64 codons, codon with index i (see :func:`codon_indexes`) is at
+position i."""
+INVALID_CODON = len(CODONS)
+"""Index of codons containing any symbol other than A, T, C, G (e.g. - for
+a missing base or N)."""
+
+SYMBOL_BITS = 5
+"""Number of low bits of an ASCII symbol used in a codon key (see
+:func:`codon_keys`). These bits uniquely identify all letters (i.e. bases,
+IUPAC codes and N) and - does not collide with A, T, C or G."""
+SYMBOL_MASK = (1 << SYMBOL_BITS) - 1
+
+
+def _build_key_to_codon() -> np.ndarray:
+    table = np.full(1 << (3 * SYMBOL_BITS), INVALID_CODON, dtype=np.uint8)
+    for index, codon in enumerate(CODONS):
+        key = 0
+        for symbol in codon.encode('ascii'):
+            key = (key << SYMBOL_BITS) | (symbol & SYMBOL_MASK)
+        table[key] = index
+    return table
+
+
+KEY_TO_CODON = _build_key_to_codon()
+"""Lookup table from codon keys to codon indexes."""
+START_CODON = b'ATG'
+STOP_CODONS = (b'TAG', b'TAA', b'TGA')
+
+
+def count_codons(cds_list: Iterable[Optional[bytes]]) -> Dict[str, int]:
+    """Count codons in all CDS from :param:`cds_list`, see
+    :class:`CodonCounter`.
+
+    :param cds_list: ASCII CDS buffers as returned by
+        :func:`cdnu.cram.load_cds_list`, None-s are skipped.
+    :return: a dict mapping each of 64 codons to number of its occurrences.
+        Codons containing - or N are not counted.
+    """
+    counter = CodonCounter()
+    for cds in cds_list:
+        counter.add(cds)
+    return counter.counts()
+
+
+class CodonCounter:
+    """Counts codons of CDS added one at a time. Added CDS are buffered and
+    counted in bulk once at least :attr:`FLUSH_SIZE` bytes are buffered, so
+    CDS do not need to be kept in memory all at once."""
+
+    FLUSH_SIZE = 1 << 22
+
+    def __init__(self):
+        self._key_counts = np.zeros(len(KEY_TO_CODON), dtype=np.int64)
+        self._pending = []
+        self._num_pending = 0
+
+    def add(self, cds: Optional[bytes]):
+        """Count codons of a CDS, None is skipped."""
+        if cds is None:
+            return
+        self._pending.append(memoryview(cds)[:len(cds) - len(cds) % 3])
+        self._num_pending += len(cds)
+        if self._num_pending >= self.FLUSH_SIZE:
+            self._flush()
+
+    def counts(self) -> Dict[str, int]:
+        """Return a dict mapping each of 64 codons to number of its
+        occurrences in all added CDS. Codons containing - or N are not
+        counted."""
+        self._flush()
+        counts = np.bincount(KEY_TO_CODON, weights=self._key_counts,
+                             minlength=INVALID_CODON + 1)
+        return {codon: int(count) for codon, count in zip(CODONS, counts)}
+
+    def _flush(self):
+        joined = b''.join(self._pending)
+        self._key_counts += np.bincount(codon_keys(joined),
+                                        minlength=len(KEY_TO_CODON))
+        self._pending = []
+        self._num_pending = 0
+
+
+class BatchCodonCounter:
+    """Counts codons of valid CDS (see :func:`cdnu.cram.is_valid_cds`) of
+    several samples at once. CDS are added as matrices with one row per
+    sample (see :class:`cdnu.cram.CdsBatch`), each matrix is counted in a
+    single pass."""
+
+    def __init__(self, num_samples: int):
+        self._counts = np.zeros((num_samples, INVALID_CODON + 1),
+                                dtype=np.int64)
+        self.processed_cds = np.zeros(num_samples, dtype=np.int64)
+        """Number of valid CDS of each sample."""
+
+    def add(self, sequences: np.ndarray, lengths: np.ndarray):
+        """Count codons of CDS of all samples.
+
+        :param sequences: (samples x bases) matrix of ASCII symbols, a row
+            holds CDS of a sample concatenated
+        :param lengths: length of each CDS
+        """
+        num_samples = len(self._counts)
+        starts = np.cumsum(lengths) - lengths
+        valid = self._valid(sequences, starts, lengths)
+        self.processed_cds += valid.sum(axis=1)
+
+        # Trailing incomplete codon of each CDS is ignored.
+        num_codons = lengths // 3
+        codon_cds = np.repeat(np.arange(len(lengths)), num_codons)
+        codon_starts = (starts[codon_cds] + 3 * (
+            np.arange(len(codon_cds))
+            - np.repeat(np.cumsum(num_codons) - num_codons, num_codons)))
+
+        keys = (sequences[:, codon_starts] & SYMBOL_MASK).astype(np.uint16)
+        for offset in (1, 2):
+            keys <<= SYMBOL_BITS
+            keys |= sequences[:, codon_starts + offset] & SYMBOL_MASK
+        indexes = KEY_TO_CODON[keys] + (
+            np.arange(num_samples)[:, np.newaxis] * (INVALID_CODON + 1))
+        self._counts += np.bincount(
+            indexes[valid[:, codon_cds]],
+            minlength=self._counts.size).reshape(self._counts.shape)
+
+    def counts(self) -> List[Dict[str, int]]:
+        """Return codon counts of each sample, see
+        :meth:`CodonCounter.counts`."""
+        return [{codon: int(count) for codon, count in zip(CODONS, row)}
+                for row in self._counts]
+
+    @staticmethod
+    def _valid(sequences: np.ndarray, starts: np.ndarray,
+               lengths: np.ndarray) -> np.ndarray:
+        """Return (samples x CDS) flags of valid CDS."""
+        long_enough = lengths >= 3
+        first = starts[long_enough, np.newaxis] + np.arange(3)
+        last = first + lengths[long_enough, np.newaxis] - 3
+
+        def matches(columns, codon):
+            return (sequences[:, columns]
+                    == np.frombuffer(codon, dtype=np.uint8)).all(axis=2)
+
+        valid = np.zeros((len(sequences), len(lengths)), dtype=np.bool_)
+        valid[:, long_enough] = matches(first, START_CODON) & np.any(
+            [matches(last, stop) for stop in STOP_CODONS], axis=0)
+        return valid
+
+
+def codon_indexes(sequence: bytes) -> np.ndarray:
+    """Return an array with index of each codon in the reading frame of
+    :param:`sequence`. Valid codons have index between 0 and 63 (see
+    :const:`CODONS`), other codons have index :const:`INVALID_CODON`.
+    Trailing incomplete codon is ignored."""
+    return KEY_TO_CODON[codon_keys(sequence)]
+
+
+def codon_keys(sequence: bytes) -> np.ndarray:
+    """Return an array of 15-bit keys of codons in the reading frame of
+    :param:`sequence`, the key is made of :const:`SYMBOL_BITS` low bits of
+    each ASCII symbol of the codon. Trailing incomplete codon is ignored."""
+    symbols = np.frombuffer(sequence, dtype=np.uint8)
+    symbols = symbols[:len(symbols) - len(symbols) % 3].reshape(-1, 3)
+
+    keys = (symbols[:, 0] & SYMBOL_MASK).astype(np.uint16)
+    keys <<= SYMBOL_BITS
+    keys |= symbols[:, 1] & SYMBOL_MASK
+    keys <<= SYMBOL_BITS
+    keys |= symbols[:, 2] & SYMBOL_MASK
+    return keys
@@ -1,75 +1,710 @@
-from typing import List, Optional
+from bisect import bisect_right
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from itertools import groupby, islice
+from operator import attrgetter
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
 
-from pysam import AlignmentFile
+import numpy as np
+from pysam import AlignedSegment, AlignmentFile
 
 from cdnu.ccds import CdsPos
+from cdnu.codons import START_CODON, STOP_CODONS
 
+FetchPlan = Dict[str, List[Tuple[int, int]]]
+"""Sorted disjoint intervals (start inclusive, stop exclusive) per
+molecule."""
 
-def load_cds_list(cram_file_path: str, cds_list: List[CdsPos]) -> List[str]:
+BASES = b'ACGTN'
+"""Symbols counted by :class:`ConsensusAssembler`, any symbol other than A,
+C, G or T is counted as N."""
+
+
+def _build_base_codes() -> np.ndarray:
+    table = np.full(256, BASES.index(b'N'), dtype=np.uint8)
+    for code, base in enumerate(BASES[:4]):
+        table[base] = code
+        table[ord(chr(base).lower())] = code
+    return table
+
+
+BASE_CODES = _build_base_codes()
+"""Lookup table from ASCII symbols to indexes of :const:`BASES`."""
+MISSING_QUALITY = 255
+"""Quality assumed for bases of reads without base qualities."""
+COMPLEMENT = bytes.maketrans(b'ACGTRYKMBVDHacgtrykmbvdh',
+                             b'TGCAYRMKVBHDtgcayrmkvbhd')
+"""Translation table of ASCII symbols (including IUPAC codes) to their
+complements, other symbols (e.g. N or -) are kept."""
+COMPLEMENT_CODES = np.frombuffer(COMPLEMENT, dtype=np.uint8)
+"""Lookup table variant of :const:`COMPLEMENT`."""
+
+
+class CdsBatch(NamedTuple):
+    """CDS of a single molecule loaded from several CRAM files, see
+    :func:`iter_cds_batch`."""
+
+    cds_list: List[CdsPos]
+    sequences: np.ndarray
+    """(samples x bases) matrix of ASCII symbols, a row holds the CDS of a
+    sample concatenated in order of :attr:`cds_list`. CDS on the - strand
+    are reverse complemented."""
+    lengths: np.ndarray
+    """Length of each CDS."""
+
+
+def load_cds_list(cram_file_path: str, cds_list: List[CdsPos],
+                  streaming: bool = False, workers: int = 1,
+                  threads: int = 1, remove_invalid: bool = True,
+                  consensus: bool = False, min_depth: int = 1,
+                  min_base_quality: int = 0,
+                  counters: Optional[Counter] = None,
+                  reference: Optional[str] = None
+                  ) -> List[Optional[bytearray]]:
     """Load CDS sequences (:param:`cds_list`) from a CRAM file
     (:param:`cram_file_path`). The CRAM file should be whole Homo Sapiens
     genome aligned to GRCh38 reference assembly.
 
-    A list of CDS strings is returned. "Candidate" CDS not starting with "ATG"
-    are replaced by None.
+    Exons of all CDS are merged to a :func:`plan_fetches` so every genomic
+    position is decoded from the CRAM file only once, even if it is shared
+    by several CDS (e.g. alternative isoforms).
+
+    A list of CDS buffers with ASCII symbols is returned, CDS on the - strand
+    are reverse complemented. "Candidate" CDS not starting with "ATG" are
+    replaced by None.
+
+    :param streaming: if True, reads of each molecule are iterated only once
+        in a single sequential pass (see :func:`stream_blocks`) instead of
+        seeking to each interval of the plan. This is faster for dense
+        target sets (e.g. whole exome).
+    :param workers: number of processes loading molecules in parallel, each
+        with its own CRAM file handle.
+    :param threads: number of htslib decompression threads per CRAM file
+        handle.
+    :param remove_invalid: if False, invalid CDS are kept (see
+        :func:`is_valid_cds`) instead of being replaced by None.
+    :param consensus: if True, each position is called from all reads
+        covering it (see :class:`ConsensusAssembler` which receives
+        :param:`min_depth` and :param:`min_base_quality`) instead of being
+        copied from the first read.
+    :param counters: if given, numbers of fetched regions and decoded reads
+        are added to its ``regions`` and ``reads`` keys.
+    :param reference: path of an indexed FASTA file with the reference
+        sequences, see :func:`open_cram`
     """
-    with AlignmentFile(cram_file_path, 'rc') as cram:
-        assert cram is not None
-        cds_strings = [find_single_cds(cram, cds_seq) for cds_seq in cds_list]
+    plan = plan_fetches(cds_list)
+    assembler = _select_assembler(consensus, min_depth, min_base_quality)
+
+    if workers == 1:
+        blocks = dict(load_molecules(cram_file_path, plan, streaming,
+                                     threads, assembler, counters,
+                                     reference))
+    else:
+        # Start with the largest molecules so the workers finish at about
+        # the same time.
+        molecules = sorted(
+            plan, key=lambda m: sum(b - a for a, b in plan[m]), reverse=True)
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [
+                pool.submit(_load_molecules_counted, cram_file_path,
+                            {molecule: plan[molecule]}, streaming, threads,
+                            assembler, reference)
+                for molecule in molecules
+            ]
+            blocks = {}
+            for future in futures:
+                items, molecule_counters = future.result()
+                blocks.update(items)
+                if counters is not None:
+                    counters.update(molecule_counters)
+
+    cds_strings = [slice_cds(plan, blocks, cds) for cds in cds_list]
+    if not remove_invalid:
+        return cds_strings
     return remove_invalid_cds(cds_strings)
 
 
-def find_single_cds(cram: AlignmentFile, sequence_cds: CdsPos) -> str:
+def iter_cds_list(
+        cram_file_path: str, cds_list: List[CdsPos],
+        streaming: bool = False, workers: int = 1, threads: int = 1,
+        remove_invalid: bool = True, consensus: bool = False,
+        min_depth: int = 1, min_base_quality: int = 0,
+        counters: Optional[Counter] = None, reference: Optional[str] = None
+) -> Iterator[Tuple[CdsPos, Optional[bytearray]]]:
+    """Generator variant of :func:`load_cds_list` (with the same parameters)
+    which yields (CDS location, CDS buffer or None) pairs in order of
+    :param:`cds_list`.
+
+    CDS are loaded one run of consecutive CDS on the same molecule at a
+    time. Only blocks of the current run (and of runs loaded in advance by
+    :param:`workers`) are kept in memory, thus :param:`cds_list` should be
+    grouped by molecule (e.g. sorted), otherwise molecules are loaded
+    repeatedly.
+    """
+    assembler = _select_assembler(consensus, min_depth, min_base_quality)
+    # Only lengths of the runs are kept, the CDS are iterated again while
+    # they are sliced from loaded blocks.
+    run_lengths = []
+    plans = []
+    for _, run in groupby(cds_list, key=attrgetter('molecule')):
+        run = list(run)
+        run_lengths.append(len(run))
+        plans.append(plan_fetches(run))
+
+    loaded = _iter_molecule_blocks(cram_file_path, plans, streaming,
+                                   workers, threads, assembler, counters,
+                                   reference)
+    cds_iter = iter(cds_list)
+    for run_length, plan, blocks in zip(run_lengths, plans, loaded):
+        for cds in islice(cds_iter, run_length):
+            sequence = slice_cds(plan, blocks, cds)
+            if remove_invalid and not is_valid_cds(sequence):
+                sequence = None
+            yield cds, sequence
+
+
+def iter_cds_batch(
+        cram_file_paths: List[str], cds_list: List[CdsPos],
+        threads: int = 1, consensus: bool = False, min_depth: int = 1,
+        min_base_quality: int = 0, counters: Optional[Counter] = None,
+        reference: Optional[str] = None) -> Iterator[CdsBatch]:
+    """Load CDS of several samples at once, one run of consecutive CDS on
+    the same molecule at a time (see :func:`iter_cds_list` with the same
+    parameters).
+
+    All CRAM files are open together. The fetch plan of a run is made only
+    once and each of its intervals is loaded from all CRAM files (see
+    :func:`load_joint_blocks`) before moving to the next one, so the files
+    are read in lockstep. Invalid CDS are kept, see
+    :func:`cdnu.codons.BatchCodonCounter`.
+
+    Memory use is proportional to the number of samples times the length
+    of CDS of the largest molecule.
+    """
+    assembler = _select_assembler(consensus, min_depth, min_base_quality)
+
+    with ExitStack() as stack:
+        crams = [stack.enter_context(open_cram(path, threads, reference))
+                 for path in cram_file_paths]
+        for molecule, run in groupby(cds_list, key=attrgetter('molecule')):
+            run = list(run)
+            intervals = plan_fetches(run)[molecule]
+            blocks = load_joint_blocks(crams, molecule, intervals, assembler,
+                                       counters)
+
+            columns, minus_strand = _cds_columns(intervals, run)
+            sequences = blocks[:, columns]
+            sequences[:, minus_strand] = \
+                COMPLEMENT_CODES[sequences[:, minus_strand]]
+            lengths = np.array([sum(b - a for a, b in cds.indexes)
+                                for cds in run], dtype=np.intp)
+            yield CdsBatch(run, sequences, lengths)
+
+
+def load_joint_blocks(crams: List[AlignmentFile], molecule: str,
+                      intervals: List[Tuple[int, int]], assembler=None,
+                      counters: Optional[Counter] = None) -> np.ndarray:
+    """Load sorted disjoint intervals of a single molecule from several
+    CRAM files. Each interval is loaded from all files before moving to the
+    next one.
+
+    :return: (files x bases) matrix of ASCII symbols, a row holds the
+        intervals loaded from a file concatenated (see :func:`load_block`)
+    """
+    lengths = [stop - start for start, stop in intervals]
+    offsets = np.cumsum([0] + lengths).tolist()
+    blocks = np.empty((len(crams), offsets[-1]), dtype=np.uint8)
+    rows = [memoryview(row) for row in blocks]
+
+    for (start, stop), offset in zip(intervals, offsets):
+        for cram, row in zip(crams, rows):
+            load_block(cram, molecule, start, stop, assembler, counters,
+                       row[offset:offset + stop - start])
+    return blocks
+
+
+def _cds_columns(intervals: List[Tuple[int, int]],
+                 cds_list: List[CdsPos]) -> Tuple[np.ndarray, np.ndarray]:
+    """Return indexes of columns of a matrix of concatenated intervals (see
+    :func:`load_joint_blocks`) which form concatenated CDS of
+    :param:`cds_list` and a flag of each column of the CDS telling whether
+    it belongs to a CDS on the - strand."""
+    offsets = np.cumsum([0] + [b - a for a, b in intervals]).tolist()
+    columns = []
+    minus_strand = []
+    for cds in cds_list:
+        cds_columns = []
+        for cds_from, cds_to in cds.indexes:
+            index = bisect_right(intervals, (cds_from, float('inf'))) - 1
+            block_start, block_stop = intervals[index]
+            assert block_start <= cds_from and cds_to <= block_stop
+            first = offsets[index] + cds_from - block_start
+            cds_columns.append(np.arange(first, first + cds_to - cds_from))
+        cds_columns = np.concatenate(cds_columns or [np.zeros(0, np.intp)])
+        if cds.strand == '-':
+            cds_columns = cds_columns[::-1]
+        columns.append(cds_columns)
+        minus_strand.append(np.full(len(cds_columns), cds.strand == '-'))
+
+    if not columns:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.bool_)
+    return np.concatenate(columns), np.concatenate(minus_strand)
+
+
+def _iter_molecule_blocks(
+        cram_file_path: str, plans: List[FetchPlan], streaming: bool,
+        workers: int, threads: int, assembler, counters: Optional[Counter],
+        reference: Optional[str]) -> Iterator[Dict[str, List[bytearray]]]:
+    """Load fetch plans one by one, at most :param:`workers` plans are
+    loaded in advance."""
+    if workers == 1:
+        with open_cram(cram_file_path, threads, reference) as cram:
+            for plan in plans:
+                yield dict(_load_plan(cram, plan, streaming, assembler,
+                                      counters))
+        return
+
+    plans = iter(plans)
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque(
+            pool.submit(_load_molecules_counted, cram_file_path, plan,
+                        streaming, threads, assembler, reference)
+            for plan in islice(plans, workers)
+        )
+        while pending:
+            items, plan_counters = pending.popleft().result()
+            if counters is not None:
+                counters.update(plan_counters)
+            for plan in islice(plans, 1):
+                pending.append(pool.submit(
+                    _load_molecules_counted, cram_file_path, plan, streaming,
+                    threads, assembler, reference))
+            yield dict(items)
+
+
+def _select_assembler(consensus: bool, min_depth: int,
+                      min_base_quality: int):
+    if consensus:
+        return partial(ConsensusAssembler, min_depth=min_depth,
+                       min_base_quality=min_base_quality)
+    return BlockAssembler
+
+
+def load_molecules(
+        cram_file_path: str, plan: FetchPlan, streaming: bool = False,
+        threads: int = 1, assembler=None,
+        counters: Optional[Counter] = None, reference: Optional[str] = None
+) -> List[Tuple[str, List[bytearray]]]:
+    """Load all intervals of a fetch plan from a CRAM file.
+
+    :param assembler: assembler class (or factory) of the intervals,
+        :class:`BlockAssembler` by default
+    :param counters: see :func:`load_cds_list`
+    :param reference: see :func:`open_cram`
+    :return: a list of (molecule, blocks) pairs, see :func:`slice_cds`
+    """
+    with open_cram(cram_file_path, threads, reference) as cram:
+        return _load_plan(cram, plan, streaming, assembler, counters)
+
+
+def _load_molecules_counted(
+        cram_file_path: str, plan: FetchPlan, streaming: bool, threads: int,
+        assembler, reference: Optional[str]
+) -> Tuple[List[Tuple[str, List[bytearray]]], Counter]:
+    """Variant of :func:`load_molecules` for worker processes which
+    returns the counters along with the blocks."""
+    counters = Counter()
+    blocks = load_molecules(cram_file_path, plan, streaming, threads,
+                            assembler, counters, reference)
+    return blocks, counters
+
+
+def open_cram(cram_file_path: str, threads: int = 1,
+              reference: Optional[str] = None) -> AlignmentFile:
+    """Open a CRAM file for reading.
+
+    :param threads: number of htslib decompression threads
+    :param reference: path of an indexed FASTA file with the reference
+        sequences (see :func:`cdnu.reference.write_reference_subset`). If
+        None, htslib looks the sequences up by their MD5 digests in
+        REF_PATH and REF_CACHE (see :func:`cdnu.reference.use_ref_cache`)
+        or downloads them from the remote reference server.
+    """
+    cram = AlignmentFile(cram_file_path, 'rc', threads=threads,
+                         reference_filename=reference)
+    assert cram is not None
+    return cram
+
+
+def _load_plan(cram: AlignmentFile, plan: FetchPlan, streaming: bool,
+               assembler, counters: Optional[Counter] = None
+               ) -> List[Tuple[str, List[bytearray]]]:
+    if streaming:
+        return [
+            (molecule, stream_blocks(cram, molecule, intervals, assembler,
+                                     counters))
+            for molecule, intervals in plan.items()
+        ]
+    return [
+        (molecule, [load_block(cram, molecule, start, stop, assembler,
+                               counters)
+                    for start, stop in intervals])
+        for molecule, intervals in plan.items()
+    ]
+
+
+def plan_fetches(cds_list: List[CdsPos]) -> FetchPlan:
+    """Collapse exons of all CDS to sorted disjoint intervals per molecule.
+    Overlapping and adjacent exons are merged to a single interval."""
+    intervals = defaultdict(list)
+    for cds in cds_list:
+        intervals[cds.molecule].extend(cds.indexes)
+    return {
+        molecule: merge_intervals(molecule_intervals)
+        for molecule, molecule_intervals in intervals.items()
+    }
+
+
+def merge_intervals(
+        intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Return sorted union of (start, stop) intervals as a list of disjoint
+    non-adjacent intervals."""
+    merged = []
+    for start, stop in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if stop > merged[-1][1]:
+                merged[-1] = (merged[-1][0], stop)
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def load_block(cram: AlignmentFile, molecule: str, start: int,
+               stop: int, assembler=None,
+               counters: Optional[Counter] = None, buffer=None) -> bytearray:
+    """Load a single continuous genomic interval from a CRAM file. Positions
+    not covered by any read are filled with -.
+
+    :param assembler: assembler class (or factory) of the interval,
+        :class:`BlockAssembler` by default
+    :param counters: see :func:`load_cds_list`
+    :param buffer: buffer the interval is written to (see
+        :class:`BlockAssembler`), a new one by default
+    """
+    assembler = (assembler or BlockAssembler)(start, stop, buffer)
+    num_reads = 0
+    for read in cram.fetch(contig=molecule, start=start, stop=stop):
+        num_reads += 1
+        assembler.feed(read)
+        if assembler.done:
+            break
+
+    if counters is not None:
+        counters['regions'] += 1
+        counters['reads'] += num_reads
+    return assembler.finish()
+
+
+def stream_blocks(cram: AlignmentFile, molecule: str,
+                  intervals: List[Tuple[int, int]], assembler=None,
+                  counters: Optional[Counter] = None) -> List[bytearray]:
+    """Load sorted disjoint intervals of a single molecule in one sequential
+    pass over its reads. Each read is fed to all intervals it overlaps while
+    a sweep line retires intervals which lie before the read.
+
+    :param counters: see :func:`load_cds_list`, the whole molecule is
+        counted as a single region
+    :return: a list of buffers, one per interval (see :func:`load_block`)
+    """
+    if not intervals:
+        return []
+
+    new_assembler = assembler or BlockAssembler
+    assemblers = [new_assembler(start, stop) for start, stop in intervals]
+    first_active = 0
+    num_reads = 0
+
+    reads = cram.fetch(contig=molecule, start=intervals[0][0],
+                       stop=intervals[-1][1])
+    for read in reads:
+        num_reads += 1
+        if read.reference_start is None or read.reference_end is None:
+            continue
+
+        while first_active < len(assemblers):
+            assembler = assemblers[first_active]
+            if not assembler.done and assembler.stop > read.reference_start:
+                break
+            first_active += 1
+        if first_active == len(assemblers):
+            break
+
+        # Indexes are walked, slicing would copy the remaining assemblers
+        # for each read.
+        for i in range(first_active, len(assemblers)):
+            assembler = assemblers[i]
+            if assembler.start >= read.reference_end:
+                break
+            assembler.feed(read)
+
+    if counters is not None:
+        counters['regions'] += 1
+        counters['reads'] += num_reads
+    return [assembler.finish() for assembler in assemblers]
+
+
+def slice_cds(plan: FetchPlan, blocks: Dict[str, List[bytearray]],
+              cds: CdsPos) -> bytearray:
+    """Construct a CDS from loaded blocks of a :func:`plan_fetches`. CDS on
+    the - strand is reverse complemented.
+
+    :param plan: the fetch plan which was used to load the blocks
+    :param blocks: loaded blocks, one buffer per interval in the plan
+    :param cds: CDS location
+    """
+    intervals = plan[cds.molecule]
+    molecule_blocks = blocks[cds.molecule]
+
+    single_cds = bytearray(sum(b - a for a, b in cds.indexes))
+    offset = 0
+    for cds_from, cds_to in cds.indexes:
+        block_index = bisect_right(intervals, (cds_from, float('inf'))) - 1
+        block_start, block_stop = intervals[block_index]
+        assert block_start <= cds_from and cds_to <= block_stop
+        block = memoryview(molecule_blocks[block_index])
+        single_cds[offset:offset + cds_to - cds_from] = \
+            block[cds_from - block_start:cds_to - block_start]
+        offset += cds_to - cds_from
+
+    if cds.strand == '-':
+        reverse_complement(single_cds)
+    return single_cds
+
+
+def reverse_complement(sequence: bytearray):
+    """Reverse complement an ASCII sequence in place."""
+    sequence[:] = sequence.translate(COMPLEMENT)
+    sequence.reverse()
+
+
+class BlockAssembler:
+    """Assembles a continuous genomic interval from reads fed in order of
+    their reference start. Each position is copied from the first read which
+    covers it, positions not covered by any read are filled with -.
+
+    The interval is written to a preallocated buffer, either a new one or
+    :param:`buffer` (e.g. a memoryview into a larger buffer) of length
+    ``stop - start``.
+    """
+
+    def __init__(self, start: int, stop: int, buffer=None):
+        self.start = start
+        self.stop = stop
+        if buffer is None:
+            buffer = bytearray(stop - start)
+        assert len(buffer) == stop - start
+        buffer[:] = b'-' * (stop - start)
+        self._buffer = buffer
+        self._index = start
+
+    @property
+    def done(self) -> bool:
+        """True if no later read can contribute to the interval."""
+        return self._index >= self.stop
+
+    def feed(self, read: AlignedSegment):
+        if read.reference_start is None or read.reference_end is None:
+            return
+
+        ref_from = read.reference_start
+        # Last aligned position, i.e. read.positions[-1] without
+        # materializing the whole list.
+        ref_to = read.reference_end - 1
+
+        if ref_from > self._index:
+            # Missing positions are already filled with -.
+            self._index = min(ref_from, self.stop)
+
+        if ref_from <= self._index < ref_to:
+            read_start = self._index - ref_from
+            read_end = min(self.stop, ref_to) - ref_from
+            offset = self._index - self.start
+            self._buffer[offset:offset + read_end - read_start] = \
+                read.query_sequence[read_start:read_end].encode('ascii')
+            self._index += read_end - read_start
+
+    def finish(self):
+        """Return the assembled interval buffer. Missing remainder (if any)
+        is filled with -."""
+        self._index = self.stop
+        return self._buffer
+
+
+class ConsensusAssembler:
+    """Assembles a continuous genomic interval from all reads overlapping
+    it, fed in any order, with the same interface as
+    :class:`BlockAssembler`.
+
+    Aligned bases (according to the CIGAR) with quality at least
+    :param:`min_base_quality` are counted per position as A, C, G, T or N
+    (see :const:`BASES`). A base is called if it makes a strict majority of
+    at least :param:`min_depth` counted bases, otherwise the position is
+    filled with N. Positions without any counted base are filled with -.
+
+    Bases of fed reads are buffered and added to a NumPy array of counts in
+    bulk once :attr:`FLUSH_SIZE` bases are buffered.
+    """
+
+    FLUSH_SIZE = 1 << 20
+
+    def __init__(self, start: int, stop: int, buffer=None,
+                 min_depth: int = 1, min_base_quality: int = 0):
+        self.start = start
+        self.stop = stop
+        if buffer is None:
+            buffer = bytearray(stop - start)
+        assert len(buffer) == stop - start
+        self.min_depth = min_depth
+        self.min_base_quality = min_base_quality
+        self._buffer = buffer
+        self._counts = np.zeros((stop - start) * len(BASES), dtype=np.uint32)
+        # Pending aligned segments: interval offset, bases and qualities.
+        self._offsets = []
+        self._sequences = []
+        self._qualities = []
+        self._num_pending = 0
+
+    @property
+    def done(self) -> bool:
+        """Always False, any later read may contribute to the interval."""
+        return False
+
+    def feed(self, read: AlignedSegment):
+        sequence = read.query_sequence
+        if read.reference_start is None or not read.cigartuples \
+                or not sequence:
+            return
+        qualities = read.query_qualities
+
+        ref_index = read.reference_start
+        query_index = 0
+        for operation, length in read.cigartuples:
+            if operation in (0, 7, 8):
+                # Match or mismatch.
+                ref_from = max(ref_index, self.start)
+                ref_to = min(ref_index + length, self.stop)
+                if ref_from < ref_to:
+                    query_from = query_index + ref_from - ref_index
+                    query_to = query_from + ref_to - ref_from
+                    self._offsets.append(ref_from - self.start)
+                    self._sequences.append(sequence[query_from:query_to])
+                    if qualities is None:
+                        self._qualities.append(
+                            bytes([MISSING_QUALITY]) * (ref_to - ref_from))
+                    else:
+                        self._qualities.append(
+                            qualities[query_from:query_to])
+                    self._num_pending += ref_to - ref_from
+                ref_index += length
+                query_index += length
+            elif operation in (1, 4):
+                # Insertion or soft clip.
+                query_index += length
+            elif operation in (2, 3):
+                # Deletion or skipped region.
+                ref_index += length
+
+            if ref_index >= self.stop:
+                break
+
+        if self._num_pending >= self.FLUSH_SIZE:
+            self._flush()
+
+    def finish(self):
+        """Return the assembled interval buffer with called bases."""
+        self._flush()
+        counts = self._counts.reshape(-1, len(BASES))
+        self._counts = None
+
+        depth = counts.sum(axis=1)
+        best = counts[:, :4].argmax(axis=1)
+        best_counts = counts[np.arange(len(counts)), best]
+        called = (depth >= self.min_depth) & (2 * best_counts > depth)
+
+        symbols = np.frombuffer(BASES, dtype=np.uint8)[best]
+        symbols[~called] = ord('N')
+        symbols[depth == 0] = ord('-')
+        self._buffer[:] = symbols.tobytes()
+        return self._buffer
+
+    def _flush(self):
+        if not self._num_pending:
+            return
+
+        lengths = np.array([len(s) for s in self._sequences], dtype=np.intp)
+        segment_starts = np.cumsum(lengths) - lengths
+        offsets = np.arange(self._num_pending) + np.repeat(
+            np.array(self._offsets, dtype=np.intp) - segment_starts, lengths)
+        symbols = np.frombuffer(
+            ''.join(self._sequences).encode('ascii'), dtype=np.uint8)
+        qualities = np.frombuffer(b''.join(self._qualities), dtype=np.uint8)
+
+        keys = offsets * len(BASES) + BASE_CODES[symbols]
+        keys = keys[qualities >= self.min_base_quality]
+        self._counts += np.bincount(
+            keys, minlength=len(self._counts)).astype(np.uint32)
+
+        self._offsets = []
+        self._sequences = []
+        self._qualities = []
+        self._num_pending = 0
+
+
+def find_single_cds(cram: AlignmentFile, sequence_cds: CdsPos,
+                    assembler=None) -> bytearray:
     """ Finds (presumed) cds sequence by parameters
 
     :param cram: pre-loaded file to be search
     :param sequence_cds: CDS location
+    :param assembler: assembler class (or factory) of the exons,
+        :class:`BlockAssembler` by default
 
-    :return: a string with DNA symbols A, T, C, G
+    :return: a buffer with ASCII DNA symbols A, T, C, G
     """
-    single_cds = ''
+    single_cds = bytearray(sum(b - a for a, b in sequence_cds.indexes))
+    view = memoryview(single_cds)
+    offset = 0
 
-    size = 0
     # The CDS be spliced from multiple exons.
     for cds_from, cds_to in sequence_cds.indexes:
         assert cds_from is not None
         assert cds_to is not None
-        size += cds_to - cds_from
 
         region = '{}:{}-{}'.format(sequence_cds.molecule, cds_from, cds_to)
-        index = cds_from
+        exon_assembler = (assembler or BlockAssembler)(
+            cds_from, cds_to, view[offset:offset + cds_to - cds_from])
         for read in cram.fetch(region=region):
-            if read.reference_start is None or read.reference_end is None:
-                continue
-            ref_from = read.positions[0]
-            ref_to = read.positions[-1]
-            assert ref_from is not None
-            assert ref_to is not None
-
-            if ref_from > index:
-                missing_len = ref_from - index
-                single_cds += '-' * missing_len
-                index += missing_len
-
-            if ref_from <= index < ref_to and index <= cds_to + 1:
-                read_start = max(cds_from, index) - ref_from
-                read_end = min(cds_to, ref_to) - ref_from
-                single_cds += read.seq[read_start:read_end]
-                index += read_end - read_start
-
-            if index > cds_to:
+            exon_assembler.feed(read)
+            if exon_assembler.done:
                 break
+        exon_assembler.finish()
+        offset += cds_to - cds_from
 
-        # Fill missing remainder (if any) with -.
-        single_cds += '-' * (size - len(single_cds))
-
+    if sequence_cds.strand == '-':
+        reverse_complement(single_cds)
     return single_cds
 
 
-def remove_invalid_cds(cds_list: List[str]) -> List[Optional[str]]:
+def remove_invalid_cds(
+        cds_list: List[bytearray]) -> List[Optional[bytearray]]:
     """This function replaces coding sequences which doesn't start with ATG
     or end with one of TAG, TAA or TGA with None-s."""
-    return [
-        t if t[:3] == 'ATG' and t[-3:] in ('TAG', 'TAA', 'TGA') else None
-        for t in cds_list
-    ]
+    return [t if is_valid_cds(t) else None for t in cds_list]
+
+
+def is_valid_cds(cds: bytes) -> bool:
+    """Check whether a coding sequence starts with ATG and ends with one of
+    TAG, TAA or TGA."""
+    return cds[:3] == START_CODON and cds[-3:] in STOP_CODONS
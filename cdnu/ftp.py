@@ -1,19 +1,148 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from io import DEFAULT_BUFFER_SIZE
-from typing import BinaryIO
-from urllib.request import urlopen
+from ftplib import FTP, all_errors
+from threading import Lock
+from typing import BinaryIO, Optional
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
 
+BUFFER_SIZE = 1024 * 1024
+"""Size of chunks in which downloaded files are copied."""
+STATE_INTERVAL = 64 * 1024 * 1024
+"""Number of bytes downloaded by a segment between stores of download
+state of a partially downloaded file."""
 
-def download_file_from_ftp(file_url: str, file_path: str):
-    """Download file from an FTP URL to a file. The file is loaded chunk by
-    chunk."""
-    with open_ftp_file(file_url) as ftp_fp:
-        with open(file_path, 'wb') as fs_fp:
-            while True:
-                chunk = ftp_fp.read(DEFAULT_BUFFER_SIZE)
-                if not chunk:
-                    break
-                fs_fp.write(chunk)
+
+def download_file_from_ftp(file_url: str, file_path: str,
+                           md5: Optional[str] = None, segments: int = 1,
+                           retries: int = 3):
+    """Download file from an FTP (or HTTP(S)) URL to a file. The file is
+    loaded chunk by chunk.
+
+    The file is first downloaded to ``file_path + '.part'`` and renamed once
+    it is complete and verified. An interrupted download is resumed from
+    where it stopped, download state is stored along with the partial file.
+
+    :param md5: expected hex MD5 digest of the file, the file is removed and
+        IOError is raised if the digest of the downloaded file differs.
+    :param segments: number of parts of the file which are downloaded
+        concurrently, each over its own connection.
+    :param retries: number of times download of a segment is restarted
+        (from where it stopped) after a failure.
+    """
+    part_path = file_path + '.part'
+    state_path = part_path + '.json'
+    size = get_url_size(file_url)
+
+    state = None
+    if os.path.exists(part_path) and os.path.exists(state_path):
+        with open(state_path, encoding='utf-8') as fp:
+            state = json.load(fp)
+        if state['url'] != file_url or state['size'] != size:
+            state = None
+        else:
+            logging.info('Resuming download of %s.', file_url)
+
+    if state is None:
+        segment_size = -(-size // segments)
+        state = {
+            'url': file_url,
+            'size': size,
+            # [start, stop, number of downloaded bytes]
+            'segments': [
+                [start, min(start + segment_size, size), 0]
+                for start in range(0, max(size, 1), segment_size or 1)
+            ],
+        }
+        with open(part_path, 'wb') as fp:
+            fp.truncate(size)
+        _store_state(state_path, state)
+
+    lock = Lock()
+    with ThreadPoolExecutor(len(state['segments'])) as pool:
+        futures = [
+            pool.submit(_download_segment, file_url, part_path, state_path,
+                        state, segment, lock, retries)
+            for segment in state['segments']
+        ]
+        for future in futures:
+            future.result()
+
+    if md5 is not None:
+        digest = file_md5(part_path)
+        if digest != md5.lower():
+            os.remove(part_path)
+            os.remove(state_path)
+            raise IOError('MD5 checksum of {} is {}, expected {}.'.format(
+                file_url, digest, md5))
+
+    os.rename(part_path, file_path)
+    os.remove(state_path)
+
+
+def _download_segment(file_url: str, part_path: str, state_path: str,
+                      state: dict, segment: list, lock: Lock, retries: int):
+    start, stop, _ = segment
+    attempt = 0
+
+    while start + segment[2] < stop:
+        try:
+            position = start + segment[2]
+            stored = segment[2]
+            with open_url_range(file_url, position, stop) as remote_fp, \
+                    open(part_path, 'r+b') as fs_fp:
+                fs_fp.seek(position)
+                while position < stop:
+                    chunk = remote_fp.read(min(BUFFER_SIZE, stop - position))
+                    if not chunk:
+                        raise IOError('Unexpected end of remote file.')
+                    fs_fp.write(chunk)
+                    position += len(chunk)
+
+                    if position - start - stored >= STATE_INTERVAL:
+                        fs_fp.flush()
+                        os.fsync(fs_fp.fileno())
+                        stored = position - start
+                        with lock:
+                            segment[2] = stored
+                            _store_state(state_path, state)
+
+                fs_fp.flush()
+                os.fsync(fs_fp.fileno())
+                with lock:
+                    segment[2] = stop - start
+                    _store_state(state_path, state)
+        except all_errors as e:
+            attempt += 1
+            if attempt > retries:
+                raise
+            logging.warning('Download of %s failed (%s), retrying...',
+                            file_url, e)
+            time.sleep(2 ** attempt)
+
+
+def _store_state(state_path: str, state: dict):
+    tmp_state_path = state_path + '.tmp'
+    with open(tmp_state_path, 'w', encoding='utf-8') as fp:
+        json.dump(state, fp)
+    os.replace(tmp_state_path, state_path)
+
+
+def file_md5(file_path: str) -> str:
+    """Return hex MD5 digest of a file."""
+    digest = hashlib.md5()
+    with open(file_path, 'rb') as fp:
+        while True:
+            chunk = fp.read(BUFFER_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
 def download_ftp_text(file_url: str) -> str:
@@ -40,3 +169,93 @@ def open_ftp_file(file_url: str) -> BinaryIO:
         yield fp
     finally:
         fp.close()
+
+
+def get_url_size(file_url: str) -> int:
+    """Return size of a remote file in bytes.
+
+    :param file_url: file URL which must start with ftp://, http:// or
+        https://
+    """
+    parsed = urlparse(file_url)
+    if parsed.scheme == 'ftp':
+        with _connect_ftp(parsed) as ftp:
+            ftp.voidcmd('TYPE I')
+            return ftp.size(parsed.path)
+
+    _check_http_url(parsed)
+    request = Request(file_url, method='HEAD')
+    with urlopen(request, timeout=30) as response:
+        return int(response.headers['Content-Length'])
+
+
+def read_url_range(file_url: str, start: int, stop: int) -> bytes:
+    """Read a byte range of a remote file to memory.
+
+    :param file_url: file URL which must start with ftp://, http:// or
+        https://
+    :param start: first byte of the range (inclusive)
+    :param stop: last byte of the range (exclusive)
+    """
+    if stop <= start:
+        return b''
+
+    with open_url_range(file_url, start, stop) as fp:
+        return _read_exactly(fp, stop - start)
+
+
+@contextmanager
+def open_url_range(file_url: str, start: int, stop: int) -> BinaryIO:
+    """Open a byte range of a remote file for reading. Data past the range
+    may be returned by FTP servers.
+
+    :param file_url: file URL which must start with ftp://, http:// or
+        https://
+    :param start: first byte of the range (inclusive)
+    :param stop: last byte of the range (exclusive)
+    """
+    parsed = urlparse(file_url)
+    if parsed.scheme == 'ftp':
+        ftp = _connect_ftp(parsed)
+        try:
+            ftp.voidcmd('TYPE I')
+            with ftp.transfercmd('RETR ' + parsed.path, rest=start) as conn:
+                with conn.makefile('rb') as fp:
+                    yield fp
+        finally:
+            # The transfer may not be complete, close the control connection
+            # without waiting for a reply.
+            ftp.close()
+        return
+
+    _check_http_url(parsed)
+    request = Request(file_url, headers={
+        'Range': 'bytes={}-{}'.format(start, stop - 1)})
+    with urlopen(request, timeout=30) as response:
+        if response.status != 206:
+            raise IOError('Server does not support byte ranges.')
+        yield response
+
+
+def _read_exactly(fp: BinaryIO, size: int) -> bytes:
+    chunks = []
+    while size > 0:
+        chunk = fp.read(min(size, BUFFER_SIZE))
+        if not chunk:
+            raise IOError('Unexpected end of remote file.')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _connect_ftp(parsed_url) -> FTP:
+    ftp = FTP(timeout=30)
+    ftp.connect(parsed_url.hostname, parsed_url.port or 21)
+    ftp.login(parsed_url.username or 'anonymous',
+              parsed_url.password or '')
+    return ftp
+
+
+def _check_http_url(parsed_url):
+    if parsed_url.scheme not in ('http', 'https'):
+        raise ValueError('Only FTP and HTTP(S) URLs are accepted.')
@@ -0,0 +1,207 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import NamedTuple, Tuple
+
+import numpy as np
+import scipy.stats as stats
+
+CHUNK_ELEMENTS = 1 << 24
+"""Maximum number of elements of (resamples x samples x features) arrays
+created at once while processing a batch of resamples."""
+
+
+class PermutationResult(NamedTuple):
+
+    h: np.ndarray
+    """Observed H statistic of each feature."""
+    pvalues: np.ndarray
+    """Permutation p-value of each feature."""
+    adjusted_pvalues: np.ndarray
+    """P-values adjusted for multiple comparisons with the max-statistic
+    method, i.e. compared to the largest H of all features of each
+    permutation."""
+
+
+def kruskal_columns(data, groups, num_groups):
+    """Compute Kruskal-Wallis H-test (with tie correction) independently for
+    each column of a (samples x features) matrix.
+
+    :param groups: group index of each sample
+    :return: arrays of H statistics and p-values, one per column
+    """
+    ranks, correction = rank_columns(data)
+    group_sizes = np.bincount(groups, minlength=num_groups)
+    rank_sums = group_matrix(groups, num_groups) @ ranks
+    h = h_statistics(rank_sums, group_sizes, correction)
+    return h, stats.chi2.sf(h, num_groups - 1)
+
+
+def permutation_test(data, groups, num_groups, permutations,
+                     batch_size=1000, seed=0, workers=1) -> PermutationResult:
+    """Kruskal-Wallis H-test of each column of a (samples x features) matrix
+    with p-values estimated from random permutations of group labels.
+
+    Data are ranked only once, H statistics of whole batches of
+    permutations are computed at once. Permutations are generated in batches
+    of :param:`batch_size`, batch i is generated from seed ``[seed, 0, i]``
+    thus results do not depend on :param:`workers`.
+
+    :param workers: number of processes evaluating batches in parallel
+    """
+    ranks, correction = rank_columns(data)
+    group_sizes = np.bincount(groups, minlength=num_groups)
+    h = h_statistics(group_matrix(groups, num_groups) @ ranks, group_sizes,
+                     correction)
+
+    # Permuting group labels is equivalent to permuting rows of the ranks
+    # sorted by group.
+    ranks = ranks[np.argsort(groups, kind='mergesort')]
+    evaluate = partial(_permutation_batch, ranks, group_sizes, correction, h,
+                       seed)
+    counts = sum(_map(evaluate, _batches(permutations, batch_size), workers))
+
+    pvalues, adjusted_pvalues = (1 + counts) / (1 + permutations)
+    return PermutationResult(h, pvalues, adjusted_pvalues)
+
+
+def bootstrap_effect_sizes(data, groups, num_groups, resamples,
+                           confidence=0.95, batch_size=1000, seed=0,
+                           workers=1) -> Tuple[np.ndarray, np.ndarray]:
+    """Compute bootstrap percentile confidence intervals of the
+    Kruskal-Wallis effect size (epsilon squared, i.e. H / (n - 1)) of each
+    column of a (samples x features) matrix.
+
+    Samples are resampled with replacement within each group. Resamples are
+    generated in batches of :param:`batch_size`, batch i is generated from
+    seed ``[seed, 1, i]`` thus results do not depend on :param:`workers`.
+
+    :return: lower and upper bounds of the intervals
+    """
+    data = data[np.argsort(groups, kind='mergesort')]
+    group_sizes = np.bincount(groups, minlength=num_groups)
+    evaluate = partial(_bootstrap_batch, data, group_sizes, seed)
+    effect_sizes = np.concatenate(
+        list(_map(evaluate, _batches(resamples, batch_size), workers)))
+
+    alpha = (1 - confidence) / 2
+    return tuple(np.percentile(effect_sizes, [100 * alpha, 100 * (1 - alpha)],
+                               axis=0))
+
+
+def rank_columns(data) -> Tuple[np.ndarray, np.ndarray]:
+    """Rank each column of a (samples x features) matrix, tied values get
+    average of their ranks (same as :func:`scipy.stats.rankdata`).
+
+    :return: matrix of ranks and tie correction factor of Kruskal-Wallis H
+        statistic of each column
+    """
+    num_samples, num_columns = data.shape
+    order = np.argsort(data, axis=0, kind='mergesort')
+    sorted_data = np.take_along_axis(data, order, axis=0)
+
+    # Runs of equal values, columns are processed as a single flat array.
+    new_run = np.ones(sorted_data.shape, dtype=np.bool_)
+    new_run[1:] = sorted_data[1:] != sorted_data[:-1]
+    new_run = new_run.T.ravel()
+    run_starts = np.flatnonzero(new_run)
+    run_lengths = np.diff(np.append(run_starts, new_run.size))
+    run_ranks = run_starts % num_samples + (run_lengths + 1) / 2
+
+    ranks = np.empty((num_columns, num_samples))
+    ranks[np.arange(num_columns)[:, np.newaxis], order.T] = \
+        run_ranks[np.cumsum(new_run) - 1].reshape(num_columns, num_samples)
+
+    ties = np.bincount(run_starts // num_samples,
+                       weights=run_lengths ** 3 - run_lengths,
+                       minlength=num_columns)
+    correction = 1 - ties / (num_samples ** 3 - num_samples)
+    return ranks.T, correction
+
+
+def h_statistics(rank_sums, group_sizes, correction):
+    """Compute Kruskal-Wallis H statistics from sums of ranks of each group
+    (the second to last axis of :param:`rank_sums`)."""
+    num_samples = group_sizes.sum()
+    h = (12 / (num_samples * (num_samples + 1))
+         * (rank_sums ** 2 / group_sizes[:, np.newaxis]).sum(axis=-2)
+         - 3 * (num_samples + 1))
+    return h / correction
+
+
+def group_matrix(groups, num_groups):
+    """Return (groups x samples) matrix with ones where a sample belongs to
+    a group."""
+    membership = np.zeros((num_groups, len(groups)))
+    membership[groups, np.arange(len(groups))] = 1
+    return membership
+
+
+def _permutation_batch(ranks, group_sizes, correction, h, seed, batch):
+    """Return number of permutations with H greater than or equal to the
+    observed H (per feature) and number of permutations with the largest H
+    over all features greater than or equal to the observed H."""
+    batch_index, size = batch
+    rng = np.random.RandomState([seed, 0, batch_index])
+    group_starts = np.cumsum(group_sizes) - group_sizes
+    # Permutation statistics equal to the observed ones in exact arithmetic
+    # may differ due to rounding.
+    threshold = h - 1e-9 * np.abs(h)
+    counts = np.zeros((2, ranks.shape[1]), dtype=np.int64)
+
+    for chunk_size in _chunks(size, ranks.size):
+        permutations = np.argsort(
+            rng.random_sample((chunk_size, ranks.shape[0])), axis=1)
+        rank_sums = np.add.reduceat(ranks[permutations], group_starts, axis=1)
+        permuted_h = h_statistics(rank_sums, group_sizes, correction)
+        counts[0] += (permuted_h >= threshold).sum(axis=0)
+        counts[1] += (permuted_h.max(axis=1)[:, np.newaxis]
+                      >= threshold).sum(axis=0)
+
+    return counts
+
+
+def _bootstrap_batch(data, group_sizes, seed, batch):
+    """Return (resamples x features) matrix of effect sizes of a batch of
+    stratified bootstrap resamples."""
+    batch_index, size = batch
+    rng = np.random.RandomState([seed, 1, batch_index])
+    num_samples, num_columns = data.shape
+    group_starts = np.cumsum(group_sizes) - group_sizes
+    groups = np.repeat(np.arange(len(group_sizes)), group_sizes)
+    effect_sizes = []
+
+    for chunk_size in _chunks(size, data.size):
+        # Random index within the group of each sample.
+        offsets = (rng.random_sample((chunk_size, num_samples))
+                   * group_sizes[groups]).astype(np.intp)
+        resampled = data[group_starts[groups] + offsets]
+        ranks, correction = rank_columns(
+            resampled.transpose(1, 0, 2).reshape(num_samples, -1))
+        ranks = ranks.reshape(num_samples, chunk_size, num_columns)
+        rank_sums = np.add.reduceat(ranks, group_starts, axis=0)
+        h = h_statistics(rank_sums.transpose(1, 0, 2), group_sizes,
+                         correction.reshape(chunk_size, num_columns))
+        effect_sizes.append(h / (num_samples - 1))
+
+    return np.concatenate(effect_sizes)
+
+
+def _batches(total, batch_size):
+    """Split :param:`total` resamples to (batch index, batch size)."""
+    return [
+        (index, min(batch_size, total - start))
+        for index, start in enumerate(range(0, total, batch_size))
+    ]
+
+
+def _chunks(size, elements_per_resample):
+    chunk_size = max(1, CHUNK_ELEMENTS // elements_per_resample)
+    for start in range(0, size, chunk_size):
+        yield min(chunk_size, size - start)
+
+
+def _map(function, items, workers):
+    if workers == 1:
+        return map(function, items)
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(function, items))
@@ -0,0 +1,224 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import closing, contextmanager
+from threading import Event, Lock, Thread
+from typing import Dict, Iterable, Iterator, Optional
+
+from cdnu.record import Record
+
+PENDING = 'pending'
+LEASED = 'leased'
+COMPLETED = 'completed'
+FAILED = 'failed'
+"""State reported by :meth:`WorkManifest.counts` for records which are not
+going to be claimed again after :attr:`WorkManifest.max_attempts`."""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    position INTEGER PRIMARY KEY,
+    sample_name TEXT NOT NULL UNIQUE,
+    record TEXT NOT NULL,
+    state TEXT NOT NULL,
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+class WorkManifest:
+    """Queue of records shared by workers on any number of nodes through an
+    SQLite database, e.g. on a shared filesystem (which must support POSIX
+    locks, the database does not use WAL).
+
+    Records are claimed in order of their addition, so the order of the
+    index (see :func:`download_index.reorder_index`) is kept. A claimed
+    record is leased to this manifest for :param:`lease_seconds`, the lease
+    is renewed by a background thread while the manifest is entered (see
+    :meth:`__enter__`). A record whose lease expired, e.g. because its
+    worker crashed, is claimed again by any worker, at most
+    :param:`max_attempts` times. Lease expiration is compared across nodes,
+    thus their clocks should be synchronized.
+    """
+
+    def __init__(self, file_path: str, lease_seconds: float = 600,
+                 max_attempts: int = 3):
+        self.file_path = file_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.owner = '{}:{}:{}'.format(socket.gethostname(), os.getpid(),
+                                       uuid.uuid4().hex[:8])
+        self._held = set()
+        self._held_lock = Lock()
+        self._stopped = Event()
+        self._heartbeat = None
+
+        with self._transaction() as db:
+            db.execute(_SCHEMA)
+
+    def __enter__(self):
+        self._stopped.clear()
+        self._heartbeat = Thread(target=self._renew_leases, daemon=True)
+        self._heartbeat.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Stop renewing leases and hand back records which were claimed but
+        not completed, nor handed back with :meth:`fail`."""
+        self._stopped.set()
+        self._heartbeat.join()
+        with self._held_lock:
+            held = list(self._held)
+        for sample_name in held:
+            self.release(sample_name)
+
+    def add_records(self, records: Iterable[Record],
+                    completed: Iterable[str] = ()) -> int:
+        """Append records which are not in the manifest yet.
+
+        :param completed: names of samples already processed elsewhere, e.g.
+            in a checkpoint, they are added as completed.
+        :return: number of added records
+        """
+        completed = set(completed)
+        with self._transaction() as db:
+            cursor = db.executemany(
+                'INSERT OR IGNORE INTO records (sample_name, record, state) '
+                'VALUES (?, ?, ?)',
+                ((r.sample_name, json.dumps(r.to_dict()),
+                  COMPLETED if r.sample_name in completed else PENDING)
+                 for r in records))
+            return cursor.rowcount
+
+    def claim(self) -> Optional[Record]:
+        """Lease the first pending record (or a record with an expired
+        lease) and return it, None is returned if there is no such
+        record."""
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute(
+                'SELECT position, record, attempts FROM records '
+                'WHERE (state = ? OR (state = ? AND lease_expires < ?)) '
+                'AND attempts < ? ORDER BY position LIMIT 1',
+                (PENDING, LEASED, now, self.max_attempts)).fetchone()
+            if row is None:
+                return None
+            position, record_json, attempts = row
+            db.execute(
+                'UPDATE records SET state = ?, owner = ?, lease_expires = ?, '
+                'attempts = ? WHERE position = ?',
+                (LEASED, self.owner, now + self.lease_seconds, attempts + 1,
+                 position))
+
+        record = Record.from_dict(json.loads(record_json))
+        if attempts:
+            logging.warning('Reclaiming %s after %d attempts.',
+                            record.sample_name, attempts)
+        with self._held_lock:
+            self._held.add(record.sample_name)
+        return record
+
+    def iter_claims(self) -> Iterator[Record]:
+        """Claim records one by one, until there are none left."""
+        while True:
+            record = self.claim()
+            if record is None:
+                return
+            yield record
+
+    def renew(self, sample_name: str) -> bool:
+        """Extend lease of a record claimed by this manifest, False is
+        returned if the lease is lost (it expired and the record was
+        claimed by another worker or completed)."""
+        with self._transaction() as db:
+            cursor = db.execute(
+                'UPDATE records SET lease_expires = ? '
+                'WHERE sample_name = ? AND state = ? AND owner = ?',
+                (time.time() + self.lease_seconds, sample_name, LEASED,
+                 self.owner))
+            return cursor.rowcount == 1
+
+    def complete(self, sample_name: str):
+        """Mark a record as processed, regardless of who holds its
+        lease."""
+        with self._transaction() as db:
+            db.execute(
+                'UPDATE records SET state = ?, owner = NULL, '
+                'lease_expires = NULL WHERE sample_name = ?',
+                (COMPLETED, sample_name))
+        with self._held_lock:
+            self._held.discard(sample_name)
+
+    def fail(self, sample_name: str):
+        """Hand back a record claimed by this manifest whose processing
+        failed, the claim is counted as an attempt (see
+        :param:`max_attempts`)."""
+        with self._transaction() as db:
+            db.execute(
+                'UPDATE records SET state = ?, owner = NULL, '
+                'lease_expires = NULL '
+                'WHERE sample_name = ? AND state = ? AND owner = ?',
+                (PENDING, sample_name, LEASED, self.owner))
+        with self._held_lock:
+            self._held.discard(sample_name)
+
+    def release(self, sample_name: str):
+        """Hand back a record claimed by this manifest whose processing has
+        not started, the claim is not counted as an attempt. See
+        :meth:`fail` for records whose processing failed."""
+        with self._transaction() as db:
+            db.execute(
+                'UPDATE records SET state = ?, owner = NULL, '
+                'lease_expires = NULL, attempts = attempts - 1 '
+                'WHERE sample_name = ? AND state = ? AND owner = ?',
+                (PENDING, sample_name, LEASED, self.owner))
+        with self._held_lock:
+            self._held.discard(sample_name)
+
+    def counts(self) -> Dict[str, int]:
+        """Return number of records in each state, records with expired
+        leases are counted as pending, or as failed once they have been
+        claimed :attr:`max_attempts` times."""
+        counts = {PENDING: 0, LEASED: 0, COMPLETED: 0, FAILED: 0}
+        now = time.time()
+        with self._transaction() as db:
+            rows = db.execute(
+                'SELECT CASE '
+                'WHEN (state = ? OR (state = ? AND lease_expires < ?)) '
+                'AND attempts >= ? THEN ? '
+                'WHEN state = ? AND lease_expires < ? THEN ? '
+                'ELSE state END AS current_state, COUNT(*) FROM records '
+                'GROUP BY current_state',
+                (PENDING, LEASED, now, self.max_attempts, FAILED, LEASED,
+                 now, PENDING)).fetchall()
+        counts.update(rows)
+        return counts
+
+    def _renew_leases(self):
+        while not self._stopped.wait(self.lease_seconds / 3):
+            with self._held_lock:
+                held = list(self._held)
+            for sample_name in held:
+                if not self.renew(sample_name):
+                    logging.warning('Lease of %s has been lost.', sample_name)
+                    with self._held_lock:
+                        self._held.discard(sample_name)
+
+    @contextmanager
+    def _transaction(self):
+        """Yield a new connection within an immediate (write locked)
+        transaction, connections are not shared by threads."""
+        with closing(sqlite3.connect(self.file_path, timeout=60,
+                                     isolation_level=None)) as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
@@ -0,0 +1,105 @@
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+from cdnu.record import Record
+
+
+class MetricsLog:
+    """Appends per-stage metrics to a JSON lines file, one line per stage of
+    a sample. Nothing is written if :param:`file_path` is None.
+
+    Each line is written with a single append, so the log may be shared by
+    concurrently running processes.
+    """
+
+    def __init__(self, file_path: Optional[str] = None):
+        self.file_path = file_path
+
+    def write(self, stage: str, seconds: float,
+              record: Optional[Record] = None, **counters):
+        """Append metrics of a stage.
+
+        :param seconds: wall clock duration of the stage
+        :param record: the processed sample, None for stages of the whole
+            run
+        :param counters: additional JSON serializable values
+        """
+        if self.file_path is None:
+            return
+
+        line = {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'pid': os.getpid(),
+            'stage': stage,
+        }
+        if record is not None:
+            line['sample'] = record.sample_name
+            line['population'] = record.population
+        line['seconds'] = round(seconds, 6)
+        line.update(counters)
+        line['peak_rss'] = peak_rss()
+        line['peak_children_rss'] = peak_rss(resource.RUSAGE_CHILDREN)
+
+        directory = os.path.dirname(self.file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.file_path, 'a', encoding='utf-8', newline='\n') as fp:
+            fp.write(json.dumps(line) + '\n')
+
+
+def peak_rss(who: int = resource.RUSAGE_SELF) -> int:
+    """Return peak resident set size in bytes of this process (or of its
+    terminated children, see :func:`resource.getrusage`)."""
+    max_rss = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class TimedIterator:
+    """Wraps an iterable and measures time spent producing its items, e.g.
+    time spent in a generator as opposed to time spent by its consumer."""
+
+    def __init__(self, iterable: Iterable):
+        self._iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+@contextmanager
+def profiled(file_path: Optional[str]):
+    """Profile the block with :mod:`cProfile` and store the statistics to
+    :param:`file_path` (see :mod:`pstats`). Nothing is profiled if
+    :param:`file_path` is None.
+
+    Only this process is profiled, i.e. not worker processes it starts.
+    """
+    if file_path is None:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        profile.dump_stats(file_path)
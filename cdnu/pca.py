@@ -0,0 +1,124 @@
+from typing import Callable, Iterable, NamedTuple
+
+import numpy as np
+
+RowChunks = Callable[[], Iterable[np.ndarray]]
+"""Function returning consecutive chunks of rows of a (rows x features)
+matrix, it is called once per pass over the matrix and each call must yield
+the same rows in the same order."""
+
+
+class PcaResult(NamedTuple):
+
+    mean: np.ndarray
+    """Mean of each feature."""
+    components: np.ndarray
+    """(components x features) matrix of principal axes. The sign of each
+    component is chosen so that its largest absolute loading is positive."""
+    explained_variance: np.ndarray
+    """Variance explained by each component."""
+    explained_variance_ratio: np.ndarray
+    """Fraction of the total variance explained by each component."""
+    embedding: np.ndarray
+    """(rows x components) matrix of rows projected to the components."""
+
+
+def randomized_pca(row_chunks: RowChunks, num_components: int = 2,
+                   oversamples: int = 10, power_iterations: int = 2,
+                   seed: int = 0) -> PcaResult:
+    """Principal component analysis of a (rows x features) matrix read from
+    :param:`row_chunks`, so that the matrix does not need to fit to memory.
+
+    Components are found with randomized SVD (Halko et al., Finding
+    structure with randomness, 2011) of the centered matrix: its range is
+    approximated by projections to ``num_components + oversamples`` random
+    vectors refined by :param:`power_iterations`, the matrix is read
+    ``2 * power_iterations + 2`` times. Only (rows x k) and (features x k)
+    matrices with ``k = num_components + oversamples`` are kept in memory.
+    The result is exact if k is at least the number of features.
+    """
+    rng = np.random.RandomState(seed)
+
+    num_rows = 0
+    sums = squares = omega = None
+    projections = []
+    for chunk in row_chunks():
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if omega is None:
+            num_features = chunk.shape[1]
+            omega = rng.standard_normal(
+                (num_features,
+                 min(num_components + oversamples, num_features)))
+            sums = np.zeros(num_features)
+            squares = np.zeros(num_features)
+        sums += chunk.sum(axis=0)
+        squares += np.square(chunk).sum(axis=0)
+        projections.append(chunk @ omega)
+        num_rows += len(chunk)
+
+    if omega is None or not 0 < num_components <= min(num_rows,
+                                                      num_features):
+        raise ValueError(
+            'Number of components must be positive and at most the number '
+            'of rows and features.')
+    if num_rows < 2:
+        raise ValueError('At least two rows are needed.')
+
+    mean = sums / num_rows
+    # Matrix products are computed with the centered matrix implicitly, the
+    # mean is subtracted from the products.
+    y = np.concatenate(projections) - mean @ omega
+    for _ in range(power_iterations):
+        q, _ = np.linalg.qr(y)
+        z, _ = np.linalg.qr(_transposed_product(row_chunks, mean, q))
+        y = _product(row_chunks, mean, z, num_rows)
+
+    q, _ = np.linalg.qr(y)
+    u, s, vt = np.linalg.svd(_transposed_product(row_chunks, mean, q).T,
+                             full_matrices=False)
+    u = u[:, :num_components]
+    s = s[:num_components]
+    components = vt[:num_components]
+
+    signs = np.sign(components[np.arange(num_components),
+                               np.argmax(np.abs(components), axis=1)])
+    components *= signs[:, np.newaxis]
+    u *= signs
+
+    explained_variance = np.square(s) / (num_rows - 1)
+    total_variance = (squares.sum() - num_rows * (mean @ mean)) \
+        / (num_rows - 1)
+    return PcaResult(
+        mean=mean,
+        components=components,
+        explained_variance=explained_variance,
+        explained_variance_ratio=explained_variance / total_variance,
+        embedding=(q @ u) * s,
+    )
+
+
+def _product(row_chunks: RowChunks, mean: np.ndarray, matrix: np.ndarray,
+             num_rows: int) -> np.ndarray:
+    """Return product of the centered matrix and a (features x k)
+    matrix."""
+    product = np.concatenate(
+        [np.asarray(chunk, dtype=np.float64) @ matrix
+         for chunk in row_chunks()])
+    if len(product) != num_rows:
+        raise ValueError('Passes over the matrix yield different rows.')
+    return product - mean @ matrix
+
+
+def _transposed_product(row_chunks: RowChunks, mean: np.ndarray,
+                        matrix: np.ndarray) -> np.ndarray:
+    """Return product of the transposed centered matrix and a (rows x k)
+    matrix."""
+    product = np.zeros((len(mean), matrix.shape[1]))
+    start = 0
+    for chunk in row_chunks():
+        chunk = np.asarray(chunk, dtype=np.float64)
+        product += chunk.T @ matrix[start:start + len(chunk)]
+        start += len(chunk)
+    if start != len(matrix):
+        raise ValueError('Passes over the matrix yield different rows.')
+    return product - np.outer(mean, matrix.sum(axis=0))
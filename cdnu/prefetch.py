@@ -0,0 +1,158 @@
+import logging
+import os
+import shutil
+from threading import Condition, Thread
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from cdnu.ftp import download_file_from_ftp
+from cdnu.record import Record
+
+
+class StagedRecord(NamedTuple):
+    """A record with its files downloaded to a staging directory."""
+
+    record: Record
+    directory: str
+    seq_file_path: str
+    size: int
+    """Total size of the downloaded files in bytes."""
+
+
+class Prefetcher:
+    """Downloads records to a staging directory in a background thread ahead
+    of their processing.
+
+    Staged records are yielded in order of :param:`records` and each of them
+    must be handed back with :meth:`release` once processed. A new download
+    is not started while :param:`max_records` records are staged (including
+    the one being downloaded) or while the staged files together with the
+    largest download seen so far would exceed :param:`max_bytes`.
+
+    :param download: function downloading an URL to a file path
+    :param stage: function which stores files of a record (first argument)
+        to a directory (second argument) and returns path of the CRAM file.
+        By default the CRAM file and its index are downloaded with
+        :param:`download`.
+    """
+
+    def __init__(self, records: Iterable[Record], staging_dir: str,
+                 max_records: int = 2, max_bytes: Optional[int] = None,
+                 download: Callable[[str, str], None] =
+                 download_file_from_ftp,
+                 stage: Optional[Callable[[Record, str], str]] = None):
+        assert max_records > 0
+        self._records = records
+        self._staging_dir = staging_dir
+        self._max_records = max_records
+        self._max_bytes = max_bytes
+        self._download = download
+        self._stage_files = stage or self._download_files
+
+        self._condition = Condition()
+        self._ready = []
+        self._finished = False
+        self._closed = False
+        self._num_staged = 0
+        self._downloading = False
+        self._staged_bytes = 0
+        self._max_size = 0
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._ready or self._finished)
+                if not self._ready:
+                    return
+                item = self._ready.pop(0)
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def needs_release(self) -> bool:
+        """Return True if no other staged record is going to be yielded
+        until a staged record is released, i.e. iterating would block
+        forever if this thread holds the staged records."""
+        with self._condition:
+            return not (self._ready or self._finished or self._downloading
+                        or self._has_space())
+
+    def release(self, staged: StagedRecord):
+        """Remove files of a processed record from the staging directory."""
+        shutil.rmtree(staged.directory)
+        with self._condition:
+            self._num_staged -= 1
+            self._staged_bytes -= staged.size
+            self._condition.notify_all()
+
+    def close(self):
+        """Stop downloading and wait for the current download to finish."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _has_space(self) -> bool:
+        if self._num_staged == 0:
+            return True
+        if self._num_staged >= self._max_records:
+            return False
+        return (self._max_bytes is None
+                or self._staged_bytes + self._max_size <= self._max_bytes)
+
+    def _run(self):
+        try:
+            for record in self._records:
+                with self._condition:
+                    self._condition.wait_for(
+                        lambda: self._closed or self._has_space())
+                    if self._closed:
+                        break
+                    self._num_staged += 1
+                    self._downloading = True
+
+                staged = self._stage(record)
+
+                with self._condition:
+                    self._downloading = False
+                    self._staged_bytes += staged.size
+                    self._max_size = max(self._max_size, staged.size)
+                    self._ready.append(staged)
+                    self._condition.notify_all()
+        except BaseException as e:
+            with self._condition:
+                self._ready.append(e)
+        finally:
+            with self._condition:
+                self._finished = True
+                self._condition.notify_all()
+
+    def _stage(self, record: Record) -> StagedRecord:
+        directory = os.path.join(self._staging_dir, record.sample_name)
+        os.makedirs(directory)
+        seq_file_path = self._stage_files(record, directory)
+
+        size = sum(os.path.getsize(os.path.join(directory, name))
+                   for name in os.listdir(directory))
+        return StagedRecord(record=record, directory=directory,
+                            seq_file_path=seq_file_path, size=size)
+
+    def _download_files(self, record: Record, directory: str) -> str:
+        seq_file_path = os.path.join(directory, 'seq.cram')
+        index_file_path = seq_file_path + '.crai'
+
+        logging.info('Going to download %s...', record.seq_url)
+        self._download(record.seq_url, seq_file_path)
+        logging.info('Going to download %s...', record.index_url)
+        self._download(record.index_url, index_file_path)
+
+        return seq_file_path
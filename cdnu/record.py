@@ -1,5 +1,5 @@
 import json
-from typing import List, NamedTuple
+from typing import List, NamedTuple, Optional
 
 
 class Record(NamedTuple):
@@ -9,22 +9,29 @@ class Record(NamedTuple):
     index_url: str
     sample_name: str
     population: str
+    md5: Optional[str] = None
+    """Hex MD5 digest of the sequence file (if known)."""
 
     def to_dict(self) -> dict:
-        return {
+        record_dict = {
             'seqUrl': self.seq_url,
             'indexUrl': self.index_url,
             'sampleName': self.sample_name,
             'population': self.population
         }
+        if self.md5 is not None:
+            record_dict['md5'] = self.md5
+        return record_dict
 
     def from_dict(record_dict):
         seq_url = record_dict['seqUrl']
         index_url = record_dict['indexUrl']
         sample_name = record_dict['sampleName']
         population = record_dict['population']
+        md5 = record_dict.get('md5')
         return Record(seq_url=seq_url, index_url=index_url,
-                      sample_name=sample_name, population=population)
+                      sample_name=sample_name, population=population,
+                      md5=md5)
 
 
 def load_index(index_file_path: str) -> List[Record]:
@@ -0,0 +1,105 @@
+import hashlib
+import os
+from typing import Iterable, List, Optional, Tuple
+
+import pysam
+
+REF_CACHE_DIR = '.ref_cache'
+"""Default directory with reference sequences keyed by their MD5 digests,
+see :func:`populate_ref_cache`."""
+_NON_PRINTABLE = bytes(b for b in range(256) if not 33 <= b < 127)
+_UPPER = bytes.maketrans(b'abcdefghijklmnopqrstuvwxyz',
+                         b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+
+def normalize_sequence(sequence: bytes) -> bytes:
+    """Convert a sequence to the form used for M5 digests of the SAM
+    specification, i.e. upper case without characters outside of the
+    printable ASCII range."""
+    return sequence.translate(_UPPER, _NON_PRINTABLE)
+
+
+def reference_md5(sequence: bytes) -> str:
+    """Return hex M5 digest of a reference sequence (as in @SQ lines of
+    SAM/CRAM headers)."""
+    return hashlib.md5(normalize_sequence(sequence)).hexdigest()
+
+
+def ref_cache_path(cache_dir: str, md5: str) -> str:
+    """Return path of a sequence in a cache directory laid out as htslib
+    expects it, i.e. ``%2s/%2s/%s``."""
+    return os.path.join(cache_dir, md5[:2], md5[2:4], md5[4:])
+
+
+def ref_cache_pattern(cache_dir: str) -> str:
+    """Return REF_PATH / REF_CACHE value of an htslib cache directory."""
+    return os.path.join(os.path.abspath(cache_dir), '%2s', '%2s', '%s')
+
+
+def use_ref_cache(cache_dir: str):
+    """Make htslib (in this process and processes started later) look up
+    CRAM reference sequences only in a local cache directory, never on the
+    remote reference server. Sequences are memory-mapped from the cache.
+
+    A CRAM file which needs a sequence missing in the cache fails to
+    decode.
+    """
+    pattern = ref_cache_pattern(cache_dir)
+    os.environ['REF_PATH'] = pattern
+    os.environ['REF_CACHE'] = pattern
+
+
+def populate_ref_cache(
+        fasta_path: str, cache_dir: str = REF_CACHE_DIR,
+        molecules: Optional[Iterable[str]] = None) -> List[Tuple[str, str]]:
+    """Store sequences of a FASTA file to an htslib reference cache
+    directory (see :func:`use_ref_cache`), each to a file named by its M5
+    digest. Sequences already in the cache are kept.
+
+    :param molecules: names of sequences to store, all by default
+    :return: (name, M5 digest) of each stored sequence
+    """
+    if molecules is not None:
+        molecules = set(molecules)
+
+    stored = []
+    with pysam.FastxFile(fasta_path) as fasta:
+        for entry in fasta:
+            if molecules is not None and entry.name not in molecules:
+                continue
+            sequence = normalize_sequence(entry.sequence.encode('ascii'))
+            md5 = hashlib.md5(sequence).hexdigest()
+            path = ref_cache_path(cache_dir, md5)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+                with open(tmp_path, 'wb') as fp:
+                    fp.write(sequence)
+                os.rename(tmp_path, path)
+            stored.append((entry.name, md5))
+    return stored
+
+
+def write_reference_subset(fasta_path: str, output_path: str,
+                           molecules: Iterable[str]) -> List[str]:
+    """Store selected sequences of a FASTA file to a new indexed FASTA file
+    which can be passed as reference of CRAM files, see
+    :func:`cdnu.cram.load_cds_list`.
+
+    :return: names of the stored sequences
+    """
+    molecules = set(molecules)
+    stored = []
+    tmp_path = output_path + '.tmp'
+    with pysam.FastxFile(fasta_path) as fasta, \
+            open(tmp_path, 'w', encoding='ascii', newline='\n') as fp:
+        for entry in fasta:
+            if entry.name not in molecules:
+                continue
+            fp.write('>{}\n'.format(entry.name))
+            for start in range(0, len(entry.sequence), 60):
+                fp.write(entry.sequence[start:start + 60] + '\n')
+            stored.append(entry.name)
+    os.rename(tmp_path, output_path)
+    pysam.faidx(output_path)
+    return stored
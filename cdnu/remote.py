@@ -0,0 +1,207 @@
+import gzip
+import hashlib
+import os
+from bisect import bisect_right
+from typing import List, NamedTuple, Optional, Tuple
+
+from pysam import AlignmentFile
+
+from cdnu.ccds import CdsPos
+from cdnu.cram import FetchPlan, load_cds_list, plan_fetches
+from cdnu.ftp import get_url_size, read_url_range
+
+CRAM_EOF_SIZES = {2: 30, 3: 38}
+"""Size of the EOF container by CRAM major version."""
+
+
+class CraiEntry(NamedTuple):
+    """A single line of a CRAM index, i.e. a single slice."""
+
+    seq_id: int
+    """Reference sequence index, -1 for unmapped reads and -2 for slices
+    with multiple references."""
+    alignment_start: int
+    """1-based start of the slice."""
+    alignment_span: int
+    container_offset: int
+    """Offset of the container from the beginning of the file."""
+    slice_offset: int
+    """Offset of the slice from the end of the container header."""
+    slice_size: int
+
+
+class RangeCache:
+    """Reads byte ranges of remote files and caches them in a local
+    directory. Nothing is cached if :param:`directory` is None."""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self.bytes_downloaded = 0
+
+    def read(self, file_url: str, start: int, stop: int) -> bytes:
+        """Read bytes from start (inclusive) to stop (exclusive)."""
+        if self.directory is None:
+            return self._download(file_url, start, stop)
+
+        path = os.path.join(self._url_directory(file_url),
+                            '{}-{}'.format(start, stop))
+        if os.path.exists(path):
+            with open(path, 'rb') as fp:
+                return fp.read()
+
+        data = self._download(file_url, start, stop)
+        self._store(path, data)
+        return data
+
+    def size(self, file_url: str) -> int:
+        """Return size of the file in bytes."""
+        if self.directory is None:
+            return get_url_size(file_url)
+
+        path = os.path.join(self._url_directory(file_url), 'size')
+        if os.path.exists(path):
+            with open(path, encoding='ascii') as fp:
+                return int(fp.read())
+
+        size = get_url_size(file_url)
+        self._store(path, str(size).encode('ascii'))
+        return size
+
+    def _download(self, file_url: str, start: int, stop: int) -> bytes:
+        data = read_url_range(file_url, start, stop)
+        self.bytes_downloaded += len(data)
+        return data
+
+    def _url_directory(self, file_url: str) -> str:
+        digest = hashlib.sha1(file_url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def _store(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as fp:
+            fp.write(data)
+        os.rename(tmp_path, path)
+
+
+def load_remote_cds_list(seq_url: str, index_url: str,
+                         cds_list: List[CdsPos], directory: str,
+                         cache: Optional[RangeCache] = None,
+                         **kwargs) -> list:
+    """Load CDS sequences from a remote CRAM file downloading only its
+    containers which overlap the CDS, see :func:`stage_regions` and
+    :func:`cdnu.cram.load_cds_list` (which receives :param:`kwargs`)."""
+    cram_file_path = stage_regions(seq_url, index_url, cds_list, directory,
+                                   cache=cache)
+    return load_cds_list(cram_file_path, cds_list, **kwargs)
+
+
+def stage_regions(seq_url: str, index_url: str, cds_list: List[CdsPos],
+                  directory: str, cache: Optional[RangeCache] = None) -> str:
+    """Download CRAM containers overlapping exons of :param:`cds_list` and
+    store them to a local CRAM file (with a CRAM index) in
+    :param:`directory`. The local file consists of the header of the remote
+    file, the overlapping containers and the EOF container, thus it contains
+    all reads needed to load the CDS.
+
+    :param seq_url: FTP or HTTP(S) URL of a CRAM file
+    :param index_url: URL of the CRAM index of :param:`seq_url`
+    :param cache: cache of downloaded byte ranges
+    :return: path of the local CRAM file
+    """
+    if cache is None:
+        cache = RangeCache()
+
+    entries = parse_crai(cache.read(index_url, 0, cache.size(index_url)))
+    seq_size = cache.size(seq_url)
+
+    container_offsets = sorted({e.container_offset for e in entries})
+    header = cache.read(seq_url, 0, container_offsets[0])
+    eof_size = CRAM_EOF_SIZES[header[4]]
+    eof = cache.read(seq_url, seq_size - eof_size, seq_size)
+    container_ends = dict(zip(
+        container_offsets, container_offsets[1:] + [seq_size - eof_size]))
+
+    references = read_references(header + eof, directory)
+    plan = plan_fetches(cds_list)
+    selected = {
+        e.container_offset for e in entries
+        if entry_overlaps(e, references, plan)
+    }
+
+    # Download consecutive containers with a single request.
+    byte_ranges = []
+    for offset in sorted(selected):
+        if byte_ranges and byte_ranges[-1][1] == offset:
+            byte_ranges[-1][1] = container_ends[offset]
+            byte_ranges[-1][2].append(offset)
+        else:
+            byte_ranges.append([offset, container_ends[offset], [offset]])
+
+    cram_file_path = os.path.join(directory, 'regions.cram')
+    new_offsets = {}
+    with open(cram_file_path, 'wb') as fp:
+        fp.write(header)
+        for start, stop, offsets in byte_ranges:
+            for offset in offsets:
+                new_offsets[offset] = fp.tell() + offset - start
+            fp.write(cache.read(seq_url, start, stop))
+        fp.write(eof)
+
+    new_entries = [
+        e._replace(container_offset=new_offsets[e.container_offset])
+        for e in entries if e.container_offset in selected
+    ]
+    with open(cram_file_path + '.crai', 'wb') as fp:
+        fp.write(format_crai(new_entries))
+
+    return cram_file_path
+
+
+def entry_overlaps(entry: CraiEntry, references: Tuple[str, ...],
+                   plan: FetchPlan) -> bool:
+    """Check whether a slice may contain reads overlapping intervals of a
+    fetch plan."""
+    if entry.seq_id == -1:
+        # Unmapped reads.
+        return False
+    if entry.seq_id < 0:
+        # Multiple references, keep it to be on the safe side.
+        return True
+
+    intervals = plan.get(references[entry.seq_id])
+    if not intervals:
+        return False
+
+    start = entry.alignment_start - 1
+    stop = start + entry.alignment_span
+    # Intervals are disjoint thus sorted by both start and stop.
+    index = bisect_right(intervals, (start, float('inf')))
+    if index > 0 and intervals[index - 1][1] > start:
+        return True
+    return index < len(intervals) and intervals[index][0] < stop
+
+
+def read_references(header: bytes, directory: str) -> Tuple[str, ...]:
+    """Return reference sequence names from a CRAM file consisting only of
+    a header and an EOF container."""
+    header_file_path = os.path.join(directory, 'header.cram')
+    with open(header_file_path, 'wb') as fp:
+        fp.write(header)
+    try:
+        with AlignmentFile(header_file_path, 'rc') as cram:
+            return cram.references
+    finally:
+        os.remove(header_file_path)
+
+
+def parse_crai(data: bytes) -> List[CraiEntry]:
+    """Parse a gzip compressed CRAM index."""
+    lines = gzip.decompress(data).decode('ascii').split('\n')
+    return [CraiEntry(*map(int, line.split('\t'))) for line in lines if line]
+
+
+def format_crai(entries: List[CraiEntry]) -> bytes:
+    """Serialize entries to a gzip compressed CRAM index."""
+    lines = ''.join('\t'.join(map(str, e)) + '\n' for e in entries)
+    return gzip.compress(lines.encode('ascii'))
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+from typing import Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+from cdnu.ccds import CdsPos
+from cdnu.cds_counts import CdsCodonCounts
+from cdnu.record import Record
+
+RESULT_CACHE_DIR = '.result_cache'
+
+
+class CachedResult(NamedTuple):
+
+    sample_json: dict
+    """Codon usage statistics as stored to stats/<population>/<sample>.json."""
+    cds_counts: Optional[CdsCodonCounts] = None
+    """Per CDS codon counts, if they were computed."""
+
+
+class ResultCache:
+    """Results of samples stored in a local directory under content
+    addressed keys, see :meth:`key`. Once the files of all results exceed
+    :param:`max_bytes`, the least recently used ones are removed.
+
+    The cache may be shared by concurrently running processes.
+
+    :param parameters: JSON serializable parameters of the computation
+        which affect results, e.g. options of CDS loading
+    :param sources: paths of source files of the computation, results are
+        not reused once any of them changes. Sources of the cdnu package by
+        default.
+    """
+
+    def __init__(self, directory: str = RESULT_CACHE_DIR,
+                 max_bytes: Optional[int] = None,
+                 ccds_list: Iterable[CdsPos] = (),
+                 parameters: Optional[dict] = None,
+                 sources: Optional[Iterable[str]] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if sources is None:
+            sources = package_sources()
+        digest = hashlib.sha256()
+        digest.update(json.dumps(parameters or {},
+                                 sort_keys=True).encode('utf-8'))
+        digest.update(ccds_digest(ccds_list).encode('ascii'))
+        digest.update(source_digest(sources).encode('ascii'))
+        self._salt = digest.hexdigest()
+
+    def key(self, record: Record) -> Optional[str]:
+        """Return key of results of a sample derived from the checksum of
+        its CRAM file, the CCDS, the parameters and the sources. None is
+        returned if the checksum is not known."""
+        if record.md5 is None:
+            return None
+        return hashlib.sha256('{}:{}'.format(
+            self._salt, record.md5.lower()).encode('ascii')).hexdigest()
+
+    def get(self, record: Record) -> Optional[CachedResult]:
+        """Return cached results of a sample or None."""
+        path = self._path(record)
+        if path is None:
+            return None
+        try:
+            data = np.load(path)
+        except FileNotFoundError:
+            return None
+
+        with data:
+            sample_json = json.loads(data['sample_json'].tobytes())
+            cds_counts = None
+            if 'indptr' in data:
+                cds_counts = CdsCodonCounts(
+                    **{f: data[f] for f in CdsCodonCounts._fields})
+        # The modification time orders entries by their last use.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process meanwhile.
+            pass
+        return CachedResult(sample_json, cds_counts)
+
+    def put(self, record: Record, result: CachedResult):
+        """Store results of a sample (nothing is stored if the sample has no
+        key) and evict the least recently used results."""
+        path = self._path(record)
+        if path is None:
+            return
+
+        arrays = {
+            'sample_json': np.frombuffer(
+                json.dumps(result.sample_json).encode('utf-8'),
+                dtype=np.uint8),
+        }
+        if result.cds_counts is not None:
+            arrays.update(result.cds_counts._asdict())
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp.npz'.format(path, os.getpid())
+        np.savez_compressed(tmp_path, **arrays)
+        os.rename(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used results until all results fit to
+        :attr:`max_bytes`."""
+        if self.max_bytes is None:
+            return
+
+        entries = []
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir():
+                continue
+            for entry in os.scandir(subdirectory.path):
+                if not entry.name.endswith('.npz') \
+                        or entry.name.endswith('.tmp.npz'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Evicted by another process.
+                pass
+            total -= size
+
+    def _path(self, record: Record) -> Optional[str]:
+        key = self.key(record)
+        if key is None:
+            return None
+        return os.path.join(self.directory, key[:2], key + '.npz')
+
+
+def ccds_digest(ccds_list: Iterable[CdsPos]) -> str:
+    """Return hex SHA-256 digest of CDS locations (in the given order)."""
+    digest = hashlib.sha256()
+    for cds in ccds_list:
+        digest.update(json.dumps([cds.ccds_id, cds.molecule, cds.strand,
+                                  [list(i) for i in cds.indexes]]
+                                 ).encode('ascii'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def source_digest(paths: Iterable[str]) -> str:
+    """Return hex SHA-256 digest of contents of files (in the given
+    order)."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest.update(hashlib.sha256(content).digest())
+    return digest.hexdigest()
+
+
+def package_sources() -> List[str]:
+    """Return sorted paths of Python source files of the cdnu package."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return sorted(os.path.join(directory, name)
+                  for name in os.listdir(directory) if name.endswith('.py'))
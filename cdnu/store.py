@@ -0,0 +1,350 @@
+import fcntl
+import json
+import os
+import posixpath
+import tarfile
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from cdnu.codons import CODONS
+
+COUNTS_FILE = 'counts.bin'
+"""Codon counts, one row of 64 little-endian uint64 values (in order of
+:const:`cdnu.codons.CODONS`) per sample."""
+SAMPLES_FILE = 'samples.tsv'
+"""Sample name, population, number of CDS and number of processed CDS, one
+line per row of the counts file."""
+AGGREGATE_FILE = 'aggregate.npz'
+"""Running statistics of all samples, see :class:`Aggregate`."""
+LOCK_FILE = 'lock'
+COUNTS_DTYPE = np.dtype('<u8')
+ROW_SIZE = len(CODONS) * COUNTS_DTYPE.itemsize
+
+
+class SampleMatrix(NamedTuple):
+    """Codon counts of all samples in a store."""
+
+    counts: np.ndarray
+    """(samples x 64) matrix of codon counts."""
+    sample_names: List[str]
+    populations: np.ndarray
+    """Index of population (see :attr:`population_names`) of each
+    sample."""
+    population_names: List[str]
+    """Population names in order of their first appearance."""
+    num_cds: np.ndarray
+    num_processed_cds: np.ndarray
+
+
+class Aggregate:
+    """Per population running statistics of codon usage (counts normalized
+    to usage per thousand codons) updated with Welford's algorithm, one
+    sample at a time.
+
+    :ivar rows: number of store rows which were added to the statistics
+    :ivar population_names: population names in order of their first
+        appearance
+    :ivar num_samples: number of samples of each population
+    :ivar counts: (populations x 64) codon counts summed over all samples
+    :ivar mean: (populations x 64) mean codon usage
+    :ivar m2: (populations x 64) sums of squared differences from the mean
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.population_names = []
+        self.num_samples = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros((0, len(CODONS)), dtype=COUNTS_DTYPE)
+        self.mean = np.zeros((0, len(CODONS)))
+        self.m2 = np.zeros((0, len(CODONS)))
+
+    @classmethod
+    def from_matrix(cls, matrix: 'SampleMatrix') -> 'Aggregate':
+        aggregate = cls()
+        for population, counts in zip(matrix.populations, matrix.counts):
+            aggregate.add(matrix.population_names[population], counts)
+        aggregate.rows = len(matrix.counts)
+        return aggregate
+
+    def add(self, population: str, counts: np.ndarray):
+        """Add a sample. Samples without any codons are skipped, their usage
+        is undefined."""
+        if not np.any(counts):
+            return
+        index = self._population_index(population)
+        usage = _usage(counts)
+        self.num_samples[index] += 1
+        self.counts[index] += counts
+        delta = usage - self.mean[index]
+        self.mean[index] += delta / self.num_samples[index]
+        self.m2[index] += delta * (usage - self.mean[index])
+
+    def remove(self, population: str, counts: np.ndarray):
+        """Remove a previously added sample."""
+        if not np.any(counts):
+            return
+        index = self.population_names.index(population)
+        usage = _usage(counts)
+        self.num_samples[index] -= 1
+        self.counts[index] -= counts.astype(COUNTS_DTYPE)
+        if self.num_samples[index] == 0:
+            self.mean[index] = 0
+            self.m2[index] = 0
+            return
+        delta = usage - self.mean[index]
+        self.mean[index] -= delta / self.num_samples[index]
+        self.m2[index] -= delta * (usage - self.mean[index])
+
+    def mean_usage(self) -> np.ndarray:
+        """Return usage of codons summed over all samples."""
+        return _usage(self.counts.sum(axis=0))
+
+    def variances(self) -> np.ndarray:
+        """Return (populations x 64) matrix of sample variances of codon
+        usage within each population."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.m2 / (self.num_samples[:, np.newaxis] - 1)
+
+    def total_variances(self) -> np.ndarray:
+        """Return sample variances of codon usage of all samples."""
+        num_samples = self.num_samples[:, np.newaxis]
+        total = num_samples.sum()
+        mean = (num_samples * self.mean).sum(axis=0) / total
+        m2 = (self.m2 + num_samples * (self.mean - mean) ** 2).sum(axis=0)
+        return m2 / (total - 1)
+
+    def save(self, file_path: str):
+        tmp_file_path = file_path + '.tmp.npz'
+        np.savez(tmp_file_path, rows=self.rows,
+                 population_names=np.array(self.population_names,
+                                           dtype=np.str_),
+                 num_samples=self.num_samples, counts=self.counts,
+                 mean=self.mean, m2=self.m2)
+        os.rename(tmp_file_path, file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'Aggregate':
+        aggregate = cls()
+        with np.load(file_path) as data:
+            aggregate.rows = int(data['rows'])
+            aggregate.population_names = data['population_names'].tolist()
+            aggregate.num_samples = data['num_samples']
+            aggregate.counts = data['counts']
+            aggregate.mean = data['mean']
+            aggregate.m2 = data['m2']
+        return aggregate
+
+    def _population_index(self, population: str) -> int:
+        if population not in self.population_names:
+            self.population_names.append(population)
+            self.num_samples = np.append(self.num_samples, 0)
+            self.counts = np.vstack((self.counts, np.zeros(
+                (1, len(CODONS)), dtype=COUNTS_DTYPE)))
+            self.mean = np.vstack((self.mean, np.zeros((1, len(CODONS)))))
+            self.m2 = np.vstack((self.m2, np.zeros((1, len(CODONS)))))
+        return self.population_names.index(population)
+
+
+def is_store(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, COUNTS_FILE))
+
+
+def append_sample(store_path: str, sample_name: str, population: str,
+                  sample_json: dict):
+    """Append a sample (as produced by codon_usage.py) to a store. The
+    store is created if it does not exist. Concurrent appends from multiple
+    processes are safe."""
+    append_samples(store_path, [(population, sample_name, sample_json)])
+
+
+def append_samples(store_path: str,
+                   samples: Iterable[Tuple[str, str, dict]]):
+    """Append (population, sample name, sample JSON) samples to a store, see
+    :func:`append_sample`."""
+    rows = []
+    lines = []
+    for population, sample_name, sample_json in samples:
+        rows.append([sample_json['triplets'][c] for c in CODONS])
+        lines.append('\t'.join((
+            sample_name, population, str(sample_json['numCds']),
+            str(sample_json['numProcessedCds']))) + '\n')
+    rows = np.array(rows, dtype=COUNTS_DTYPE).reshape(-1, len(CODONS))
+
+    with _locked(store_path):
+        samples_path = os.path.join(store_path, SAMPLES_FILE)
+        stored_lines = _read_sample_lines(samples_path)
+
+        # Drop rows or a partial line which were not completely written
+        # (e.g. due to a crash).
+        with open(os.path.join(store_path, COUNTS_FILE), 'ab') as fp:
+            fp.truncate(len(stored_lines) * ROW_SIZE)
+            fp.write(rows.tobytes())
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        with open(samples_path, 'ab') as fp:
+            fp.truncate(sum(len(line.encode('utf-8')) + 1
+                            for line in stored_lines))
+            fp.write(''.join(lines).encode('utf-8'))
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        aggregate = _load_aggregate(
+            store_path, stored_lines + [line[:-1] for line in lines])
+        aggregate.save(os.path.join(store_path, AGGREGATE_FILE))
+
+
+def load_store(store_path: str) -> SampleMatrix:
+    """Load all samples from a store. Codon counts are memory-mapped unless
+    some samples are stored multiple times, in which case only the last
+    occurrence of each sample is kept."""
+    lines = _read_sample_lines(os.path.join(store_path, SAMPLES_FILE))
+    counts_path = os.path.join(store_path, COUNTS_FILE)
+    num_samples = min(len(lines), os.path.getsize(counts_path) // ROW_SIZE)
+    lines = lines[:num_samples]
+
+    if num_samples:
+        counts = np.memmap(counts_path, dtype=COUNTS_DTYPE, mode='r',
+                           shape=(num_samples, len(CODONS)))
+    else:
+        counts = np.zeros((0, len(CODONS)), dtype=COUNTS_DTYPE)
+
+    fields = [line.split('\t') for line in lines]
+    last_rows = {f[0]: i for i, f in enumerate(fields)}
+    if len(last_rows) < num_samples:
+        rows = sorted(last_rows.values())
+        counts = counts[rows]
+        fields = [fields[i] for i in rows]
+
+    population_names = list(dict.fromkeys(f[1] for f in fields))
+    population_indexes = {p: i for i, p in enumerate(population_names)}
+
+    return SampleMatrix(
+        counts=counts,
+        sample_names=[f[0] for f in fields],
+        populations=np.array([population_indexes[f[1]] for f in fields],
+                             dtype=np.intp),
+        population_names=population_names,
+        num_cds=np.array([int(f[2]) for f in fields], dtype=np.int64),
+        num_processed_cds=np.array([int(f[3]) for f in fields],
+                                   dtype=np.int64),
+    )
+
+
+def load_aggregate(store_path: str) -> Aggregate:
+    """Load running statistics of all samples of a store. Samples stored
+    multiple times are counted only once, with the last stored values."""
+    lines = _read_sample_lines(os.path.join(store_path, SAMPLES_FILE))
+    return _load_aggregate(store_path, lines)
+
+
+def rebuild_aggregate(store_path: str) -> Aggregate:
+    """Recompute running statistics of a store from all its samples and
+    store them."""
+    with _locked(store_path):
+        lines = _read_sample_lines(os.path.join(store_path, SAMPLES_FILE))
+        aggregate = _load_aggregate(store_path, lines, Aggregate())
+        aggregate.save(os.path.join(store_path, AGGREGATE_FILE))
+    return aggregate
+
+
+def import_stats(stats_path: str, store_path: str) -> int:
+    """Append samples stored as stats/<population>/<sample>.json files
+    either in a directory or in a (possibly compressed) tar archive to a
+    store.
+
+    :return: number of imported samples
+    """
+    samples = list(iter_stats(stats_path))
+    append_samples(store_path, samples)
+    return len(samples)
+
+
+def iter_stats(stats_path: str) -> Iterator[Tuple[str, str, dict]]:
+    """Iterate over (population, sample name, sample JSON) of samples
+    stored as <population>/<sample>.json files in a directory or a tar
+    archive."""
+    if os.path.isdir(stats_path):
+        for dirpath, dirnames, filenames in os.walk(stats_path):
+            dirnames.sort()
+            _, population = os.path.split(dirpath)
+            for filename in sorted(filenames):
+                sample_name, extension = os.path.splitext(filename)
+                if extension != '.json':
+                    continue
+                with open(os.path.join(dirpath, filename)) as fp:
+                    yield population, sample_name, json.load(fp)
+        return
+
+    with tarfile.open(stats_path) as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            dirname, filename = posixpath.split(member.name)
+            sample_name, extension = posixpath.splitext(filename)
+            if extension != '.json' or filename.startswith('.'):
+                continue
+            population = posixpath.basename(dirname)
+            with tar.extractfile(member) as fp:
+                yield population, sample_name, json.load(fp)
+
+
+def _load_aggregate(store_path: str, lines: List[str],
+                    aggregate: Optional[Aggregate] = None) -> Aggregate:
+    """Add rows of a store which were not added yet (e.g. due to a crash)
+    to stored (or the given) statistics."""
+    if aggregate is None:
+        aggregate_path = os.path.join(store_path, AGGREGATE_FILE)
+        if os.path.exists(aggregate_path):
+            aggregate = Aggregate.load(aggregate_path)
+        else:
+            aggregate = Aggregate()
+
+    counts_path = os.path.join(store_path, COUNTS_FILE)
+    num_rows = min(len(lines), os.path.getsize(counts_path) // ROW_SIZE)
+    if aggregate.rows >= num_rows:
+        return aggregate
+
+    counts = np.memmap(counts_path, dtype=COUNTS_DTYPE, mode='r',
+                       shape=(num_rows, len(CODONS)))
+    fields = [line.split('\t', 2)[:2] for line in lines[:num_rows]]
+    last_rows = {f[0]: i for i, f in enumerate(fields[:aggregate.rows])}
+
+    for row in range(aggregate.rows, num_rows):
+        sample_name, population = fields[row]
+        previous = last_rows.get(sample_name)
+        if previous is not None:
+            aggregate.remove(fields[previous][1], counts[previous])
+        aggregate.add(population, counts[row])
+        last_rows[sample_name] = row
+
+    aggregate.rows = num_rows
+    return aggregate
+
+
+def _usage(counts: np.ndarray) -> np.ndarray:
+    counts = np.asarray(counts, dtype=np.float64)
+    return 1000 * counts / counts.sum()
+
+
+def _read_sample_lines(samples_path: str) -> List[str]:
+    if not os.path.exists(samples_path):
+        return []
+    with open(samples_path, encoding='utf-8', newline='\n') as fp:
+        content = fp.read()
+    # The last line is either empty or it was not completely written due to
+    # a crash.
+    return content.split('\n')[:-1]
+
+
+@contextmanager
+def _locked(store_path: str):
+    os.makedirs(store_path, exist_ok=True)
+    with open(os.path.join(store_path, LOCK_FILE), 'w') as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
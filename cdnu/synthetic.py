@@ -0,0 +1,127 @@
+"""Synthetic reference aligned CRAM files and CCDS tables for tests and
+benchmarks."""
+
+import os
+import random
+from typing import Dict, List, Tuple
+
+import pysam
+
+from cdnu.ccds import CdsPos
+from cdnu.cram import COMPLEMENT
+
+
+def random_sequence(length: int, rng: random.Random) -> str:
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+
+def random_genes(num_genes: int, exons_per_gene: int, rng: random.Random,
+                 exon_length: int = 150, intron_length: int = 300,
+                 num_molecules: int = 2
+                 ) -> Tuple[Dict[str, str], List[CdsPos]]:
+    """Generate random molecules with genes and return the molecules
+    (mapping of molecule name to its sequence) and CDS of the genes.
+
+    Genes are spread evenly over the molecules, every other gene is on the -
+    strand. Each CDS starts with ATG and ends with a stop codon (on its
+    strand). :param:`exon_length` should be a multiple of three.
+    """
+    molecules = ['chr{}'.format(i + 1) for i in range(num_molecules)]
+    sequences = {molecule: [] for molecule in molecules}
+    cds_list = []
+
+    for gene in range(num_genes):
+        molecule = molecules[gene % num_molecules]
+        parts = sequences[molecule]
+        position = sum(len(p) for p in parts)
+
+        exons = [random_sequence(exon_length, rng)
+                 for _ in range(exons_per_gene)]
+        cds = ''.join(exons)
+        cds = 'ATG' + cds[3:-3] + rng.choice(('TAG', 'TAA', 'TGA'))
+        strand = '+-'[gene % 2]
+        if strand == '-':
+            cds = cds.encode('ascii').translate(COMPLEMENT)[::-1]
+            cds = cds.decode('ascii')
+
+        indexes = []
+        for exon in range(exons_per_gene):
+            parts.append(random_sequence(intron_length, rng))
+            position += intron_length
+            parts.append(cds[exon * exon_length:(exon + 1) * exon_length])
+            indexes.append((position, position + exon_length))
+            position += exon_length
+
+        cds_list.append(CdsPos('CCDS{}.1'.format(gene + 1), indexes,
+                               molecule, strand))
+
+    references = {
+        molecule: ''.join(parts) + random_sequence(intron_length, rng)
+        for molecule, parts in sequences.items()
+    }
+    return references, cds_list
+
+
+def write_ccds(file_path: str, cds_list: List[CdsPos]):
+    """Write CDS to a file in the format of CCDS.current.txt."""
+    with open(file_path, 'w', encoding='utf-8', newline='\n') as fp:
+        fp.write('#chromosome\tnc_accession\tgene\tgene_id\tccds_id\t'
+                 'ccds_status\tcds_strand\tcds_from\tcds_to\t'
+                 'cds_locations\tmatch_type\n')
+        for cds in cds_list:
+            locations = ', '.join('{}-{}'.format(start, stop - 1)
+                                  for start, stop in cds.indexes)
+            fp.write('\t'.join((
+                cds.molecule[3:], 'NC_000000.0', cds.ccds_id, '0',
+                cds.ccds_id, 'Public', cds.strand,
+                str(cds.indexes[0][0]), str(cds.indexes[-1][1] - 1),
+                '[{}]'.format(locations), 'Identical')) + '\n')
+
+
+def write_cram(directory: str, references: Dict[str, str],
+               read_length: int = 100, step: int = 30,
+               reads_per_slice: int = 10000,
+               embed_reference: bool = True) -> str:
+    """Write a CRAM file with reads tiled over :param:`references` (mapping
+    of molecule name to its sequence) and return its path.
+
+    Every read is an exact copy of the reference, reads start every
+    :param:`step` bases. The reference is embedded into the CRAM file so it
+    can be decoded without external reference, unless
+    :param:`embed_reference` is False. The reference is stored to
+    reference.fa in :param:`directory` in either case. Each container holds
+    a single slice of at most :param:`reads_per_slice` reads.
+    """
+    fasta_path = os.path.join(directory, 'reference.fa')
+    with open(fasta_path, 'w', encoding='ascii', newline='\n') as fp:
+        for name, sequence in references.items():
+            fp.write('>{}\n{}\n'.format(name, sequence))
+    pysam.faidx(fasta_path)
+
+    header = {
+        'HD': {'VN': '1.6', 'SO': 'coordinate'},
+        'SQ': [{'SN': n, 'LN': len(s)} for n, s in references.items()],
+    }
+    cram_path = os.path.join(directory, 'sample.cram')
+    with pysam.AlignmentFile(cram_path, 'wc', header=header,
+                             reference_filename=fasta_path,
+                             format_options=[
+                                 b'embed_ref=%d' % embed_reference,
+                                 b'seqs_per_slice=%d' % reads_per_slice,
+                             ]) as cram:
+        for reference_id, sequence in enumerate(references.values()):
+            for start in range(0, len(sequence) - read_length + 1, step):
+                read = pysam.AlignedSegment()
+                read.query_name = 'r{}_{}'.format(reference_id, start)
+                read.query_sequence = sequence[start:start + read_length]
+                read.flag = 0
+                read.reference_id = reference_id
+                read.reference_start = start
+                read.mapping_quality = 60
+                read.cigartuples = [(0, read_length)]
+                read.query_qualities = pysam.qualitystring_to_array(
+                    'I' * read_length)
+                cram.write(read)
+
+    pysam.index(cram_path)
+    return cram_path
@@ -1,100 +1,709 @@
 #!/usr/bin/env python3
 
+"""Compute codon usage statistics of all samples from index.json.
+
+Usage:
+  codon_usage.py [--workers=<n>] [--streaming] [--load-workers=<n>]
+                 [--threads=<n>] [--prefetch=<n>] [--staging-size=<gib>]
+                 [--batch-size=<n>]
+                 [--remote] [--range-cache=<path>] [--segments=<n>]
+                 [--per-cds] [--consensus] [--min-depth=<n>]
+                 [--min-base-quality=<q>] [--metrics=<path>]
+                 [--profile=<dir>] [--manifest=<path>] [--lease=<s>]
+                 [--reference=<fasta> | --ref-cache=<dir>]
+                 [--result-cache=<dir> | --no-result-cache]
+                 [--result-cache-size=<gib>]
+  codon_usage.py (-h | --help)
+
+Options:
+  -h --help           Show this screen.
+  --workers=<n>       Number of samples processed concurrently [default: 1].
+  --streaming         Read each chromosome in a single sequential pass.
+  --load-workers=<n>  Number of processes loading chromosomes of a single
+                      sample in parallel [default: 1].
+  --threads=<n>       Number of htslib decompression threads per opened CRAM
+                      file [default: 1].
+  --prefetch=<n>      Download samples in background while other samples are
+                      processed, keeping at most <n> samples (including the
+                      ones being processed) on disk. Use at least the number
+                      of workers + 1 to keep all workers busy.
+  --staging-size=<gib>
+                      Limit disk space used by samples downloaded in
+                      background.
+  --batch-size=<n>    Analyze samples downloaded in background in batches,
+                      loading each CDS region from all CRAM files of a
+                      batch at once. Requires --prefetch of at least <n>,
+                      batches are smaller while samples staged for other
+                      workers or --staging-size leave no room for a full
+                      batch. Batches support neither per CDS counts,
+                      streaming nor load workers [default: 1].
+  --remote            Download only CRAM containers overlapping CDS instead
+                      of whole CRAM files.
+  --range-cache=<path>
+                      Directory where CRAM byte ranges downloaded in the
+                      remote mode are cached.
+  --segments=<n>      Number of concurrent connections used to download a
+                      single CRAM file [default: 1].
+  --per-cds           Store also codon counts of each CDS to
+                      cds_stats/<population>/<sample>.npz.
+  --consensus         Call each base by majority of all reads covering it
+                      instead of copying it from the first read.
+  --min-depth=<n>     Minimum number of counted bases at a position of a
+                      called base in the consensus mode [default: 1].
+  --min-base-quality=<q>
+                      Minimum quality of bases counted in the consensus mode
+                      [default: 0].
+  --metrics=<path>    JSON lines file where metrics of each stage of each
+                      sample are appended. A new file in metrics/ is created
+                      for each run by default.
+  --profile=<dir>     Profile loading and counting of CDS of each sample with
+                      cProfile and store the statistics to <dir>, a file
+                      named <sample>.prof per sample. Loading done by load
+                      worker processes is not profiled.
+  --manifest=<path>   Claim samples from a work manifest (an SQLite database)
+                      shared by runs on any number of nodes instead of
+                      processing all samples not in the checkpoint. Samples
+                      from index.json are added to the manifest, the ones in
+                      the checkpoint as processed.
+  --lease=<s>         Seconds after which a sample claimed from the manifest
+                      by a crashed run is claimed again [default: 600].
+  --reference=<fasta> Decode CRAM files with reference sequences from an
+                      indexed FASTA file, see prepare_reference.py.
+  --ref-cache=<dir>   Decode CRAM files with reference sequences from a
+                      local htslib cache directory (keyed by MD5 digests)
+                      only, see prepare_reference.py. By default, sequences
+                      missing in the cache configured by REF_PATH and
+                      REF_CACHE are downloaded from the remote reference
+                      server.
+  --result-cache=<dir>
+                      Directory where results of samples are cached under
+                      keys derived from MD5 checksums of their CRAM files,
+                      the CCDS, options affecting the results and the
+                      source code computing them. Cached samples are not
+                      downloaded [default: .result_cache].
+  --no-result-cache   Neither use nor store cached results.
+  --result-cache-size=<gib>
+                      Least recently used results are removed from the
+                      result cache once it exceeds the size [default: 1].
+"""
+
 import json
 import logging
 import os
-from itertools import product
+import queue
+import time
+from collections import Counter
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                wait)
+from contextlib import ExitStack
+from datetime import datetime
 from tempfile import TemporaryDirectory
 
-from more_itertools import chunked
+from docopt import docopt
 
-from cdnu.ccds import load_ccds
-from cdnu.cram import load_cds_list
+from cdnu.ccds import CdsList, load_ccds_index
+from cdnu.cds_counts import CdsCodonCounter, save_cds_counts
+from cdnu.codons import CODONS, BatchCodonCounter, CodonCounter
+from cdnu.cram import iter_cds_batch, iter_cds_list
 from cdnu.ftp import download_file_from_ftp
+from cdnu.manifest import COMPLETED, FAILED, LEASED, PENDING, WorkManifest
+from cdnu.metrics import MetricsLog, TimedIterator, profiled
+from cdnu.prefetch import Prefetcher
 from cdnu.record import load_index
+from cdnu.reference import use_ref_cache
+from cdnu.result_cache import CachedResult, ResultCache, package_sources
+from cdnu.remote import RangeCache, stage_regions
+from cdnu.store import append_sample
 
 CHECKPOINT_FILE = 'checkpoint.txt'
+"""Names of already processed samples, one per line."""
+STATS_STORE = 'stats.store'
+"""Consolidated codon counts of all samples, see :mod:`cdnu.store`."""
+CDS_STATS_DIR = 'cds_stats'
+"""Directory with per CDS codon counts, see :mod:`cdnu.cds_counts`."""
+METRICS_DIR = 'metrics'
+"""Directory with metrics of runs, see :class:`cdnu.metrics.MetricsLog`."""
+RESULT_LOAD_OPTIONS = ('consensus', 'min_depth', 'min_base_quality')
+"""Options of :func:`cdnu.cram.load_cds_list` which affect results, other
+options only affect how the CDS are loaded."""
 
 
-def main():
+def main(arguments):
     logging.basicConfig(level=logging.INFO, format='%(asctime)s: %(message)s')
+    start = time.perf_counter()
 
-    # Number of already processed records.
-    checkpoint = 0
+    workers = int(arguments['--workers'])
+    assert workers > 0
+    batch_size = int(arguments['--batch-size'])
+    assert batch_size > 0
+    if batch_size > 1:
+        assert int(arguments['--prefetch'] or 0) >= batch_size
+        assert not arguments['--per-cds']
+        assert not arguments['--streaming']
+        assert arguments['--load-workers'] == '1'
+    load_options = {
+        'streaming': arguments['--streaming'],
+        'workers': int(arguments['--load-workers']),
+        'threads': int(arguments['--threads']),
+        'consensus': arguments['--consensus'],
+        'min_depth': int(arguments['--min-depth']),
+        'min_base_quality': int(arguments['--min-base-quality']),
+        'reference': arguments['--reference'],
+    }
+    if arguments['--ref-cache']:
+        # Inherited by all worker processes.
+        use_ref_cache(arguments['--ref-cache'])
+    download_options = {
+        'remote': arguments['--remote'],
+        'range_cache': arguments['--range-cache'],
+        'segments': int(arguments['--segments']),
+    }
+    metrics = MetricsLog(arguments['--metrics'] or os.path.join(
+        METRICS_DIR, datetime.now().strftime('%Y%m%d-%H%M%S.jsonl')))
+    logging.info('Metrics are stored to %s.', metrics.file_path)
+    analysis_options = {
+        'per_cds': arguments['--per-cds'],
+        'metrics': metrics,
+        'profile_dir': arguments['--profile'],
+    }
 
-    if os.path.exists(CHECKPOINT_FILE):
-        with open(CHECKPOINT_FILE) as fp:
-            checkpoint = int(fp.read())
-            assert checkpoint >= 0
-        logging.info('Checkpoint value / number of already process sequences'
-                     ' is %d', checkpoint)
+    records = load_index('index.json')
+    completed = load_checkpoint(records)
+    manifest = None
+    if arguments['--manifest']:
+        manifest = WorkManifest(arguments['--manifest'],
+                                float(arguments['--lease']))
+        num_added = manifest.add_records(records, completed)
+        counts = manifest.counts()
+        logging.info('%d samples added to the manifest, %d processed, %d '
+                     'claimed by other runs, %d pending, %d failed.',
+                     num_added, counts[COMPLETED], counts[LEASED],
+                     counts[PENDING], counts[FAILED])
+        # Records are claimed lazily, just before they are downloaded.
+        records = manifest.iter_claims()
     else:
-        logging.info('No checkpoint found, going to process all samples.')
+        records = [r for r in records if r.sample_name not in completed]
+        logging.info('%d samples already processed, going to process %d '
+                     'samples.', len(completed), len(records))
+    num_processed = 0
+
+    def mark_completed(record):
+        nonlocal num_processed
+        if manifest is None:
+            store_checkpoint(record.sample_name)
+        else:
+            manifest.complete(record.sample_name)
+        num_processed += 1
+
+    def mark_failed(record):
+        # The claim is counted as an attempt, unlike claims of records
+        # handed back unprocessed once the run ends.
+        if manifest is not None:
+            manifest.fail(record.sample_name)
+
+    # Sort the CCDS for faster loading from CRAM file. CDS are converted to
+    # Python objects only while iterated, exons stay memory-mapped and are
+    # shared by worker processes.
+    ccds_list = CdsList(load_ccds_index().sorted_by_position())
+
+    # Records are checked in the result cache as they are taken, by the
+    # prefetch thread if samples are prefetched. Cached results are stored
+    # in this thread, like results of processed records.
+    cached_results = queue.SimpleQueue()
 
-    records = load_index('index.json')[checkpoint:]
-    ccds_list = load_ccds()
+    def store_cached():
+        while not cached_results.empty():
+            record, result, seconds = cached_results.get()
+            start = time.perf_counter()
+            logging.info('Using cached results of %s.', record.sample_name)
+            store_results(record, result)
+            mark_completed(record)
+            metrics.write('cached', seconds + time.perf_counter() - start,
+                          record)
 
-    # Sort the CCDS for faster loading from CRAM file.
-    ccds_list.sort(key=lambda cds: (cds.molecule, cds.indexes[0][0]))
+    result_cache = None
+    if not arguments['--no-result-cache']:
+        parameters = {k: load_options[k] for k in RESULT_LOAD_OPTIONS}
+        parameters['per_cds'] = analysis_options['per_cds']
+        result_cache = ResultCache(
+            arguments['--result-cache'],
+            int(float(arguments['--result-cache-size']) * 2**30),
+            ccds_list, parameters,
+            package_sources() + [os.path.abspath(__file__)])
+        analysis_options['result_cache'] = result_cache
+        records = skip_cached(
+            records, result_cache,
+            lambda *cached: cached_results.put(cached))
 
-    with TemporaryDirectory(prefix='mbg_codon_usage_') as tmp_dir:
+    with ExitStack() as stack:
+        if manifest is not None:
+            # Leases are renewed until the run ends.
+            stack.enter_context(manifest)
+        tmp_dir = stack.enter_context(
+            TemporaryDirectory(prefix='mbg_codon_usage_'))
         logging.info('Created temporary directory %s.', tmp_dir)
 
-        for i, record in enumerate(records):
-            logging.info('[%d/%d] Going to process sample %s...',
-                         i + 1, len(records), record.sample_name)
-            process_record(tmp_dir, record, ccds_list)
-
-            # Store the checkpoint atomically.
-            tmp_checkpoint = CHECKPOINT_FILE + '.tmp'
-            with open(tmp_checkpoint, 'w') as fp:
-                fp.write(str(i + checkpoint + 1))
-            os.rename(tmp_checkpoint, CHECKPOINT_FILE)
-
-
-def process_record(tmp_dir, record, ccds_list):
-    seq_file_path = os.path.join(tmp_dir, 'seq.cram')
-    index_file_path = seq_file_path + '.crai'
-
-    logging.info('Going to download %s...', record.seq_url)
-    download_file_from_ftp(record.seq_url, seq_file_path)
-    logging.info('Going to download %s...', record.index_url)
-    download_file_from_ftp(record.index_url, index_file_path)
-
-    logging.info('Going to load coding sequences from downloaded CRAM file...')
-    stats = {''.join(codon): 0 for codon in product('ATCG', repeat=3)}
-    cds_list = load_cds_list(seq_file_path, ccds_list)
-
-    logging.info('Going to calculate codon usage statistics...')
-    processed_cds = 0
-    for cds in cds_list:
-        if cds is None:
-            continue
-
-        processed_cds += 1
-        for triplet in chunked(cds, 3):
-            if '-' in triplet or 'N' in triplet:
-                continue
-            stats[''.join(triplet)] += 1
-
-    sample_json = {
-        'triplets': stats,
-        'numCds': len(cds_list),
-        'numProcessedCds': processed_cds,
-    }
+        if arguments['--prefetch']:
+            max_bytes = None
+            if arguments['--staging-size']:
+                max_bytes = int(float(arguments['--staging-size']) * 2**30)
+            prefetcher = Prefetcher(
+                records, tmp_dir, int(arguments['--prefetch']), max_bytes,
+                stage=lambda record, directory: download_record(
+                    directory, record, ccds_list, metrics=metrics,
+                    **download_options))
+
+            def on_completed(staged):
+                prefetcher.release(staged)
+                mark_completed(staged.record)
+
+            def on_batch_completed(batch):
+                for staged in batch:
+                    on_completed(staged)
+
+            def on_batch_failed(batch):
+                for staged in batch:
+                    mark_failed(staged.record)
+
+            with prefetcher:
+                if batch_size > 1:
+                    jobs = (
+                        (analyze_staged_batch,
+                         (batch, load_options, analysis_options), batch)
+                        for batch in iter_batches(prefetcher, batch_size,
+                                                  prefetcher.needs_release)
+                    )
+                    run_jobs(iter_with_callback(jobs, store_cached),
+                             ccds_list, workers, on_batch_completed,
+                             lambda: not prefetcher.needs_release(),
+                             on_batch_failed)
+                else:
+                    jobs = (
+                        (analyze_staged_record,
+                         (staged, load_options, analysis_options), staged)
+                        for staged in prefetcher
+                    )
+                    run_jobs(iter_with_callback(jobs, store_cached),
+                             ccds_list, workers, on_completed,
+                             lambda: not prefetcher.needs_release(),
+                             lambda staged: mark_failed(staged.record))
+        else:
+            jobs = (
+                (process_record_in_worker,
+                 (tmp_dir, record, load_options, download_options,
+                  analysis_options),
+                 record)
+                for record in records
+            )
+            run_jobs(iter_with_callback(jobs, store_cached), ccds_list,
+                     workers, mark_completed, on_failed=mark_failed)
+
+    if manifest is not None:
+        counts = manifest.counts()
+        if counts[FAILED]:
+            logging.warning('%d samples failed %d times and are not going '
+                            'to be claimed again.', counts[FAILED],
+                            manifest.max_attempts)
+
+    metrics.write('run', time.perf_counter() - start, samples=num_processed,
+                  workers=workers)
+
+
+def skip_cached(records, result_cache, on_cached):
+    """Yield records without cached results. :param:`on_cached` is called
+    with each cached record, its :class:`cdnu.result_cache.CachedResult` and
+    seconds spent by reading it, in the thread iterating the records."""
+    for record in records:
+        start = time.perf_counter()
+        cached = result_cache.get(record)
+        if cached is None:
+            yield record
+        else:
+            on_cached(record, cached, time.perf_counter() - start)
+
+
+def iter_with_callback(items, callback):
+    """Yield items, :param:`callback` is called after each item is taken
+    and once the items are exhausted."""
+    for item in items:
+        callback()
+        yield item
+    callback()
+
+
+def run_jobs(jobs, ccds_list, workers, on_completed, can_submit=None,
+             on_failed=None):
+    """Run (function, args, key) jobs in a pool of :param:`workers`
+    processes, or in this process if there is a single worker.
+    :param:`on_completed` is called with the job key as soon as the job is
+    completed, regardless of the order.
+
+    :param can_submit: function called before a job is taken from
+        :param:`jobs` while other jobs are pending. If it returns False, a
+        pending job is awaited first, e.g. because taking the job would block
+        until :param:`on_completed` frees resources.
+    :param on_failed: function called with the key of a job which raised an
+        exception, before the exception is propagated.
+    """
+    init_worker(ccds_list)
+    num_completed = 0
+
+    if workers == 1:
+        for function, args, key in jobs:
+            try:
+                function(*args)
+            except BaseException:
+                if on_failed is not None:
+                    on_failed(key)
+                raise
+            num_completed += 1
+            logging.info('[%d] Job has been completed.', num_completed)
+            on_completed(key)
+        return
+
+    jobs = iter(jobs)
+    pending = {}
+
+    with ProcessPoolExecutor(workers, initializer=init_worker,
+                             initargs=(ccds_list,)) as pool:
+        while True:
+            # Submit only as many jobs as there are workers, so a failure
+            # stops the pipeline early.
+            while len(pending) < workers and (
+                    not pending or can_submit is None or can_submit()):
+                job = next(jobs, None)
+                if job is None:
+                    break
+                function, args, key = job
+                pending[pool.submit(function, *args)] = key
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                if future.exception() is not None:
+                    if on_failed is not None:
+                        on_failed(key)
+                    future.result()
+                num_completed += 1
+                logging.info('[%d] Job has been completed.', num_completed)
+                on_completed(key)
+
+
+_worker_ccds_list = None
+
+
+def init_worker(ccds_list):
+    global _worker_ccds_list
+    _worker_ccds_list = ccds_list
+
+
+def process_record_in_worker(tmp_dir, record, load_options,
+                             download_options, analysis_options):
+    with TemporaryDirectory(dir=tmp_dir) as sample_dir:
+        process_record(sample_dir, record, _worker_ccds_list, load_options,
+                       download_options, **analysis_options)
+
+
+def analyze_staged_record(staged, load_options, analysis_options):
+    analyze_record(staged.seq_file_path, staged.record, _worker_ccds_list,
+                   load_options, **analysis_options)
+
+
+def analyze_staged_batch(batch, load_options, analysis_options):
+    analyze_batch([staged.seq_file_path for staged in batch],
+                  [staged.record for staged in batch], _worker_ccds_list,
+                  load_options, **analysis_options)
+
+
+def iter_batches(items, batch_size, flush=None):
+    """Group items to lists of :param:`batch_size` items, the last list may
+    be shorter.
 
+    :param flush: function called after an item is added to an incomplete
+        list. If it returns True, the list is yielded as it is, e.g. because
+        the next item would not be available until the list is processed.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size or (flush is not None and flush()):
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_checkpoint(records):
+    """Return a set of names of already processed samples.
+
+    Checkpoint in the legacy format, i.e. number of processed records from
+    the beginning of the index, is converted to the current format.
+    """
+    if not os.path.exists(CHECKPOINT_FILE):
+        logging.info('No checkpoint found, going to process all samples.')
+        return set()
+
+    with open(CHECKPOINT_FILE, encoding='utf-8', newline='\n') as fp:
+        content = fp.read()
+
+    if content.strip().isdigit():
+        checkpoint = int(content)
+        completed = [r.sample_name for r in records[:checkpoint]]
+        logging.info('Converting legacy checkpoint value %d.', checkpoint)
+
+        tmp_checkpoint = CHECKPOINT_FILE + '.tmp'
+        with open(tmp_checkpoint, 'w', encoding='utf-8', newline='\n') as fp:
+            fp.write(''.join(name + '\n' for name in completed))
+        os.rename(tmp_checkpoint, CHECKPOINT_FILE)
+        return set(completed)
+
+    lines = content.split('\n')
+    # The last line is either empty or it was not completely written due to
+    # a crash. The partial line is removed, otherwise the next stored sample
+    # name would be appended to it.
+    if lines[-1]:
+        logging.warning('Removing partial checkpoint line %r.', lines[-1])
+        complete = content[:content.rfind('\n') + 1]
+        os.truncate(CHECKPOINT_FILE, len(complete.encode('utf-8')))
+    return set(lines[:-1])
+
+
+def store_checkpoint(sample_name):
+    """Durably append a sample name to the checkpoint file."""
+    with open(CHECKPOINT_FILE, 'a', encoding='utf-8', newline='\n') as fp:
+        fp.write(sample_name + '\n')
+        fp.flush()
+        os.fsync(fp.fileno())
+
+
+def process_record(tmp_dir, record, ccds_list, load_options=None,
+                   download_options=None, per_cds=False, metrics=None,
+                   profile_dir=None, result_cache=None):
+    """Download a sample and store its codon usage statistics, see
+    :func:`download_record` and :func:`analyze_record`."""
+    seq_file_path = download_record(tmp_dir, record, ccds_list,
+                                    metrics=metrics,
+                                    **(download_options or {}))
+    analyze_record(seq_file_path, record, ccds_list, load_options, per_cds,
+                   metrics, profile_dir, result_cache)
+
+
+def download_record(tmp_dir, record, ccds_list, remote=False,
+                    range_cache=None, segments=1, metrics=None):
+    """Download CRAM file of a sample and its index and return path to the
+    downloaded CRAM file. Checksum of the CRAM file is verified if it is
+    known.
+
+    :param remote: if True, only CRAM containers overlapping CDS from
+        :param:`ccds_list` are downloaded, see
+        :func:`cdnu.remote.stage_regions`.
+    :param range_cache: directory with cached CRAM byte ranges
+    :param segments: number of concurrent connections used to download the
+        CRAM file
+    :param metrics: :class:`cdnu.metrics.MetricsLog` receiving duration of
+        the download and number of downloaded bytes
+    """
+    start = time.perf_counter()
+
+    if remote:
+        logging.info('Going to download CDS regions of %s...', record.seq_url)
+        cache = RangeCache(range_cache)
+        seq_file_path = stage_regions(record.seq_url, record.index_url,
+                                      ccds_list, tmp_dir, cache=cache)
+        num_bytes = cache.bytes_downloaded
+    else:
+        seq_file_path = os.path.join(tmp_dir, 'seq.cram')
+        index_file_path = seq_file_path + '.crai'
+
+        logging.info('Going to download %s...', record.seq_url)
+        download_file_from_ftp(record.seq_url, seq_file_path,
+                               md5=record.md5, segments=segments)
+        logging.info('Going to download %s...', record.index_url)
+        download_file_from_ftp(record.index_url, index_file_path)
+        num_bytes = (os.path.getsize(seq_file_path)
+                     + os.path.getsize(index_file_path))
+
+    if metrics is not None:
+        seconds = time.perf_counter() - start
+        metrics.write('download', seconds, record, bytes=num_bytes,
+                      mb_per_s=round(num_bytes / 1e6 / max(seconds, 1e-9), 3))
+    return seq_file_path
+
+
+def analyze_record(seq_file_path, record, ccds_list, load_options=None,
+                   per_cds=False, metrics=None, profile_dir=None,
+                   result_cache=None):
+    """Store codon usage statistics of an already downloaded sample.
+
+    :param load_options: keyword arguments of
+        :func:`cdnu.cram.load_cds_list`
+    :param per_cds: if True, codon counts of each CDS are stored as well,
+        see :mod:`cdnu.cds_counts`.
+    :param metrics: :class:`cdnu.metrics.MetricsLog` receiving durations
+        and counters of loading, counting and storing
+    :param profile_dir: if given, loading and counting is profiled, see
+        :func:`cdnu.metrics.profiled`
+    :param result_cache: :class:`cdnu.result_cache.ResultCache` where the
+        results are stored
+    """
+    logging.info('Going to load coding sequences from downloaded CRAM file '
+                 'and calculate codon usage statistics...')
+    start = time.perf_counter()
+    load_counters = Counter()
+    # CDS are counted as they are loaded, so they are not kept in memory.
+    # Time spent in the generator is loading, the rest is counting.
+    cds_iter = TimedIterator(iter_cds_list(
+        seq_file_path, ccds_list, remove_invalid=not per_cds,
+        counters=load_counters, **(load_options or {})))
+    profile_path = None
+    if profile_dir is not None:
+        profile_path = os.path.join(profile_dir, record.sample_name + '.prof')
+
+    with profiled(profile_path):
+        if per_cds:
+            cds_counter = CdsCodonCounter()
+            for cds_pos, cds in cds_iter:
+                cds_counter.add(cds_pos, cds)
+            cds_counts = cds_counter.result()
+            stats = dict(zip(CODONS, cds_counts.totals().tolist()))
+            processed_cds = int(cds_counts.valid.sum())
+        else:
+            cds_counts = None
+            counter = CodonCounter()
+            processed_cds = 0
+            for _, cds in cds_iter:
+                if cds is not None:
+                    counter.add(cds)
+                    processed_cds += 1
+            stats = counter.counts()
+
+    count_seconds = time.perf_counter() - start - cds_iter.seconds
+    if metrics is not None:
+        metrics.write('load', cds_iter.seconds, record,
+                      regions=load_counters['regions'],
+                      reads=load_counters['reads'],
+                      cds_valid=processed_cds,
+                      cds_invalid=len(ccds_list) - processed_cds)
+        metrics.write('count', count_seconds, record,
+                      codons=sum(stats.values()))
+
+    start = time.perf_counter()
+    result = CachedResult(
+        sample_json={
+            'triplets': stats,
+            'numCds': len(ccds_list),
+            'numProcessedCds': processed_cds,
+        },
+        cds_counts=cds_counts,
+    )
+    store_results(record, result)
+    if result_cache is not None:
+        result_cache.put(record, result)
+
+    if metrics is not None:
+        metrics.write('store', time.perf_counter() - start, record)
+
+
+def analyze_batch(seq_file_paths, records, ccds_list, load_options=None,
+                  per_cds=False, metrics=None, profile_dir=None,
+                  result_cache=None):
+    """Store codon usage statistics of several already downloaded samples
+    (:param:`records` with CRAM files :param:`seq_file_paths`), loading CDS
+    of all the samples at once (see :func:`cdnu.cram.iter_cds_batch`).
+
+    Parameters are the same as of :func:`analyze_record`, except that
+    :param:`per_cds` is not supported and load options of a single CRAM
+    file (streaming and workers) are ignored. Metrics are written for the
+    whole batch.
+    """
+    assert not per_cds
+    logging.info('Going to load coding sequences of %d samples from '
+                 'downloaded CRAM files and calculate codon usage '
+                 'statistics...', len(records))
+    load_options = {k: v for k, v in (load_options or {}).items()
+                    if k not in ('streaming', 'workers')}
+    start = time.perf_counter()
+    load_counters = Counter()
+    batches = TimedIterator(iter_cds_batch(
+        seq_file_paths, ccds_list, counters=load_counters, **load_options))
+    profile_path = None
+    if profile_dir is not None:
+        profile_path = os.path.join(
+            profile_dir, records[0].sample_name + '-batch.prof')
+
+    with profiled(profile_path):
+        counter = BatchCodonCounter(len(records))
+        for batch in batches:
+            counter.add(batch.sequences, batch.lengths)
+
+    count_seconds = time.perf_counter() - start - batches.seconds
+    all_stats = counter.counts()
+    if metrics is not None:
+        samples = [record.sample_name for record in records]
+        metrics.write('batch_load', batches.seconds, samples=samples,
+                      regions=load_counters['regions'],
+                      reads=load_counters['reads'],
+                      cds_valid=counter.processed_cds.tolist())
+        metrics.write('batch_count', count_seconds, samples=samples,
+                      codons=[sum(stats.values()) for stats in all_stats])
+
+    start = time.perf_counter()
+    for record, stats, processed_cds in zip(records, all_stats,
+                                            counter.processed_cds.tolist()):
+        result = CachedResult(sample_json={
+            'triplets': stats,
+            'numCds': len(ccds_list),
+            'numProcessedCds': processed_cds,
+        })
+        store_results(record, result)
+        if result_cache is not None:
+            result_cache.put(record, result)
+
+    if metrics is not None:
+        metrics.write('batch_store', time.perf_counter() - start,
+                      samples=samples)
+
+
+def store_results(record, result):
+    """Store codon usage statistics (and per CDS codon counts if they are
+    included) of a sample.
+
+    :param result: :class:`cdnu.result_cache.CachedResult`
+    """
+    if result.cds_counts is not None:
+        store_cds_counts(record, result.cds_counts)
+
+    sample_json = result.sample_json
     stats_file_name = record.sample_name + '.json'
     stats_file_dir = os.path.join('stats', record.population)
     stats_file_path = os.path.join(stats_file_dir, stats_file_name)
 
-    if not os.path.exists(stats_file_dir):
-        os.makedirs(stats_file_dir)
+    # Samples may be processed concurrently.
+    os.makedirs(stats_file_dir, exist_ok=True)
 
     logging.info('Sample has been processed, storing stats to %s...',
                  stats_file_path)
-    with open(stats_file_path, 'w', encoding='utf-8', newline='\n') as fp:
+    tmp_stats_file_path = stats_file_path + '.tmp'
+    with open(tmp_stats_file_path, 'w', encoding='utf-8', newline='\n') as fp:
         json.dump(sample_json, fp)
+    os.rename(tmp_stats_file_path, stats_file_path)
+    append_sample(STATS_STORE, record.sample_name, record.population,
+                  sample_json)
+
+
+def store_cds_counts(record, cds_counts):
+    cds_stats_dir = os.path.join(CDS_STATS_DIR, record.population)
+    cds_stats_path = os.path.join(cds_stats_dir, record.sample_name + '.npz')
+
+    # Samples may be processed concurrently.
+    os.makedirs(cds_stats_dir, exist_ok=True)
+
+    logging.info('Storing per CDS codon counts to %s...', cds_stats_path)
+    save_cds_counts(cds_stats_path, cds_counts)
 
 
 if __name__ == '__main__':
-    main()
+    arguments = docopt(__doc__)
+    main(arguments)
@@ -74,7 +74,8 @@ def load_index():
             seq_url=record['ENA_FILE_PATH'],
             index_url='{}.crai'.format(record['ENA_FILE_PATH']),
             sample_name=record['SAMPLE_NAME'],
-            population=record['POPULATION']
+            population=record['POPULATION'],
+            md5=record['MD5SUM']
         )
         for record in records
     ]
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""Store GRCh38 sequences of molecules with CCDS to a local reference cache,
+so CRAM files can be decoded without the remote reference server, see
+--ref-cache and --reference of codon_usage.py.
+
+<fasta> is a path or an FTP / HTTP(S) URL of a FASTA file, by default the
+reference which 1000 Genomes high coverage samples are aligned to.
+
+Usage:
+  prepare_reference.py [<fasta>] [--ref-cache=<dir>] [--output=<fasta>]
+                       [--all]
+  prepare_reference.py (-h | --help)
+
+Options:
+  -h --help          Show this screen.
+  --ref-cache=<dir>  Directory where sequences are stored keyed by their MD5
+                     digests [default: .ref_cache].
+  --output=<fasta>   Store the sequences also to an indexed FASTA file.
+  --all              Store all sequences, not only molecules with CCDS.
+"""
+
+import logging
+import os
+from tempfile import TemporaryDirectory
+
+from docopt import docopt
+
+from cdnu.ccds import load_ccds
+from cdnu.ftp import download_file_from_ftp
+from cdnu.reference import populate_ref_cache, write_reference_subset
+
+REFERENCE_URL = ('ftp://ftp.1000genomes.ebi.ac.uk/vol1/ftp/technical/'
+                 'reference/GRCh38_reference_genome/'
+                 'GRCh38_full_analysis_set_plus_decoy_hla.fa')
+
+
+def main(arguments):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s: %(message)s')
+
+    molecules = None
+    if not arguments['--all']:
+        molecules = sorted({cds.molecule for cds in load_ccds()})
+        logging.info('Going to store %d molecules with CCDS.', len(molecules))
+
+    fasta = arguments['<fasta>'] or REFERENCE_URL
+    with TemporaryDirectory(prefix='mbg_reference_') as tmp_dir:
+        if '://' in fasta:
+            fasta_path = os.path.join(tmp_dir, 'reference.fa')
+            logging.info('Going to download %s...', fasta)
+            download_file_from_ftp(fasta, fasta_path)
+        else:
+            fasta_path = fasta
+
+        logging.info('Storing sequences to %s...', arguments['--ref-cache'])
+        stored = populate_ref_cache(fasta_path, arguments['--ref-cache'],
+                                    molecules)
+        for name, md5 in stored:
+            logging.info('Stored %s (%s).', name, md5)
+
+        if arguments['--output']:
+            logging.info('Storing sequences to %s...', arguments['--output'])
+            write_reference_subset(fasta_path, arguments['--output'],
+                                   [name for name, _ in stored])
+
+    missing = set(molecules or ()) - {name for name, _ in stored}
+    if missing:
+        logging.warning('Molecules missing in the FASTA file: %s.',
+                        ', '.join(sorted(missing)))
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+    main(arguments)
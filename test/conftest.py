@@ -0,0 +1,64 @@
+import os
+import re
+import threading
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+import pytest
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serves files of a directory with support of single byte ranges."""
+
+    def send_head(self):
+        match = re.fullmatch(r'bytes=(\d+)-(\d+)',
+                             self.headers.get('Range', ''))
+        if not match:
+            return super().send_head()
+
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+
+        size = os.path.getsize(path)
+        start, stop = int(match.group(1)), int(match.group(2)) + 1
+        stop = min(stop, size)
+        with open(path, 'rb') as fp:
+            fp.seek(start)
+            data = fp.read(stop - start)
+        self.server.bytes_sent += len(data)
+
+        self.send_response(206)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Range',
+                         'bytes {}-{}/{}'.format(start, stop - 1, size))
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        return None
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    """Return a function which starts a HTTP server serving a directory and
+    returns the server. Server URL is stored in its url attribute."""
+    servers = []
+
+    def start(directory):
+        handler = partial(RangeRequestHandler, directory=directory)
+        server = HTTPServer(('127.0.0.1', 0), handler)
+        server.url = 'http://127.0.0.1:{}/'.format(server.server_port)
+        server.bytes_sent = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
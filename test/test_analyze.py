@@ -0,0 +1,55 @@
+import json
+
+import numpy as np
+
+from analyze import compute_variances, load_matrix, normalize_all
+from cdnu.codons import CODONS
+from cdnu.store import append_sample, load_aggregate, load_store
+from test.test_store import random_sample_json, sample_json
+
+
+def test_load_matrix_directory(tmp_path):
+    for i, population in enumerate(('GBR', 'YRI', 'GBR')):
+        population_dir = tmp_path / population
+        population_dir.mkdir(exist_ok=True)
+        (population_dir / 'S{}.json'.format(i)).write_text(
+            json.dumps(sample_json(i)))
+    # Files left by interrupted writes are skipped.
+    (tmp_path / 'GBR' / 'S3.json.tmp').write_text('{"triplets": {')
+    (tmp_path / 'YRI' / 'S4.json.tmp').write_text(json.dumps(sample_json(4)))
+
+    matrix = load_matrix(str(tmp_path))
+    assert sorted(matrix.population_names) == ['GBR', 'YRI']
+    assert sorted(matrix.sample_names) == ['S0', 'S1', 'S2']
+    for i, sample_name in enumerate(matrix.sample_names):
+        seed = int(sample_name[1:])
+        population = matrix.population_names[matrix.populations[i]]
+        assert population == ('GBR', 'YRI', 'GBR')[seed]
+        assert matrix.counts[i, 0] == seed * 100
+        assert matrix.num_cds[i] == 10 + seed
+
+
+def test_compute_variances(tmp_path):
+    store_path = str(tmp_path / 'stats.store')
+    rng = np.random.RandomState(3)
+    for i in range(12):
+        append_sample(store_path, 'S{}'.format(i), ('GBR', 'YRI')[i % 3 // 2],
+                      random_sample_json(rng))
+    append_sample(store_path, 'S12', 'FIN', {
+        'triplets': {c: 0 for c in CODONS}, 'numCds': 1,
+        'numProcessedCds': 0})
+    matrix = load_store(store_path)
+    aggregate = load_aggregate(store_path)
+
+    total_variances, population_variances = compute_variances(matrix)
+    usage = normalize_all(matrix)[:12]
+    assert np.array_equal(total_variances, usage.var(axis=0, ddof=1))
+    assert np.allclose(total_variances, aggregate.total_variances())
+    # The population without any counted samples is skipped.
+    assert [p for p, _ in population_variances] == ['GBR', 'YRI']
+    for (population, variances), expected in zip(population_variances,
+                                                 aggregate.variances()):
+        assert np.array_equal(variances, usage[
+            matrix.populations[:12] == matrix.population_names.index(
+                population)].var(axis=0, ddof=1))
+        assert np.allclose(variances, expected)
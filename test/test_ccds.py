@@ -0,0 +1,117 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from cdnu.ccds import (CdsList, CdsPos, load_ccds, load_ccds_index,
+                       parse_ccds)
+
+CCDS_HEADER = ('#chromosome\tnc_accession\tgene\tgene_id\tccds_id\t'
+               'ccds_status\tcds_strand\tcds_from\tcds_to\tcds_locations\t'
+               'match_type\n')
+
+
+def ccds_line(chromosome, ccds_id, strand, locations, status='Public'):
+    return '\t'.join((
+        chromosome, 'NC_000001.11', 'GENE', '1', ccds_id, status, strand,
+        '0', '0', locations, 'Identical')) + '\n'
+
+
+def write_ccds(path, lines):
+    with open(path, 'w', encoding='utf-8', newline='\n') as fp:
+        fp.write(CCDS_HEADER)
+        fp.writelines(lines)
+
+
+def test_load_ccds(tmp_path):
+    ccds_file = str(tmp_path / 'CCDS.txt')
+    write_ccds(ccds_file, [
+        ccds_line('1', 'CCDS1.1', '+', '[100-159, 300-329]'),
+        ccds_line('1', 'CCDS2.1', '+', '[100-160]'),
+        ccds_line('1', 'CCDS3.1', '+', '-'),
+        ccds_line('2', 'CCDS4.1', '+', '[10-18]', status='Withdrawn'),
+        ccds_line('X', 'CCDS5.2', '+', '[1000-1008]'),
+        ccds_line('2', 'CCDS7.1', '-', '[20-25, 40-42]'),
+    ])
+
+    expected = [
+        CdsPos('CCDS1.1', [(100, 160), (300, 330)], 'chr1'),
+        CdsPos('CCDS5.2', [(1000, 1009)], 'chrX'),
+        CdsPos('CCDS7.1', [(20, 26), (40, 43)], 'chr2', '-'),
+    ]
+    assert parse_ccds(ccds_file) == expected
+    assert load_ccds(ccds_file, cache_dir=None) == expected
+
+    cache_dir = str(tmp_path / 'cache')
+    assert load_ccds(ccds_file, cache_dir) == expected
+    assert len(os.listdir(cache_dir)) == 1
+    # Compiled files are used.
+    assert load_ccds(ccds_file, cache_dir) == expected
+    index = load_ccds_index(ccds_file, cache_dir)
+    assert len(index.cds) == 3
+    assert index.cds_pos(1) == expected[1]
+    assert index.cds_pos(2) == expected[2]
+
+    # Compiled files are rebuilt once the CCDS file changes.
+    write_ccds(ccds_file, [ccds_line('Y', 'CCDS6.1', '+', '[5-7]')])
+    assert load_ccds(ccds_file, cache_dir) == [
+        CdsPos('CCDS6.1', [(5, 8)], 'chrY')]
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_load_ccds_empty(tmp_path):
+    ccds_file = str(tmp_path / 'CCDS.txt')
+    write_ccds(ccds_file, [])
+    assert load_ccds(ccds_file, str(tmp_path / 'cache')) == []
+
+
+def test_load_ccds_index_cleanup(tmp_path):
+    ccds_file = str(tmp_path / 'CCDS.txt')
+    cache_dir = tmp_path / 'cache'
+    write_ccds(ccds_file, [ccds_line('1', 'CCDS1.1', '+', '[100-1x9]')])
+    with pytest.raises(ValueError):
+        load_ccds_index(ccds_file, str(cache_dir))
+    assert not cache_dir.exists() or os.listdir(str(cache_dir)) == []
+
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    dead = cache_dir / 'other-v2.{}.tmp'.format(process.pid)
+    running = cache_dir / 'other-v2.{}.tmp'.format(os.getpid())
+    dead.mkdir(parents=True)
+    running.mkdir()
+
+    write_ccds(ccds_file, [ccds_line('1', 'CCDS1.1', '+', '[100-159]')])
+    load_ccds_index(ccds_file, str(cache_dir))
+    assert not dead.exists()
+    assert running.exists()
+    assert len(os.listdir(str(cache_dir))) == 2
+
+
+def test_cds_list(tmp_path):
+    ccds_file = str(tmp_path / 'CCDS.txt')
+    write_ccds(ccds_file, [
+        ccds_line('2', 'CCDS1.1', '+', '[500-559, 600-629]'),
+        ccds_line('1', 'CCDS2.1', '+', '[300-359]'),
+        ccds_line('10', 'CCDS3.1', '-', '[20-25, 40-42, 50-52]'),
+        ccds_line('1', 'CCDS4.1', '-', '[100-159]'),
+        ccds_line('2', 'CCDS5.1', '+', '[500-511]'),
+    ])
+    expected = parse_ccds(ccds_file)
+    expected.sort(key=lambda cds: (cds.molecule, cds.indexes[0][0]))
+
+    index = load_ccds_index(ccds_file, str(tmp_path / 'cache'))
+    cds_list = CdsList(index.sorted_by_position())
+    assert len(cds_list) == 5
+    assert list(cds_list) == expected
+    assert cds_list[1] == expected[1]
+    assert cds_list[-1] == expected[-1]
+    assert cds_list[1:4] == expected[1:4]
+    with pytest.raises(IndexError):
+        cds_list[5]
+
+    CdsList.CHUNK_SIZE = 2
+    try:
+        assert list(cds_list) == expected
+    finally:
+        CdsList.CHUNK_SIZE = 4096
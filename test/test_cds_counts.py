@@ -0,0 +1,55 @@
+import random
+
+import numpy as np
+
+from cdnu.ccds import CdsPos
+from cdnu.cds_counts import count_cds_codons, load_cds_counts, save_cds_counts
+from cdnu.codons import CODONS, count_codons
+from cdnu.cram import remove_invalid_cds
+
+
+def random_cds_list():
+    rng = random.Random(7)
+    cds_list = [
+        bytearray(''.join(rng.choice('ATCGN-') for _ in range(3 * n + n % 2)),
+                  'ascii')
+        for n in range(1, 40)
+    ]
+    for i in range(0, len(cds_list), 3):
+        cds_list[i][:3] = b'ATG'
+        cds_list[i][-3:] = b'TGA'
+    cds_list[4] = bytearray()
+    ccds_list = [CdsPos('CCDS{}.1'.format(i), [(0, len(cds))], 'chr1')
+                 for i, cds in enumerate(cds_list)]
+    return ccds_list, cds_list
+
+
+def test_count_cds_codons():
+    ccds_list, cds_list = random_cds_list()
+
+    cds_counts = count_cds_codons(ccds_list, cds_list)
+
+    assert cds_counts.ccds_ids[1] == b'CCDS1.1'
+    assert list(cds_counts.valid) == [
+        cds is not None for cds in remove_invalid_cds(cds_list)]
+
+    dense = cds_counts.dense()
+    assert dense.shape == (len(cds_list), len(CODONS))
+    for cds, row in zip(cds_list, dense):
+        assert dict(zip(CODONS, row.tolist())) == count_codons([cds])
+
+    expected = count_codons(remove_invalid_cds(cds_list))
+    assert dict(zip(CODONS, cds_counts.totals().tolist())) == expected
+
+
+def test_save_load_cds_counts(tmpdir):
+    ccds_list, cds_list = random_cds_list()
+    cds_counts = count_cds_codons(ccds_list, cds_list)
+    file_path = str(tmpdir.join('sample.npz'))
+
+    save_cds_counts(file_path, cds_counts)
+    loaded = load_cds_counts(file_path)
+
+    for field in cds_counts._fields:
+        assert np.array_equal(getattr(loaded, field),
+                              getattr(cds_counts, field))
@@ -0,0 +1,50 @@
+from threading import current_thread, main_thread
+
+from cdnu.prefetch import Prefetcher
+from cdnu.record import Record
+from cdnu.result_cache import CachedResult, ResultCache
+from codon_usage import (CHECKPOINT_FILE, iter_with_callback, load_checkpoint,
+                         skip_cached, store_checkpoint)
+
+
+def test_checkpoint_after_crash(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert load_checkpoint([]) == set()
+    store_checkpoint('NA123')
+
+    # Partially written sample name.
+    with open(CHECKPOINT_FILE, 'a') as fp:
+        fp.write('NA12')
+    assert load_checkpoint([]) == {'NA123'}
+
+    store_checkpoint('NA456')
+    assert load_checkpoint([]) == {'NA123', 'NA456'}
+    assert (tmp_path / CHECKPOINT_FILE).read_text() == 'NA123\nNA456\n'
+
+
+def test_skip_cached_in_prefetch_thread(tmp_path):
+    records = [Record('seq{}'.format(i), 'index{}'.format(i), 'S{}'.format(i),
+                      'POP', md5='{:032x}'.format(i)) for i in range(5)]
+    cache = ResultCache(str(tmp_path / 'cache'))
+    for record in records[1::2]:
+        cache.put(record, CachedResult({'numCds': 1}))
+
+    cached = []
+    events = []
+
+    def on_cached(record, result, seconds):
+        # The prefetch thread only hands cached results over.
+        assert current_thread() is not main_thread()
+        cached.append(record.sample_name)
+
+    def store_cached():
+        assert current_thread() is main_thread()
+        events.extend(cached)
+        cached.clear()
+
+    with Prefetcher(skip_cached(records, cache, on_cached), str(tmp_path),
+                    stage=lambda record, directory: directory) as prefetcher:
+        for staged in iter_with_callback(prefetcher, store_cached):
+            events.append(staged.record.sample_name)
+            prefetcher.release(staged)
+    assert sorted(events) == ['S{}'.format(i) for i in range(5)]
@@ -0,0 +1,94 @@
+import random
+from itertools import product
+
+import numpy as np
+
+from cdnu.codons import (CODONS, INVALID_CODON, BatchCodonCounter,
+                         CodonCounter, codon_indexes, count_codons)
+from cdnu.cram import remove_invalid_cds
+
+
+def test_codon_indexes():
+    indexes = codon_indexes(b'AAAATGGGGTN-CCT')
+    assert list(indexes) == [
+        CODONS.index('AAA'), CODONS.index('ATG'), CODONS.index('GGG'),
+        INVALID_CODON, CODONS.index('CCT')
+    ]
+
+
+def test_count_codons():
+    rng = random.Random(3)
+    cds_list = [
+        bytearray(''.join(rng.choice('ATCGN-') for _ in range(3 * n)),
+                  'ascii')
+        for n in range(1, 50)
+    ]
+    cds_list[7] = None
+
+    expected = {''.join(codon): 0 for codon in product('ATCG', repeat=3)}
+    for cds in cds_list:
+        if cds is None:
+            continue
+        for i in range(0, len(cds), 3):
+            triplet = cds[i:i + 3].decode('ascii')
+            if '-' in triplet or 'N' in triplet:
+                continue
+            expected[triplet] += 1
+
+    counts = count_codons(cds_list)
+    assert counts == expected
+    assert list(counts) == list(expected)
+
+
+def test_count_codons_empty():
+    counts = count_codons([None])
+    assert len(counts) == 64
+    assert not any(counts.values())
+
+
+def test_codon_counter():
+    rng = random.Random(5)
+    cds_list = [
+        bytearray(''.join(rng.choice('ATCGN') for _ in range(n)), 'ascii')
+        for n in range(1, 60)
+    ]
+
+    counter = CodonCounter()
+    counter.FLUSH_SIZE = 100
+    for cds in cds_list:
+        counter.add(cds)
+    counter.add(None)
+
+    assert counter.counts() == count_codons(cds_list)
+    assert sum(counter.counts().values()) > 0
+
+
+def test_batch_codon_counter():
+    rng = random.Random(13)
+    samples = []
+    for _ in range(3):
+        cds_list = [
+            bytearray(''.join(rng.choice('ATCGN-') for _ in range(n)),
+                      'ascii')
+            for n in [0, 2, 3, 4, 6] + list(range(30, 50))
+        ]
+        for cds in cds_list[3::2]:
+            cds[:3] = b'ATG'
+            cds[-3:] = rng.choice([b'TAG', b'TAA', b'TGA'])
+        samples.append(cds_list)
+    samples[1][6][:3] = b'ATC'
+    samples[2][3][:] = b'ATGA'
+
+    counter = BatchCodonCounter(len(samples))
+    # CDS are added in two parts.
+    for part in (slice(0, 10), slice(10, None)):
+        lengths = np.array([len(cds) for cds in samples[0][part]])
+        sequences = np.array(
+            [np.frombuffer(b''.join(cds_list[part]), dtype=np.uint8)
+             for cds_list in samples])
+        counter.add(sequences, lengths)
+
+    expected = [remove_invalid_cds(cds_list) for cds_list in samples]
+    assert counter.counts() == [count_codons(cds) for cds in expected]
+    assert counter.processed_cds.tolist() \
+        == [sum(cds is not None for cds in e) for e in expected]
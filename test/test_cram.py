@@ -1,5 +1,26 @@
+import os
+import random
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from pysam import AlignedSegment, AlignmentFile, qualitystring_to_array
+
 from cdnu.ccds import CdsPos, load_ccds
-from cdnu.cram import load_cds_list
+from cdnu.cram import (ConsensusAssembler, find_single_cds, iter_cds_batch,
+                       iter_cds_list, load_block, load_cds_list,
+                       merge_intervals, plan_fetches, reverse_complement,
+                       stream_blocks)
+from cdnu.synthetic import random_genes, random_sequence, write_cram
+
+HUGE_CRAM = os.environ.get('CDNU_HUGE_CRAM')
+"""Path to a local copy of
+ftp://ftp.ncbi.nlm.nih.gov/1000genomes/ftp/1000G_2504_high_coverage/data/
+ERR3239281/NA07051.final.cram (with its index) used by slow tests."""
+requires_huge_cram = pytest.mark.skipif(
+    HUGE_CRAM is None, reason='CDNU_HUGE_CRAM is not set')
 
 
 def test_load_cds_list():
@@ -10,8 +31,8 @@ def test_load_cds_list():
     assert single_cds is not None
     assert len(single_cds) % 3 is 0
     assert len(single_cds) is (33036588 - 33036411)
-    assert single_cds.startswith('ATG')
-    assert single_cds[-3:] in ('TAG', 'TAA', 'TGA')
+    assert single_cds.startswith(b'ATG')
+    assert single_cds[-3:] in (b'TAG', b'TAA', b'TGA')
 
 
 def test_load_cds_list_small():
@@ -21,17 +42,15 @@ def test_load_cds_list_small():
     assert cds[0] is None
 
 
+@requires_huge_cram
 def test_load_cds_list_some():
     ccds = [
         CdsPos('first', [(925941, 926012)], 'chr1'),
         CdsPos('second', [(966531, 966613)], 'chr1'),
         CdsPos('third', [(7784877, 7785004)], 'chr1')
     ]
-    address = ('ftp://ftp.ncbi.nlm.nih.gov/1000genomes/ftp/'
-               '1000G_2504_high_coverage/data/ERR3239281/NA07051.final.cram')
-    address = '/Users/peta/School/mbg/mbg-codon-usage/huge/NA07051.final.cram'
 
-    cds_list = load_cds_list(address, ccds)
+    cds_list = load_cds_list(HUGE_CRAM, ccds)
 
     assert len(cds_list) is 3
     assert cds_list[0] is None
@@ -39,19 +58,343 @@ def test_load_cds_list_some():
     assert cds_list[2] is None
 
 
+@requires_huge_cram
 def test_load_cds_list_huge():
     ccds = load_ccds()
-    address = ('ftp://ftp.ncbi.nlm.nih.gov/1000genomes/ftp/'
-               '1000G_2504_high_coverage/data/ERR3239281/NA07051.final.cram')
-    address = '/Users/peta/School/mbg/mbg-codon-usage/huge/NA07051.final.cram'
 
-    cds_list = load_cds_list(address, ccds[:100])
+    cds_list = load_cds_list(HUGE_CRAM, ccds[:100])
 
     for cds in cds_list:
         if cds is not None:
-            print('{}.. {:4} ..{}'.format(cds[:3], len(cds), cds[-3:]))
+            print('{}.. {:4} ..{}'.format(cds[:3].decode('ascii'), len(cds),
+                                          cds[-3:].decode('ascii')))
             assert len(cds) % 3 is 0
-            assert cds.startswith('ATG')
-            assert cds[-3:] in ('TAG', 'TAA', 'TGA')
+            assert cds.startswith(b'ATG')
+            assert cds[-3:] in (b'TAG', b'TAA', b'TGA')
         else:
             print('None')
+
+
+def test_merge_intervals():
+    assert merge_intervals([(10, 20), (5, 8), (15, 30), (30, 31),
+                            (40, 45)]) == [(5, 8), (10, 31), (40, 45)]
+    assert merge_intervals([]) == []
+
+
+def test_plan_fetches():
+    ccds = [
+        CdsPos('a', [(100, 200), (300, 400)], 'chr1'),
+        CdsPos('b', [(150, 250), (300, 400)], 'chr1'),
+        CdsPos('c', [(100, 200)], 'chr2'),
+    ]
+    assert plan_fetches(ccds) == {
+        'chr1': [(100, 250), (300, 400)],
+        'chr2': [(100, 200)],
+    }
+
+
+def test_load_cds_list_isoforms(tmp_path):
+    rng = random.Random(42)
+    reference = list(random_sequence(3000, rng))
+    reference[1000:1003] = 'ATG'
+    reference[1597:1600] = 'TAA'
+    reference[1897:1900] = 'TGA'
+    reference = ''.join(reference)
+    cram_path = write_cram(str(tmp_path), {'chr1': reference})
+
+    ccds = [
+        CdsPos('first', [(1000, 1300), (1450, 1600)], 'chr1'),
+        CdsPos('second', [(1000, 1300), (1450, 1600)], 'chr1'),
+        CdsPos('third', [(1000, 1102), (1501, 1600), (1801, 1900)], 'chr1'),
+        CdsPos('invalid', [(2950, 2998)], 'chr1'),
+    ]
+    cds_list = load_cds_list(cram_path, ccds)
+    reference = reference.encode('ascii')
+
+    assert cds_list[0] == reference[1000:1300] + reference[1450:1600]
+    assert cds_list[1] == cds_list[0]
+    assert cds_list[2] == (reference[1000:1102] + reference[1501:1600]
+                           + reference[1801:1900])
+    assert cds_list[3] is None
+
+    with AlignmentFile(cram_path, 'rc') as cram:
+        for cds, single_cds in zip(ccds[:3], cds_list):
+            assert find_single_cds(cram, cds) == single_cds
+
+
+def test_load_cds_list_streaming(tmp_path):
+    rng = random.Random(7)
+    references = {
+        'chr1': random_sequence(4000, rng),
+        'chr2': random_sequence(2000, rng),
+    }
+    cram_path = write_cram(str(tmp_path), references)
+
+    ccds = [
+        CdsPos('first', [(120, 330), (500, 710)], 'chr1'),
+        CdsPos('second', [(300, 420), (690, 900), (3400, 3430)], 'chr1'),
+        CdsPos('third', [(3950, 3998)], 'chr1'),
+        CdsPos('fourth', [(0, 99), (1000, 1201)], 'chr2'),
+    ]
+    plan = plan_fetches(ccds)
+
+    with AlignmentFile(cram_path, 'rc') as cram:
+        for molecule, intervals in plan.items():
+            streamed = stream_blocks(cram, molecule, intervals)
+            fetched = [load_block(cram, molecule, start, stop)
+                       for start, stop in intervals]
+            assert streamed == fetched
+
+    assert (load_cds_list(cram_path, ccds, streaming=True)
+            == load_cds_list(cram_path, ccds))
+
+
+def test_stream_blocks_many_intervals():
+    # Reads are fed to overlapping intervals only, thus the time of a sweep
+    # does not grow with the number of intervals.
+    length = 400000
+    # Each read overlaps at most a single interval.
+    reads = [SimpleNamespace(reference_start=start,
+                             reference_end=start + 2)
+             for start in range(0, length, 4)]
+    cram = SimpleNamespace(fetch=lambda **kwargs: iter(reads))
+
+    class CountingAssembler:
+
+        def __init__(self, start, stop):
+            self.start = start
+            self.stop = stop
+            self.done = False
+            self.num_reads = 0
+
+        def feed(self, read):
+            self.num_reads += 1
+
+        def finish(self):
+            return self.num_reads
+
+    def sweep(num_intervals):
+        intervals = [(start, start + 1)
+                     for start in range(0, length, length // num_intervals)]
+        times = []
+        for _ in range(3):
+            start_time = time.perf_counter()
+            fed = stream_blocks(cram, 'chr1', intervals, CountingAssembler)
+            times.append(time.perf_counter() - start_time)
+        assert sum(fed) == num_intervals
+        return min(times)
+
+    assert sweep(20000) < 5 * sweep(100)
+
+
+def test_load_cds_list_parallel(tmp_path):
+    rng = random.Random(11)
+    references = {
+        'chr{}'.format(i): (random_sequence(100, rng) + 'ATG'
+                            + random_sequence(894, rng) + 'TAG'
+                            + random_sequence(500, rng))
+        for i in range(1, 5)
+    }
+    cram_path = write_cram(str(tmp_path), references)
+
+    ccds = [
+        CdsPos('cds{}'.format(i), [(100, 400 + i), (700 + i, 1000)],
+               'chr{}'.format(i % 4 + 1))
+        for i in range(12)
+    ]
+    expected = load_cds_list(cram_path, ccds, streaming=True)
+    assert all(cds is not None for cds in expected)
+    assert load_cds_list(cram_path, ccds, workers=3, threads=2) == expected
+    assert load_cds_list(cram_path, ccds, streaming=True, workers=2) \
+        == expected
+
+
+def aligned_read(start, sequence, cigar, qualities=None):
+    read = AlignedSegment()
+    read.query_name = 'r{}'.format(start)
+    read.query_sequence = sequence
+    read.reference_id = 0
+    read.reference_start = start
+    read.cigarstring = cigar
+    if qualities is not None:
+        read.query_qualities = qualitystring_to_array(qualities)
+    return read
+
+
+def test_consensus_assembler():
+    reads = [
+        aligned_read(8, 'TTACGTACGTAC', '12M', 'I' * 12),
+        # Sequencing error at position 14.
+        aligned_read(10, 'ACGTGCGTAC', '10M', 'I' * 10),
+        # Soft clipped base and a deletion of positions 13 and 14.
+        aligned_read(10, 'GACGCGTA', '1S3M2D4M', 'I' * 8),
+        # Low quality error at position 17.
+        aligned_read(11, 'CGTACGGAC', '9M', 'IIIIII#II'),
+    ]
+
+    assembler = ConsensusAssembler(10, 22, min_base_quality=10)
+    for read in reads:
+        assembler.feed(read)
+    assert assembler.finish() == b'ACGTACGTAC--'
+
+    assembler = ConsensusAssembler(10, 22, min_depth=4, min_base_quality=10)
+    for read in reads:
+        assembler.feed(read)
+    assert assembler.finish() == b'NCGNNCGNAN--'
+
+    # Ties are not called.
+    assembler = ConsensusAssembler(0, 4)
+    assembler.feed(aligned_read(0, 'ACGT', '4M'))
+    assembler.feed(aligned_read(0, 'ACCT', '4M'))
+    assert assembler.finish() == b'ACNT'
+
+
+def test_load_cds_list_consensus(tmp_path):
+    rng = random.Random(13)
+    references = {
+        'chr{}'.format(i): (random_sequence(100, rng) + 'ATG'
+                            + random_sequence(894, rng) + 'TAG'
+                            + random_sequence(500, rng))
+        for i in range(1, 4)
+    }
+    cram_path = write_cram(str(tmp_path), references)
+
+    ccds = [
+        CdsPos('cds{}'.format(i), [(100, 400 + i), (700 + i, 1000)],
+               'chr{}'.format(i % 3 + 1))
+        for i in range(6)
+    ]
+    expected = [
+        bytearray(''.join(references[cds.molecule][a:b]
+                          for a, b in cds.indexes), 'ascii')
+        for cds in ccds
+    ]
+
+    assert load_cds_list(cram_path, ccds, consensus=True) == expected
+    assert load_cds_list(cram_path, ccds, consensus=True, streaming=True,
+                         min_depth=2, min_base_quality=30) == expected
+    assert load_cds_list(cram_path, ccds, consensus=True, workers=2) \
+        == expected
+
+
+def test_iter_cds_list(tmp_path):
+    rng = random.Random(17)
+    references = {
+        'chr{}'.format(i): (random_sequence(100, rng) + 'ATG'
+                            + random_sequence(894, rng) + 'TAG'
+                            + random_sequence(500, rng))
+        for i in range(1, 4)
+    }
+    cram_path = write_cram(str(tmp_path), references)
+
+    # Not grouped by molecule, some molecules are loaded repeatedly.
+    ccds = [
+        CdsPos('cds{}'.format(i), [(100, 400 + i), (700 + i, 1000 + i % 2)],
+               'chr{}'.format(i // 2 % 3 + 1))
+        for i in range(10)
+    ]
+    expected = load_cds_list(cram_path, ccds)
+    assert any(cds is None for cds in expected)
+    assert any(cds is not None for cds in expected)
+
+    for options in ({}, {'streaming': True}, {'workers': 2}):
+        assert list(iter_cds_list(cram_path, ccds, **options)) \
+            == list(zip(ccds, expected))
+    loaded = iter_cds_list(cram_path, ccds, remove_invalid=False)
+    assert [cds for _, cds in loaded] \
+        == load_cds_list(cram_path, ccds, remove_invalid=False)
+
+
+def test_reverse_complement():
+    sequence = bytearray(b'ATGCNRY-acgt')
+    reverse_complement(sequence)
+    assert sequence == bytearray(b'acgt-RYNGCAT')
+
+
+def test_load_cds_list_minus_strand(tmp_path):
+    rng = random.Random(19)
+    # CDS on the - strand: reverse complement of CAT...TTA spliced from
+    # two exons.
+    reference = (random_sequence(200, rng) + 'TTA' + random_sequence(297, rng)
+                 + random_sequence(100, rng) + random_sequence(297, rng)
+                 + 'CAT' + random_sequence(500, rng))
+    cram_path = write_cram(str(tmp_path), {'chr1': reference})
+
+    ccds = [
+        CdsPos('minus', [(200, 500), (600, 900)], 'chr1', '-'),
+        CdsPos('plus', [(200, 500), (600, 900)], 'chr1'),
+    ]
+    plus = reference[200:500] + reference[600:900]
+    expected = bytearray(plus, 'ascii')
+    reverse_complement(expected)
+
+    cds_list = load_cds_list(cram_path, ccds)
+    assert cds_list == [expected, None]
+    assert expected.startswith(b'ATG') and expected.endswith(b'TAA')
+    assert [cds for _, cds in iter_cds_list(cram_path, ccds,
+                                            streaming=True)] == cds_list
+    with AlignmentFile(cram_path, 'rc') as cram:
+        assert find_single_cds(cram, ccds[0]) == expected
+
+
+def test_load_cds_list_counters(tmp_path):
+    rng = random.Random(19)
+    references = {
+        'chr1': random_sequence(3000, rng),
+        'chr2': random_sequence(2000, rng),
+    }
+    cram_path = write_cram(str(tmp_path), references)
+    ccds = [
+        CdsPos('first', [(120, 330), (500, 710)], 'chr1'),
+        CdsPos('second', [(300, 420), (2400, 2430)], 'chr1'),
+        CdsPos('third', [(1000, 1201)], 'chr2'),
+    ]
+
+    counters = Counter()
+    load_cds_list(cram_path, ccds, counters=counters)
+    assert counters['regions'] == 4
+    assert counters['reads'] > 0
+
+    parallel = Counter()
+    load_cds_list(cram_path, ccds, workers=2, counters=parallel)
+    assert parallel == counters
+
+    # Each molecule is fetched once.
+    streamed = Counter()
+    list(iter_cds_list(cram_path, ccds, streaming=True, workers=2,
+                       counters=streamed))
+    assert streamed['regions'] == 2
+
+
+def test_iter_cds_batch(tmp_path):
+    rng = random.Random(29)
+    references, ccds = random_genes(8, 3, rng)
+    cram_paths = []
+    for i, step in enumerate((30, 45, 120)):
+        sample_dir = tmp_path / str(i)
+        sample_dir.mkdir()
+        cram_paths.append(write_cram(str(sample_dir), references, step=step))
+    ccds.sort(key=lambda cds: (cds.molecule, cds.indexes[0][0]))
+
+    for options in ({}, {'consensus': True, 'min_depth': 2}):
+        counters = Counter()
+        batches = list(iter_cds_batch(cram_paths, ccds, counters=counters,
+                                      **options))
+        assert [cds for batch in batches for cds in batch.cds_list] == ccds
+
+        for row, cram_path in enumerate(cram_paths):
+            expected = load_cds_list(cram_path, ccds, remove_invalid=False,
+                                     **options)
+            loaded = []
+            for batch in batches:
+                offsets = np.cumsum([0] + batch.lengths.tolist())
+                loaded.extend(batch.sequences[row, a:b].tobytes()
+                              for a, b in zip(offsets[:-1], offsets[1:]))
+            assert loaded == expected
+            # Reads of the last file do not cover all positions.
+            assert any(b'-' in cds for cds in expected) == (row == 2)
+
+        # Each merged exon is fetched from each file.
+        num_intervals = sum(len(intervals)
+                            for intervals in plan_fetches(ccds).values())
+        assert counters['regions'] == len(cram_paths) * num_intervals
@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+from cdnu import ftp
+from cdnu.ftp import download_file_from_ftp, file_md5, read_url_range
+
+
+@pytest.fixture
+def served_file(tmp_path, http_server):
+    data = os.urandom(300000)
+    served_dir = tmp_path / 'served'
+    served_dir.mkdir()
+    (served_dir / 'data.bin').write_bytes(data)
+    server = http_server(str(served_dir))
+    return server.url + 'data.bin', data
+
+
+def test_read_url_range(served_file):
+    url, data = served_file
+    assert read_url_range(url, 1000, 2500) == data[1000:2500]
+
+
+@pytest.mark.parametrize('segments', [1, 4])
+def test_download(tmp_path, served_file, segments, monkeypatch):
+    monkeypatch.setattr(ftp, 'BUFFER_SIZE', 4096)
+    url, data = served_file
+    file_path = str(tmp_path / 'downloaded.bin')
+
+    download_file_from_ftp(url, file_path, segments=segments,
+                           md5=hashlib.md5(data).hexdigest())
+
+    with open(file_path, 'rb') as fp:
+        assert fp.read() == data
+    assert file_md5(file_path) == hashlib.md5(data).hexdigest()
+    assert sorted(os.listdir(str(tmp_path))) == ['downloaded.bin', 'served']
+
+
+def test_download_resume(tmp_path, served_file):
+    url, data = served_file
+    file_path = str(tmp_path / 'downloaded.bin')
+
+    # Simulate an interrupted download of two segments, the second segment
+    # stored garbage past its stored progress.
+    with open(file_path + '.part', 'wb') as fp:
+        fp.write(data[:1000] + bytes(149000) + data[150000:150500]
+                 + b'x' * 149500)
+    with open(file_path + '.part.json', 'w') as fp:
+        json.dump({'url': url, 'size': len(data),
+                   'segments': [[0, 150000, 1000],
+                                [150000, 300000, 500]]}, fp)
+
+    download_file_from_ftp(url, file_path,
+                           md5=hashlib.md5(data).hexdigest())
+    with open(file_path, 'rb') as fp:
+        assert fp.read() == data
+    assert not os.path.exists(file_path + '.part.json')
+
+
+def test_download_checksum_mismatch(tmp_path, served_file):
+    url, _ = served_file
+    file_path = str(tmp_path / 'downloaded.bin')
+
+    with pytest.raises(IOError):
+        download_file_from_ftp(url, file_path, md5='0' * 32)
+    assert not os.path.exists(file_path)
+    assert not os.path.exists(file_path + '.part')
@@ -0,0 +1,73 @@
+import numpy as np
+import scipy.stats as stats
+
+from cdnu.kruskal import (bootstrap_effect_sizes, kruskal_columns,
+                          permutation_test, rank_columns)
+
+
+def random_data(seed=42):
+    rng = np.random.RandomState(seed)
+    groups = np.array([0] * 6 + [2] * 5 + [1] * 7)
+    rng.shuffle(groups)
+    data = rng.randint(0, 5, size=(len(groups), 8)).astype(np.float64)
+    return data, groups
+
+
+def test_rank_columns():
+    data, _ = random_data()
+    ranks, correction = rank_columns(data)
+    for column in range(data.shape[1]):
+        expected = stats.rankdata(data[:, column])
+        assert np.array_equal(ranks[:, column], expected)
+        assert np.isclose(correction[column], stats.tiecorrect(expected))
+
+
+def test_kruskal_columns():
+    data, groups = random_data()
+
+    h, pvalues = kruskal_columns(data, groups, 3)
+
+    for column in range(data.shape[1]):
+        expected = stats.kruskal(*(data[groups == g, column]
+                                   for g in range(3)))
+        assert np.isclose(h[column], expected.statistic)
+        assert np.isclose(pvalues[column], expected.pvalue)
+
+
+def test_permutation_test():
+    data, groups = random_data()
+    h, pvalues = kruskal_columns(data, groups, 3)
+
+    result = permutation_test(data, groups, 3, 3000, batch_size=700)
+
+    assert np.allclose(result.h, h)
+    assert np.allclose(result.pvalues, pvalues, atol=0.05)
+    assert np.all(result.adjusted_pvalues >= result.pvalues)
+    assert np.all(result.pvalues >= 1 / 3001)
+
+
+def test_permutation_test_reproducible():
+    data, groups = random_data()
+
+    first = permutation_test(data, groups, 3, 500, batch_size=128, seed=1)
+    second = permutation_test(data, groups, 3, 500, batch_size=128, seed=1,
+                              workers=2)
+    third = permutation_test(data, groups, 3, 500, batch_size=128, seed=2)
+
+    assert np.array_equal(first.pvalues, second.pvalues)
+    assert np.array_equal(first.adjusted_pvalues, second.adjusted_pvalues)
+    assert not np.array_equal(first.pvalues, third.pvalues)
+
+
+def test_bootstrap_effect_sizes():
+    data, groups = random_data()
+    h, _ = kruskal_columns(data, groups, 3)
+
+    lower, upper = bootstrap_effect_sizes(data, groups, 3, 300,
+                                          batch_size=64, seed=3)
+
+    assert lower.shape == upper.shape == (data.shape[1],)
+    assert np.all(lower <= upper)
+    assert np.all(lower >= 0)
+    effect_sizes = h / (len(data) - 1)
+    assert np.all((lower <= effect_sizes) & (effect_sizes <= upper))
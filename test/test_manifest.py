@@ -0,0 +1,137 @@
+import time
+from functools import partial
+
+import pytest
+
+from cdnu.manifest import WorkManifest
+from cdnu.record import Record
+from codon_usage import run_jobs
+
+
+def make_records(count):
+    return [Record('ftp://seq{}'.format(i), 'ftp://index{}'.format(i),
+                   'S{}'.format(i), 'POP{}'.format(i % 2))
+            for i in range(count)]
+
+
+def test_claim_order(tmp_path):
+    file_path = str(tmp_path / 'manifest.db')
+    records = make_records(5)
+    manifest = WorkManifest(file_path)
+    assert manifest.add_records(records[:3], completed=['S1']) == 3
+    assert manifest.add_records(records) == 2
+
+    other = WorkManifest(file_path)
+    assert manifest.claim() == records[0]
+    assert other.claim() == records[2]
+    assert list(manifest.iter_claims()) == records[3:]
+    assert manifest.claim() is None
+    assert manifest.counts() == {'pending': 0, 'leased': 4, 'completed': 1,
+                                 'failed': 0}
+
+    other.release('S2')
+    manifest.complete('S0')
+    assert manifest.counts() == {'pending': 1, 'leased': 2, 'completed': 2,
+                                 'failed': 0}
+    assert manifest.claim() == records[2]
+
+
+def test_expired_lease(tmp_path):
+    file_path = str(tmp_path / 'manifest.db')
+    records = make_records(2)
+    crashed = WorkManifest(file_path, lease_seconds=0.05, max_attempts=2)
+    crashed.add_records(records)
+    assert crashed.claim() == records[0]
+    assert crashed.renew('S0')
+
+    time.sleep(0.1)
+    manifest = WorkManifest(file_path, max_attempts=2)
+    assert manifest.counts()['pending'] == 2
+    assert manifest.claim() == records[0]
+    assert not crashed.renew('S0')
+    assert manifest.renew('S0')
+
+    # The record is not claimed again after max_attempts.
+    manifest.lease_seconds = 0
+    assert manifest.claim() == records[1]
+    assert manifest.claim() == records[1]
+    assert manifest.claim() is None
+    assert manifest.counts() == {'pending': 0, 'leased': 1, 'completed': 0,
+                                 'failed': 1}
+
+
+def test_heartbeat(tmp_path):
+    file_path = str(tmp_path / 'manifest.db')
+    records = make_records(3)
+    other = WorkManifest(file_path)
+
+    with WorkManifest(file_path, lease_seconds=0.15) as manifest:
+        manifest.add_records(records)
+        assert manifest.claim() == records[0]
+        assert manifest.claim() == records[1]
+        manifest.complete('S1')
+        time.sleep(0.3)
+        assert other.claim() == records[2]
+        assert other.claim() is None
+
+    # Claimed records which were not completed are handed back.
+    assert other.claim() == records[0]
+
+
+def test_release_is_not_attempt(tmp_path):
+    file_path = str(tmp_path / 'manifest.db')
+    records = make_records(2)
+    WorkManifest(file_path).add_records(records)
+
+    # Records handed back unprocessed at the end of a run are claimed
+    # again by any number of later runs, failed records only
+    # max_attempts times.
+    for _ in range(5):
+        with WorkManifest(file_path, max_attempts=2) as manifest:
+            claimed = manifest.claim()
+            if claimed == records[0]:
+                manifest.fail('S0')
+            else:
+                assert claimed == records[1]
+    counts = WorkManifest(file_path, max_attempts=2).counts()
+    assert counts['pending'] == 1
+    assert counts['failed'] == 1
+
+
+def analyze(record):
+    if record.sample_name == 'S1':
+        raise ValueError('Failing sample.')
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_failing_job(tmp_path, workers):
+    file_path = str(tmp_path / 'manifest.db')
+    records = make_records(4)
+    WorkManifest(file_path).add_records(records)
+
+    for attempt in range(3):
+        with WorkManifest(file_path, max_attempts=2) as manifest:
+            jobs = ((analyze, (record,), record)
+                    for record in manifest.iter_claims())
+            on_completed = partial(_complete, manifest)
+            on_failed = partial(_fail, manifest)
+            if attempt < 2:
+                with pytest.raises(ValueError):
+                    run_jobs(jobs, [], workers, on_completed,
+                             on_failed=on_failed)
+            else:
+                # The failing sample is not claimed anymore.
+                run_jobs(jobs, [], workers, on_completed,
+                         on_failed=on_failed)
+
+    counts = WorkManifest(file_path, max_attempts=2).counts()
+    assert counts == {'pending': 0, 'leased': 0, 'completed': 3,
+                      'failed': 1}
+
+
+def _complete(manifest, record):
+    manifest.complete(record.sample_name)
+
+
+def _fail(manifest, record):
+    manifest.fail(record.sample_name)
@@ -0,0 +1,78 @@
+import json
+import pstats
+import random
+
+from cdnu.ccds import CdsPos
+from cdnu.metrics import MetricsLog, TimedIterator, peak_rss, profiled
+from cdnu.record import Record
+from cdnu.synthetic import random_sequence, write_cram
+from codon_usage import analyze_record
+
+
+def test_metrics_log(tmp_path):
+    file_path = str(tmp_path / 'metrics' / 'run.jsonl')
+    metrics = MetricsLog(file_path)
+    record = Record('', '', 'S1', 'POP')
+    metrics.write('download', 1.5, record, bytes=10)
+    metrics.write('run', 2)
+    MetricsLog().write('download', 1, record)
+
+    with open(file_path, encoding='utf-8') as fp:
+        lines = [json.loads(line) for line in fp]
+    assert [line['stage'] for line in lines] == ['download', 'run']
+    assert lines[0]['sample'] == 'S1'
+    assert lines[0]['population'] == 'POP'
+    assert lines[0]['seconds'] == 1.5
+    assert lines[0]['bytes'] == 10
+    assert 'sample' not in lines[1]
+    assert lines[1]['peak_rss'] >= 1 << 20
+
+
+def test_peak_rss():
+    before = peak_rss()
+    buffer = bytearray(64 << 20)
+    buffer[::4096] = b'x' * len(buffer[::4096])
+    assert peak_rss() >= before
+    assert peak_rss() >= len(buffer)
+
+
+def test_timed_iterator():
+    timed = TimedIterator(range(3))
+    assert list(timed) == [0, 1, 2]
+    assert timed.seconds > 0
+
+
+def test_profiled(tmp_path):
+    file_path = str(tmp_path / 'profile' / 'sample.prof')
+    with profiled(file_path):
+        sorted(random.random() for _ in range(1000))
+    functions = pstats.Stats(file_path).stats
+    assert any(name == '<genexpr>' for _, _, name in functions)
+
+    with profiled(None):
+        pass
+
+
+def test_analyze_record_metrics(tmp_path, monkeypatch):
+    rng = random.Random(3)
+    reference = (random_sequence(100, rng) + 'ATG' + random_sequence(894, rng)
+                 + 'TAG' + random_sequence(500, rng))
+    cram_path = write_cram(str(tmp_path), {'chr1': reference})
+    ccds = [
+        CdsPos('valid', [(100, 400), (700, 1000)], 'chr1'),
+        CdsPos('invalid', [(200, 500)], 'chr1'),
+    ]
+    monkeypatch.chdir(tmp_path)
+    metrics = MetricsLog('metrics.jsonl')
+    analyze_record(cram_path, Record('', '', 'S1', 'POP'), ccds,
+                   {'streaming': True}, metrics=metrics, profile_dir='prof')
+
+    with open('metrics.jsonl', encoding='utf-8') as fp:
+        lines = {line['stage']: line for line in map(json.loads, fp)}
+    assert set(lines) == {'load', 'count', 'store'}
+    assert lines['load']['regions'] == 1
+    assert lines['load']['reads'] > 0
+    assert lines['load']['cds_valid'] == 1
+    assert lines['load']['cds_invalid'] == 1
+    assert lines['count']['codons'] == 200
+    assert (tmp_path / 'prof' / 'S1.prof').exists()
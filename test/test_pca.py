@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from cdnu.pca import randomized_pca
+
+
+def chunks_of(matrix, chunk_rows):
+    def row_chunks():
+        for start in range(0, len(matrix), chunk_rows):
+            yield matrix[start:start + chunk_rows]
+    return row_chunks
+
+
+def exact_pca(matrix, num_components):
+    centered = matrix - matrix.mean(axis=0)
+    u, s, vt = np.linalg.svd(centered, full_matrices=False)
+    variances = np.square(s) / (len(matrix) - 1)
+    return (vt[:num_components], variances[:num_components],
+            variances[:num_components] / variances.sum(),
+            (u * s)[:, :num_components])
+
+
+def assert_equal_up_to_sign(actual, expected, axis):
+    signs = np.sign(np.sum(actual * expected, axis=axis, keepdims=True))
+    np.testing.assert_allclose(actual * signs, expected, atol=1e-8)
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 7, 100])
+def test_randomized_pca_exact(chunk_rows):
+    rng = np.random.RandomState(3)
+    matrix = rng.normal(size=(40, 8)) * np.arange(1, 9) + 5
+
+    pca = randomized_pca(chunks_of(matrix, chunk_rows), num_components=3)
+    components, variances, ratios, embedding = exact_pca(matrix, 3)
+
+    np.testing.assert_allclose(pca.mean, matrix.mean(axis=0))
+    np.testing.assert_allclose(pca.explained_variance, variances)
+    np.testing.assert_allclose(pca.explained_variance_ratio, ratios)
+    assert_equal_up_to_sign(pca.components, components, axis=1)
+    assert_equal_up_to_sign(pca.embedding, embedding, axis=0)
+    np.testing.assert_allclose(
+        pca.embedding, (matrix - pca.mean) @ pca.components.T, atol=1e-8)
+    assert np.all(pca.components[
+        np.arange(3), np.argmax(np.abs(pca.components), axis=1)] > 0)
+
+
+def test_randomized_pca_wide():
+    # More features than oversampled components, the matrix has
+    # a dominant low rank structure.
+    rng = np.random.RandomState(5)
+    factors = rng.normal(size=(60, 2)) * [10, 5]
+    matrix = factors @ rng.normal(size=(2, 500)) \
+        + rng.normal(scale=0.01, size=(60, 500))
+
+    pca = randomized_pca(chunks_of(matrix, 16), num_components=2)
+    components, variances, ratios, embedding = exact_pca(matrix, 2)
+
+    np.testing.assert_allclose(pca.explained_variance, variances, rtol=1e-6)
+    np.testing.assert_allclose(pca.explained_variance_ratio, ratios,
+                               rtol=1e-6)
+    signs = np.sign(np.sum(pca.components * components, axis=1))
+    np.testing.assert_allclose(pca.components * signs[:, np.newaxis],
+                               components, atol=1e-6)
+
+
+def test_randomized_pca_invalid():
+    matrix = np.ones((5, 3))
+    with pytest.raises(ValueError):
+        randomized_pca(chunks_of(matrix, 2), num_components=4)
+    with pytest.raises(ValueError):
+        randomized_pca(chunks_of(matrix[:1], 2), num_components=1)
+    with pytest.raises(ValueError):
+        randomized_pca(lambda: iter(()))
@@ -0,0 +1,159 @@
+import os
+import time
+from threading import Thread
+from urllib.request import urlretrieve
+
+import pytest
+
+from cdnu.prefetch import Prefetcher
+from cdnu.record import Record
+from codon_usage import iter_batches, run_jobs
+
+
+@pytest.fixture
+def http_url(http_server):
+    return http_server(os.path.dirname(__file__)).url
+
+
+def make_records(http_url, count):
+    return [
+        Record(seq_url=http_url + 'cramExample.cram',
+               index_url=http_url + 'cramExample.cram.crai',
+               sample_name='sample{}'.format(i), population='POP')
+        for i in range(count)
+    ]
+
+
+def test_prefetcher(tmp_path, http_url):
+    records = make_records(http_url, 4)
+    expected_size = (os.path.getsize('test/cramExample.cram')
+                     + os.path.getsize('test/cramExample.cram.crai'))
+
+    with Prefetcher(records, str(tmp_path), max_records=2,
+                    download=urlretrieve) as prefetcher:
+        staged_list = []
+        for staged in prefetcher:
+            staged_list.append(staged)
+            assert os.path.exists(staged.seq_file_path)
+            assert os.path.exists(staged.seq_file_path + '.crai')
+            assert staged.size == expected_size
+
+            time.sleep(0.1)
+            # Back-pressure: at most two records are staged at a time.
+            assert len(os.listdir(str(tmp_path))) <= 2
+
+            prefetcher.release(staged)
+            assert not os.path.exists(staged.directory)
+
+    assert [s.record for s in staged_list] == records
+
+
+def test_prefetcher_max_bytes(tmp_path, http_url):
+    records = make_records(http_url, 3)
+    with Prefetcher(records, str(tmp_path), max_records=3, max_bytes=1,
+                    download=urlretrieve) as prefetcher:
+        for staged in prefetcher:
+            time.sleep(0.1)
+            # A single record exceeds the limit, thus nothing else is
+            # downloaded until the record is released.
+            assert os.listdir(str(tmp_path)) == [staged.record.sample_name]
+            prefetcher.release(staged)
+
+
+def test_prefetcher_error(tmp_path, http_url):
+    records = make_records(http_url + 'missing/', 2)
+    with Prefetcher(records, str(tmp_path),
+                    download=urlretrieve) as prefetcher:
+        with pytest.raises(IOError):
+            list(prefetcher)
+
+
+def stage_file(record, directory):
+    file_path = os.path.join(directory, 'seq.cram')
+    with open(file_path, 'wb') as fp:
+        fp.write(b'x' * 10)
+    return file_path
+
+
+def test_prefetcher_needs_release(tmp_path):
+    records = [Record('', '', 'sample{}'.format(i), 'POP') for i in range(4)]
+    with Prefetcher(records, str(tmp_path), max_records=2,
+                    stage=stage_file) as prefetcher:
+        staged = iter(prefetcher)
+        first = next(staged)
+        assert not prefetcher.needs_release()
+        second = next(staged)
+        assert prefetcher.needs_release()
+
+        prefetcher.release(first)
+        assert not prefetcher.needs_release()
+        third = next(staged)
+        assert prefetcher.needs_release()
+
+        prefetcher.release(second)
+        fourth, = staged
+        # No other record is left.
+        assert not prefetcher.needs_release()
+        prefetcher.release(third)
+        prefetcher.release(fourth)
+
+
+def read_staged(staged):
+    with open(staged.seq_file_path, 'rb') as fp:
+        return fp.read()
+
+
+def test_run_jobs_more_workers_than_prefetch(tmp_path):
+    records = [Record('', '', 'sample{}'.format(i), 'POP') for i in range(6)]
+    completed = []
+
+    def run():
+        with Prefetcher(records, str(tmp_path), max_records=2,
+                        stage=stage_file) as prefetcher:
+            def on_completed(staged):
+                prefetcher.release(staged)
+                completed.append(staged.record)
+
+            jobs = ((read_staged, (staged,), staged) for staged in prefetcher)
+            run_jobs(jobs, [], 3, on_completed,
+                     lambda: not prefetcher.needs_release())
+
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(60)
+    assert not thread.is_alive()
+    assert sorted(completed) == records
+
+
+def test_run_jobs_partial_batches(tmp_path):
+    records = [Record('', '', 'sample{}'.format(i), 'POP') for i in range(7)]
+    batches = []
+
+    def run():
+        with Prefetcher(records, str(tmp_path), max_records=3,
+                        stage=stage_file) as prefetcher:
+            def on_completed(batch):
+                for staged in batch:
+                    prefetcher.release(staged)
+                batches.append([staged.record for staged in batch])
+
+            jobs = (
+                (len, (batch,), batch)
+                for batch in iter_batches(prefetcher, 2,
+                                          prefetcher.needs_release)
+            )
+            run_jobs(jobs, [], 2, on_completed,
+                     lambda: not prefetcher.needs_release())
+
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(60)
+    assert not thread.is_alive()
+    assert sorted(r for batch in batches for r in batch) == records
+    assert all(1 <= len(batch) <= 2 for batch in batches)
+
+
+def test_iter_batches():
+    assert list(iter_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(iter_batches(range(5), 3, lambda: True)) \
+        == [[0], [1], [2], [3], [4]]
@@ -0,0 +1,76 @@
+import hashlib
+import random
+
+import pytest
+
+from cdnu.ccds import CdsPos
+from cdnu.cram import load_cds_list
+from cdnu.reference import (normalize_sequence, populate_ref_cache,
+                            ref_cache_path, reference_md5, use_ref_cache,
+                            write_reference_subset)
+from cdnu.synthetic import random_sequence, write_cram
+
+
+@pytest.fixture
+def references():
+    rng = random.Random(23)
+    return {
+        'chr1': random_sequence(2000, rng),
+        'chr2': random_sequence(1500, rng),
+        'chrUn': random_sequence(500, rng),
+    }
+
+
+def test_reference_md5():
+    assert normalize_sequence(b'acgT N\tn*') == b'ACGTNN*'
+    assert reference_md5(b'acgt\n') == hashlib.md5(b'ACGT').hexdigest()
+
+
+def test_populate_ref_cache(tmp_path, references):
+    write_cram(str(tmp_path), references)
+    fasta_path = str(tmp_path / 'reference.fa')
+    cache_dir = str(tmp_path / 'cache')
+
+    stored = populate_ref_cache(fasta_path, cache_dir, ['chr1', 'chr2'])
+    assert stored == [
+        (name, reference_md5(references[name].encode('ascii')))
+        for name in ('chr1', 'chr2')
+    ]
+    for name, md5 in stored:
+        with open(ref_cache_path(cache_dir, md5), 'rb') as fp:
+            assert fp.read() == references[name].encode('ascii')
+
+    assert populate_ref_cache(fasta_path, cache_dir) == stored + [
+        ('chrUn', reference_md5(references['chrUn'].encode('ascii')))]
+
+
+def test_load_cds_list_with_reference(tmp_path, monkeypatch, references):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    cram_path = write_cram(str(data_dir), references, embed_reference=False)
+    fasta_path = str(data_dir / 'reference.fa')
+    ccds = [
+        CdsPos('first', [(100, 400), (700, 1000)], 'chr1'),
+        CdsPos('second', [(200, 500)], 'chr2', '-'),
+    ]
+    expected = load_cds_list(cram_path, ccds, remove_invalid=False,
+                             reference=fasta_path)
+    assert expected[0] == (references['chr1'][100:400]
+                           + references['chr1'][700:1000]).encode('ascii')
+
+    subset_path = str(tmp_path / 'subset.fa')
+    assert write_reference_subset(fasta_path, subset_path,
+                                  ['chr1', 'chr2']) == ['chr1', 'chr2']
+    assert load_cds_list(cram_path, ccds, remove_invalid=False,
+                         reference=subset_path, workers=2) == expected
+
+    # Sequences are looked up only in the cache.
+    cache_dir = str(tmp_path / 'cache')
+    populate_ref_cache(fasta_path, cache_dir)
+    (data_dir / 'reference.fa').unlink()
+    (data_dir / 'reference.fa.fai').unlink()
+    monkeypatch.setenv('REF_PATH', '')
+    monkeypatch.setenv('REF_CACHE', '')
+    use_ref_cache(cache_dir)
+    assert load_cds_list(cram_path, ccds, remove_invalid=False,
+                         streaming=True) == expected
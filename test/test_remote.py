@@ -0,0 +1,56 @@
+import os
+import random
+
+from cdnu.ccds import CdsPos
+from cdnu.cram import load_cds_list, load_molecules, plan_fetches
+from cdnu.remote import (CraiEntry, RangeCache, format_crai,
+                         load_remote_cds_list, parse_crai)
+from cdnu.synthetic import random_sequence, write_cram
+
+
+def test_crai_round_trip():
+    entries = [CraiEntry(0, 1, 3070, 224, 180, 1020),
+               CraiEntry(-1, 0, 0, 1444, 180, 998)]
+    assert parse_crai(format_crai(entries)) == entries
+
+
+def test_load_remote_cds_list(tmp_path, http_server):
+    rng = random.Random(9)
+    references = {
+        'chr1': random_sequence(30000, rng),
+        'chr2': random_sequence(10000, rng),
+    }
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    cram_path = write_cram(str(data_dir), references, reads_per_slice=50)
+    server = http_server(str(data_dir))
+    seq_url = server.url + os.path.basename(cram_path)
+
+    ccds = [
+        CdsPos('first', [(2000, 2300), (2600, 2900)], 'chr1'),
+        CdsPos('second', [(20000, 20150)], 'chr1'),
+        CdsPos('third', [(5000, 5090)], 'chr2'),
+    ]
+    expected = load_cds_list(cram_path, ccds)
+    plan = plan_fetches(ccds)
+    expected_blocks = load_molecules(cram_path, plan)
+    assert all(b'-' not in block
+               for _, blocks in expected_blocks for block in blocks)
+
+    cache_dir = str(tmp_path / 'cache')
+    for i in range(2):
+        work_dir = tmp_path / 'work{}'.format(i)
+        work_dir.mkdir()
+        cache = RangeCache(cache_dir)
+        cds_list = load_remote_cds_list(
+            seq_url, seq_url + '.crai', ccds, str(work_dir), cache=cache)
+        assert cds_list == expected
+
+        staged_path = str(work_dir / 'regions.cram')
+        assert load_molecules(staged_path, plan) == expected_blocks
+
+        if i == 0:
+            bytes_downloaded = cache.bytes_downloaded
+            assert 0 < bytes_downloaded < os.path.getsize(cram_path) / 4
+        else:
+            assert cache.bytes_downloaded == 0
@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+
+from cdnu.ccds import CdsPos
+from cdnu.cds_counts import count_cds_codons
+from cdnu.record import Record
+from cdnu.result_cache import (CachedResult, ResultCache, ccds_digest,
+                               package_sources)
+
+CCDS = [
+    CdsPos('CCDS1.1', [(0, 9)], 'chr1'),
+    CdsPos('CCDS2.1', [(20, 26), (30, 33)], 'chr1', '-'),
+]
+
+
+def make_record(i, md5=True):
+    return Record('ftp://seq{}'.format(i), 'ftp://index{}'.format(i),
+                  'S{}'.format(i), 'POP',
+                  md5='{:032x}'.format(i) if md5 else None)
+
+
+def test_key():
+    cache = ResultCache('cache', ccds_list=CCDS, parameters={'a': 1})
+    record = make_record(1)
+    assert cache.key(record) == cache.key(
+        record._replace(sample_name='other', md5=record.md5.upper()))
+    assert cache.key(record) != cache.key(make_record(2))
+    assert cache.key(make_record(1, md5=False)) is None
+
+    for other in (ResultCache('cache', ccds_list=CCDS, parameters={'a': 2}),
+                  ResultCache('cache', ccds_list=CCDS[:1],
+                              parameters={'a': 1})):
+        assert other.key(record) != cache.key(record)
+    assert ccds_digest(CCDS) != ccds_digest(CCDS[::-1])
+
+
+def test_key_sources(tmp_path):
+    source = tmp_path / 'source.py'
+    source.write_text('VERSION = 1\n')
+    record = make_record(1)
+    key = ResultCache('cache', sources=[str(source)]).key(record)
+    assert ResultCache('cache', sources=[str(source)]).key(record) == key
+
+    # Results are not reused once the code computing them changes.
+    source.write_text('VERSION = 2\n')
+    assert ResultCache('cache', sources=[str(source)]).key(record) != key
+    assert ResultCache('cache').key(record) == ResultCache(
+        'cache', sources=package_sources()).key(record)
+    assert any(path.endswith('cram.py') for path in package_sources())
+
+
+def test_get_put(tmp_path):
+    cache = ResultCache(str(tmp_path), ccds_list=CCDS)
+    record = make_record(1)
+    assert cache.get(record) is None
+
+    cds_counts = count_cds_codons(CCDS, [b'ATGAAATAG', b'ATGCCCTGA'])
+    cache.put(record, CachedResult({'numCds': 2}, cds_counts))
+    cache.put(make_record(2), CachedResult({'numCds': 1}))
+    cache.put(make_record(3, md5=False), CachedResult({'numCds': 3}))
+
+    cached = cache.get(record)
+    assert cached.sample_json == {'numCds': 2}
+    for field, array in zip(cached.cds_counts, cds_counts):
+        assert np.array_equal(field, array)
+    assert cache.get(make_record(2)) == CachedResult({'numCds': 1})
+    assert cache.get(make_record(3, md5=False)) is None
+
+
+def test_evict(tmp_path):
+    cache = ResultCache(str(tmp_path), ccds_list=CCDS)
+    records = [make_record(i) for i in range(4)]
+    for i, record in enumerate(records):
+        cache.put(record, CachedResult({'numCds': i}))
+        path = cache._path(record)
+        os.utime(path, (i, i))
+    size = os.path.getsize(path)
+
+    # The oldest result becomes the most recently used one.
+    cache.get(records[0])
+    cache.max_bytes = 2 * size
+    cache.evict()
+    assert [cache.get(r) is not None for r in records] \
+        == [True, False, False, True]
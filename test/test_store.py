@@ -0,0 +1,155 @@
+import io
+import json
+import os
+import tarfile
+
+import numpy as np
+
+from cdnu.codons import CODONS
+from cdnu.store import (AGGREGATE_FILE, SAMPLES_FILE, Aggregate, append_sample,
+                        import_stats, is_store, load_aggregate, load_store,
+                        rebuild_aggregate)
+
+
+def sample_json(seed):
+    return {
+        'triplets': {c: seed * 100 + i for i, c in enumerate(CODONS)},
+        'numCds': 10 + seed,
+        'numProcessedCds': seed,
+    }
+
+
+def test_append_and_load(tmp_path):
+    store_path = str(tmp_path / 'stats.store')
+    assert not is_store(store_path)
+
+    append_sample(store_path, 'S1', 'GBR', sample_json(1))
+    append_sample(store_path, 'S2', 'YRI', sample_json(2))
+    append_sample(store_path, 'S3', 'GBR', sample_json(3))
+    assert is_store(store_path)
+
+    matrix = load_store(store_path)
+    assert matrix.sample_names == ['S1', 'S2', 'S3']
+    assert matrix.population_names == ['GBR', 'YRI']
+    assert matrix.populations.tolist() == [0, 1, 0]
+    assert matrix.counts.shape == (3, 64)
+    assert matrix.counts[1].tolist() == list(range(200, 264))
+    assert matrix.num_cds.tolist() == [11, 12, 13]
+    assert matrix.num_processed_cds.tolist() == [1, 2, 3]
+
+    # A sample stored again replaces the previous one.
+    append_sample(store_path, 'S1', 'GBR', sample_json(4))
+    matrix = load_store(store_path)
+    assert matrix.sample_names == ['S2', 'S3', 'S1']
+    assert matrix.counts[2, 0] == 400
+
+
+def test_append_after_crash(tmp_path):
+    store_path = str(tmp_path / 'stats.store')
+    append_sample(store_path, 'S1', 'GBR', sample_json(1))
+
+    # Partially written sample line.
+    with open(os.path.join(store_path, SAMPLES_FILE), 'a') as fp:
+        fp.write('S2\tGB')
+    assert load_store(store_path).sample_names == ['S1']
+
+    append_sample(store_path, 'S3', 'YRI', sample_json(3))
+    matrix = load_store(store_path)
+    assert matrix.sample_names == ['S1', 'S3']
+    assert matrix.counts[:, 0].tolist() == [100, 300]
+
+
+def test_import_stats(tmp_path):
+    stats_dir = tmp_path / 'stats'
+    tar_path = str(tmp_path / 'stats.tar.gz')
+    with tarfile.open(tar_path, 'w:gz') as tar:
+        for i, population in enumerate(('GBR', 'YRI', 'GBR')):
+            population_dir = stats_dir / population
+            population_dir.mkdir(parents=True, exist_ok=True)
+            data = json.dumps(sample_json(i)).encode('utf-8')
+            (population_dir / 'S{}.json'.format(i)).write_bytes(data)
+
+            info = tarfile.TarInfo('stats/{}/S{}.json'.format(population, i))
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    for source in (str(stats_dir), tar_path):
+        store_path = str(tmp_path / (os.path.basename(source) + '.store'))
+        assert import_stats(source, store_path) == 3
+        matrix = load_store(store_path)
+        assert sorted(matrix.sample_names) == ['S0', 'S1', 'S2']
+        assert sorted(matrix.population_names) == ['GBR', 'YRI']
+        for name, row in zip(matrix.sample_names, matrix.counts):
+            seed = int(name[1:])
+            assert np.array_equal(row, np.arange(64) + seed * 100)
+
+
+def random_sample_json(rng):
+    counts = rng.randint(1, 1000, len(CODONS)).tolist()
+    return {
+        'triplets': dict(zip(CODONS, counts)),
+        'numCds': 10,
+        'numProcessedCds': 9,
+    }
+
+
+def check_aggregate(aggregate, matrix):
+    usage = 1000 * matrix.counts / matrix.counts.sum(axis=1, keepdims=True)
+    assert aggregate.population_names == matrix.population_names
+    assert np.allclose(aggregate.total_variances(), usage.var(axis=0, ddof=1))
+    for index in range(len(matrix.population_names)):
+        population_usage = usage[matrix.populations == index]
+        assert aggregate.num_samples[index] == len(population_usage)
+        assert np.allclose(aggregate.mean[index],
+                           population_usage.mean(axis=0))
+        assert np.allclose(aggregate.variances()[index],
+                           population_usage.var(axis=0, ddof=1))
+    assert np.allclose(aggregate.mean_usage(),
+                       1000 * matrix.counts.sum(axis=0) / matrix.counts.sum())
+
+
+def test_aggregate(tmp_path):
+    store_path = str(tmp_path / 'stats.store')
+    rng = np.random.RandomState(5)
+    for i in range(20):
+        population = ('GBR', 'YRI', 'FIN')[i % 3]
+        append_sample(store_path, 'S{}'.format(i), population,
+                      random_sample_json(rng))
+    # Replace samples, one of them moves to another population.
+    append_sample(store_path, 'S4', 'YRI', random_sample_json(rng))
+    append_sample(store_path, 'S5', 'GBR', random_sample_json(rng))
+
+    matrix = load_store(store_path)
+    aggregate = load_aggregate(store_path)
+    assert aggregate.rows == 22
+    check_aggregate(aggregate, matrix)
+    check_aggregate(Aggregate.from_matrix(matrix), matrix)
+
+    # Aggregate not updated after the last append (e.g. due to a crash).
+    os.remove(os.path.join(store_path, AGGREGATE_FILE))
+    check_aggregate(load_aggregate(store_path), matrix)
+    check_aggregate(rebuild_aggregate(store_path), matrix)
+    assert os.path.exists(os.path.join(store_path, AGGREGATE_FILE))
+
+
+def test_aggregate_empty_sample(tmp_path):
+    store_path = str(tmp_path / 'stats.store')
+    rng = np.random.RandomState(6)
+    empty = {'triplets': {c: 0 for c in CODONS}, 'numCds': 10,
+             'numProcessedCds': 0}
+    append_sample(store_path, 'S0', 'GBR', random_sample_json(rng))
+    append_sample(store_path, 'S1', 'GBR', empty)
+    append_sample(store_path, 'S2', 'GBR', random_sample_json(rng))
+    append_sample(store_path, 'S3', 'YRI', empty)
+
+    # Samples without codons are skipped.
+    aggregate = load_aggregate(store_path)
+    assert aggregate.population_names == ['GBR']
+    assert aggregate.num_samples.tolist() == [2]
+    assert np.all(np.isfinite(aggregate.mean))
+    assert np.all(np.isfinite(aggregate.m2))
+
+    append_sample(store_path, 'S1', 'GBR', random_sample_json(rng))
+    append_sample(store_path, 'S3', 'GBR', random_sample_json(rng))
+    aggregate = load_aggregate(store_path)
+    check_aggregate(aggregate, load_store(store_path))